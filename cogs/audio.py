@@ -2,7 +2,6 @@ import asyncio
 import audioop
 import os
 import random
-import subprocess
 import tempfile
 from collections import deque
 from concurrent.futures import ThreadPoolExecutor
@@ -18,6 +17,7 @@ from discord.ext import commands
 from gtts import gTTS
 
 import bot_info
+from media_services import FFMPEG_SCHEDULER, MEDIA_PROBE, TEMP_STORAGE
 
 
 class MixerAudioSource(discord.AudioSource):
@@ -165,9 +165,10 @@ class Audio(commands.Cog):
         self.guild_states: Dict[int, GuildMusicState] = {}
         self.paused_times: Dict[int, datetime] = {}
         self.executor = ThreadPoolExecutor(max_workers=5)
+        self.temp_lease = TEMP_STORAGE.lease("audio")
         self.ydl_options = {
             "format": "bestaudio/best",
-            "outtmpl": f"{os.path.join(tempfile.gettempdir())}/%(extractor)s-%(id)s-%(title)s.%(ext)s",
+            "outtmpl": f"{self.temp_lease.path}/%(extractor)s-%(id)s-%(title)s.%(ext)s",
             "restrictfilenames": True,
             "quiet": True,
             "no_warnings": True,
@@ -190,6 +191,8 @@ class Audio(commands.Cog):
                 if vc := guild.voice_client:
                     await vc.disconnect()
         self.executor.shutdown(wait=False)
+        self.temp_lease.release()
+        await asyncio.to_thread(MEDIA_PROBE.save)
 
     def get_state(self, guild_id: int) -> GuildMusicState:
         if guild_id not in self.guild_states:
@@ -258,47 +261,36 @@ class Audio(commands.Cog):
             )
 
     async def fetch_yt_info(self, url: str, download: bool = False) -> Dict:
+        options = self.ydl_options
+        if download:
+            # tracks that are known not to fit are refused before writing
+            await self.temp_lease.refresh()
+            options = {**options, "max_filesize": self.temp_lease.headroom()}
+
         def sync_extract():
-            with yt_dlp.YoutubeDL(self.ydl_options) as ydl:
+            with yt_dlp.YoutubeDL(options) as ydl:
                 return ydl.extract_info(url, download=download)
 
-        return await self.run_in_executor(sync_extract)
+        info = await self.run_in_executor(sync_extract)
+        if download:
+            await self.temp_lease.refresh()
+            self.temp_lease.ensure()
+            # the lease lives as long as the cog; only what is on disk counts
+            self.temp_lease.trim()
+        return info
 
     async def get_duration_ffprobe(self, target: Optional[str]) -> float:
         if not target:
             return 0.0
 
-        def sync_probe() -> float:
-            try:
-                result = subprocess.run(
-                    [
-                        "ffprobe",
-                        "-v",
-                        "error",
-                        "-show_entries",
-                        "format=duration",
-                        "-of",
-                        "default=noprint_wrappers=1:nokey=1",
-                        target,
-                    ],
-                    capture_output=True,
-                    text=True,
-                    timeout=20,
-                )
-                duration_str = result.stdout.strip()
-                if not duration_str:
-                    return 0.0
-                duration = float(duration_str)
-                return duration if duration > 0 else 0.0
-            except (
-                subprocess.TimeoutExpired,
-                ValueError,
-                FileNotFoundError,
-                OSError,
-            ):
-                return 0.0
-
-        return await self.run_in_executor(sync_probe)
+        success, data = await MEDIA_PROBE.probe(target)
+        if not success:
+            return 0.0
+        try:
+            duration = float(data.get("format", {}).get("duration", 0))
+        except (ValueError, TypeError):
+            return 0.0
+        return duration if duration > 0 else 0.0
 
     async def connect_to_channel(self, ctx: commands.Context) -> bool:
         if not ctx.author.voice:
@@ -389,7 +381,9 @@ class Audio(commands.Cog):
             }
 
     def _generate_tts_file(self, text: str, language: Optional[str]) -> str:
-        fp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
+        fp = tempfile.NamedTemporaryFile(
+            delete=False, suffix=".mp3", dir=self.temp_lease.path
+        )
         filename = fp.name
         fp.close()
         lang = language if language else "en"
@@ -413,6 +407,7 @@ class Audio(commands.Cog):
             ffmpeg_opts["options"] += f' -af "{",".join(filters)}"'
 
         source = discord.FFmpegPCMAudio(filename, **ffmpeg_opts)
+        FFMPEG_SCHEDULER.track_realtime(source)
         source = discord.PCMVolumeTransformer(source, volume=1.0)
 
         state.is_tts_playing = True
@@ -641,6 +636,7 @@ class Audio(commands.Cog):
                 stream_url,
                 **ffmpeg_opts,
             )
+            FFMPEG_SCHEDULER.track_realtime(source)
         else:
             if file_path and os.path.exists(file_path):
                 actual_file_path = file_path
@@ -660,6 +656,7 @@ class Audio(commands.Cog):
                 actual_file_path,
                 **ffmpeg_opts,
             )
+            FFMPEG_SCHEDULER.track_realtime(source)
         source = discord.PCMVolumeTransformer(source, volume=state.volume)
 
         probe_target = stream_url if is_stream else actual_file_path
@@ -775,6 +772,8 @@ class Audio(commands.Cog):
                 await asyncio.to_thread(os.remove, file_path)
             except Exception:
                 pass
+            await self.temp_lease.refresh()
+            self.temp_lease.trim()
 
         await self.play_next(ctx, guild_id)
 
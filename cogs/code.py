@@ -1,7 +1,9 @@
 import asyncio
+import os
 import re
+import tempfile
 import time
-from io import BytesIO
+from pathlib import Path
 from typing import List
 
 import aiohttp
@@ -9,6 +11,8 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+from media_services import download_to_path, stream_attachment
+
 LANGUAGE_ALIASES: dict[str, str] = {
     "py": "python",
     "python": "python",
@@ -222,10 +226,9 @@ class Code(commands.Cog):
 
         if files:
             for file in files:
-                file_bytes = await file.read()
                 data.add_field(
                     "files",
-                    BytesIO(file_bytes),
+                    stream_attachment(self.session, file),
                     filename=file.filename,
                     content_type=file.content_type or "application/octet-stream",
                 )
@@ -294,15 +297,18 @@ class Code(commands.Cog):
                 file_objs = []
                 for filename in result["files"][:10]:
                     file_url = f"http://localhost:8000/files/{job_id}/{filename}"
+                    fd, temp_path = tempfile.mkstemp(suffix=Path(filename).suffix)
+                    os.close(fd)
                     try:
-                        async with self.session.get(file_url) as resp:
-                            if resp.status == 200:
-                                file_data = await resp.read()
-                                file_objs.append(
-                                    discord.File(BytesIO(file_data), filename=filename)
-                                )
+                        if await download_to_path(
+                            self.session, file_url, Path(temp_path)
+                        ):
+                            file_objs.append(discord.File(temp_path, filename=filename))
                     except Exception as e:
                         output += f"\nFailed to fetch {filename}: {str(e)}"
+                    finally:
+                        # discord.File keeps its own handle open until it is sent
+                        Path(temp_path).unlink(missing_ok=True)
 
                 await send(embed=input_embed)
                 if file_objs:
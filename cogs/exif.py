@@ -1,5 +1,3 @@
-import asyncio
-import json
 import mimetypes
 import os
 import tempfile
@@ -11,11 +9,16 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+from media_services import MEDIA_PROBE
+
 
 class Exif(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    def cog_unload(self):
+        MEDIA_PROBE.save()
+
     @commands.hybrid_command(
         name="exif",
         description="Use FFprobe to extract exif metadata from media.",
@@ -155,25 +158,9 @@ class Exif(commands.Cog):
 
     async def get_metadata(self, file_path: str) -> dict:
         try:
-            cmd = [
-                "ffprobe",
-                "-v",
-                "error",
-                "-show_entries",
-                "format=duration,size,format_name,format_long_name,bit_rate,format_tags:stream=codec_name,codec_type,codec_tag_string,codec_tag,codec_long_name,width,height,duration,bit_rate:side_data_list:format_tags:stream_tags",
-                "-print_format",
-                "json",
-                file_path,
-            ]
-            result = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await result.communicate()
-
-            if result.returncode != 0:
-                raise ValueError(f"FFprobe error: {stderr}")
-
-            metadata = json.loads(stdout)
+            success, metadata = await MEDIA_PROBE.probe(file_path)
+            if not success:
+                raise ValueError(metadata)
 
             flat_metadata = {}
 
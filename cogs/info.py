@@ -13,6 +13,8 @@ from discord.ext import commands
 from PIL import Image, ImageDraw
 from webcolors import hex_to_name, name_to_hex
 
+from media_services import RENDER_POOL
+
 
 class Info(commands.Cog):
     def __init__(self, bot):
@@ -44,15 +46,16 @@ class Info(commands.Cog):
 
         return colors, positions
 
+    @classmethod
     def generate_gradient_image(
-        self, colors, positions, width=800, height=100, background=(255, 255, 255)
+        cls, colors, positions, width=800, height=100, background=(255, 255, 255)
     ):
         gradient = Image.new("RGBA", (width, height))
         draw = ImageDraw.Draw(gradient)
         positions = [round(pos * width / 100) for pos in positions]
         for i in range(len(colors) - 1):
-            start_color = self.parse_color(colors[i])
-            end_color = self.parse_color(colors[i + 1])
+            start_color = cls.parse_color(colors[i])
+            end_color = cls.parse_color(colors[i + 1])
             start_x = positions[i]
             end_x = positions[i + 1]
             for x in range(start_x, end_x):
@@ -67,6 +70,12 @@ class Info(commands.Cog):
                 draw.line([(x, 0), (x, height)], (blended_r, blended_g, blended_b, a))
         return gradient
 
+    @classmethod
+    def _gradient_png(cls, colors, positions) -> bytes:
+        buffer = io.BytesIO()
+        cls.generate_gradient_image(colors, positions).save(buffer, "PNG")
+        return buffer.getvalue()
+
     @staticmethod
     def parse_color(color_input):
         if color_input.startswith("#"):
@@ -1103,15 +1112,12 @@ class Info(commands.Cog):
         left = int(cx_px - width / 2)
         top = int(cy_px - height / 2)
 
-        canvas = await asyncio.to_thread(
-            Image.new, "RGB", (cols * TILE_SIZE, rows * TILE_SIZE)
-        )
-
         headers = {
             "User-Agent": "DiscordBot/1.0 (g-man; https://codeberg.org/MiniatureEge2006/g-man)"
         }
         n_tiles = 2**zoom
 
+        tiles = []
         async with aiohttp.ClientSession() as session:
             for row in range(rows):
                 for col in range(cols):
@@ -1122,16 +1128,29 @@ class Info(commands.Cog):
                     tile_url = f"https://tile.openstreetmap.org/{zoom}/{tx}/{ty}.png"
                     async with session.get(tile_url, headers=headers) as resp:
                         if resp.status == 200:
-                            tile_bytes = await resp.read()
-                            tile_img = await asyncio.to_thread(
-                                Image.open, io.BytesIO(tile_bytes)
+                            tiles.append(
+                                (col * TILE_SIZE, row * TILE_SIZE, await resp.read())
                             )
-                            canvas.paste(tile_img, (col * TILE_SIZE, row * TILE_SIZE))
 
-        map_img = canvas.crop((left, top, left + width, top + height))
+        return io.BytesIO(
+            await RENDER_POOL.run(
+                Info._stitch_map,
+                tiles,
+                (cols * TILE_SIZE, rows * TILE_SIZE),
+                (left, top, left + width, top + height),
+            )
+        )
 
-        draw = await asyncio.to_thread(ImageDraw.Draw, map_img)
-        cx, cy = width // 2, height // 2
+    @staticmethod
+    def _stitch_map(tiles: list, canvas_size: tuple, box: tuple) -> bytes:
+        canvas = Image.new("RGB", canvas_size)
+        for x, y, tile_bytes in tiles:
+            with Image.open(io.BytesIO(tile_bytes)) as tile_img:
+                canvas.paste(tile_img, (x, y))
+        map_img = canvas.crop(box)
+
+        draw = ImageDraw.Draw(map_img)
+        cx, cy = map_img.width // 2, map_img.height // 2
         r = 8
         draw.ellipse(
             [cx - r + 2, cy - r + 2, cx + r + 2, cy + r + 2], fill=(0, 0, 0, 120)
@@ -1146,9 +1165,8 @@ class Info(commands.Cog):
         draw.line([(cx - r - 6, cy), (cx + r + 6, cy)], fill=(220, 30, 30), width=2)
 
         buf = io.BytesIO()
-        await asyncio.to_thread(map_img.save, buf, "PNG")
-        buf.seek(0)
-        return buf
+        map_img.save(buf, "PNG")
+        return buf.getvalue()
 
     @staticmethod
     def _wind_direction_label(deg: float) -> str:
@@ -1631,12 +1649,9 @@ class Info(commands.Cog):
                         "You can only create a gradient with up to 10 colors."
                     )
                     return
-            gradient = await asyncio.to_thread(
-                self.generate_gradient_image, colors, positions
+            buffer = io.BytesIO(
+                await RENDER_POOL.run(self._gradient_png, colors, positions)
             )
-            buffer = io.BytesIO()
-            await asyncio.to_thread(gradient.save, buffer, "PNG")
-            buffer.seek(0)
 
             embed = discord.Embed(
                 title="Gradient Info",
@@ -9,7 +9,7 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
-from cogs.tags import MediaProcessor
+from cogs.tags import JobStatus, MediaProcessor, upload_limit
 
 
 class Media(commands.Cog):
@@ -88,6 +88,9 @@ class Media(commands.Cog):
         **kwargs,
     ):
         output_key = output_key or f"{command_name}_{ctx.message.id}"
+        processor.owner_id = ctx.author.id
+        status = JobStatus(ctx, processor)
+        processor.size_limit = upload_limit(ctx)
 
         try:
             func = processor.gscript_commands.get(command_name)
@@ -119,16 +122,11 @@ class Media(commands.Cog):
             final_name = (
                 f"{custom_name}.{ext}" if custom_name else f"{command_name}.{ext}"
             )
-            final_path = output_path.with_name(final_name)
-            if final_path.exists():
-                final_path.unlink()
-            output_path.rename(final_path)
 
-            with open(final_path, "rb") as f:
-                file = discord.File(f, filename=final_name)
-                await ctx.send(file=file)
+            await ctx.send(file=discord.File(output_path, filename=final_name))
 
         finally:
+            await status.close()
             await processor.cleanup()
 
     @commands.hybrid_group(
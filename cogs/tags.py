@@ -1,6 +1,8 @@
 import ast
 import asyncio
 import base64
+import contextlib
+import functools
 import hashlib
 import inspect
 import json
@@ -11,7 +13,9 @@ import random
 import re
 import shlex
 import shutil
+import struct
 import subprocess
+import time
 import uuid
 from datetime import datetime, timedelta
 from datetime import timezone as timez
@@ -27,13 +31,29 @@ import dateparser
 import discord
 import emoji as emoji_lib
 import matplotlib.font_manager
-import yt_dlp
 from discord import app_commands
 from discord.ext import commands
 from jsonschema import ValidationError, validate
 from PIL import Image, ImageDraw, ImageFilter, ImageFont
 
 import bot_info
+from media_services import (
+    EXPR_CACHE,
+    FFMPEG_SCHEDULER,
+    MEDIA_CACHES,
+    MEDIA_DOWNLOAD_CACHE,
+    MEDIA_PROBE,
+    RENDER_POOL,
+    STEP_CACHE,
+    STREAM_CHUNK_SIZE,
+    TEMP_STORAGE,
+    TEXT_LAYER_CACHE,
+    FFmpegScheduler,
+    LRUCache,
+    MediaDownloadCache,
+    download_to_path,
+    stream_attachment,
+)
 
 IMAGE_TYPES = ("image/png", "image/jpeg", "image/jpg", "image/webp", "image/gif")
 VIDEO_TYPES = (
@@ -54,6 +74,78 @@ AUDIO_TYPES = (
     "audio/x-matroska",
     "audio/x-ms-wma",
 )
+CODE_TAG_ALIASES = {
+    "python": ("python", "py"),
+    "bash": ("bash", "sh"),
+    "fish": ("fish",),
+    "nu": ("nu", "nushell"),
+    "elvish": ("elvish", "elv"),
+    "javascript": ("javascript", "js", "node"),
+    "typescript": ("typescript", "ts"),
+    "php": ("php",),
+    "ruby": ("ruby", "rb"),
+    "lua": ("lua",),
+    "go": ("go",),
+    "rust": ("rust", "rs"),
+    "c": ("c",),
+    "cpp": ("cpp", "c++"),
+    "csharp": ("csharp", "cs", "c#"),
+    "zig": ("zig",),
+    "java": ("java",),
+    "kotlin": ("kotlin", "kt"),
+    "nim": ("nim",),
+}
+CODE_TAGS = {
+    alias + suffix: language
+    for language, aliases in CODE_TAG_ALIASES.items()
+    for alias in aliases
+    for suffix in ("", "_")
+}
+
+
+class ExecFileRegistry(dict):
+    def __init__(self):
+        super().__init__()
+        base = Path(os.getenv("TEMP", "/tmp")) / "gman_exec"
+        self.spool_dir = base / uuid.uuid4().hex
+
+    def spool_path(self, filename: str) -> Path:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        return self.spool_dir / f"{uuid.uuid4().hex}{Path(filename).suffix}"
+
+    def _release(self, path) -> None:
+        if all(path != entry[0] for entry in self.values()):
+            Path(path).unlink(missing_ok=True)
+
+    def __setitem__(self, key: str, value: tuple[Path, str]) -> None:
+        old = self.get(key)
+        super().__setitem__(key, value)
+        if old is not None:
+            self._release(old[0])
+
+    def clear(self) -> None:
+        paths = [entry[0] for entry in self.values()]
+        super().clear()
+        for path in paths:
+            Path(path).unlink(missing_ok=True)
+
+    def cleanup(self) -> None:
+        self.clear()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+class SpooledFile(discord.File):
+    # deletes its backing path once discord.py closes it after sending
+    def __init__(self, path, filename: str = None, **kwargs):
+        super().__init__(path, filename=filename, **kwargs)
+        self.spool_path = Path(path)
+
+    def close(self) -> None:
+        super().close()
+        try:
+            self.spool_path.unlink(missing_ok=True)
+        except OSError:
+            pass
 
 
 class TagPaginator(discord.ui.View):
@@ -425,14 +517,373 @@ class DiscordGenerator:
         return styles.get(style.lower(), discord.ButtonStyle.primary)
 
 
+class QueueNotice:
+    def __init__(self, ctx: commands.Context):
+        self.ctx = ctx
+        self.message = None
+        # parallel script branches share one notice
+        self.lock = asyncio.Lock()
+
+    async def __call__(self, position: int) -> None:
+        async with self.lock:
+            await self._update(position)
+
+    async def _update(self, position: int) -> None:
+        try:
+            if position == 0:
+                if self.message is not None:
+                    await self.message.delete()
+                    self.message = None
+            elif self.message is None:
+                self.message = await self.ctx.send(
+                    f"Queued for processing (position {position})..."
+                )
+            else:
+                await self.message.edit(
+                    content=f"Queued for processing (position {position})..."
+                )
+        except discord.HTTPException:
+            pass
+
+
+class JobProgress:
+    # how far a GScript job has got: finished top-level steps plus the
+    # fraction of the running ffmpeg process
+    def __init__(self, on_change: Callable = None, interval: float = 2.0):
+        self.total = 0
+        self.done = 0
+        self.fraction = 0.0
+        self.label = ""
+        self.cancelled = False
+        self._on_change = on_change
+        self._interval = interval
+        self._last = time.monotonic()
+        # the latest on_change call, so the owner can wait for it
+        self.pending = None
+
+    @property
+    def percent(self) -> float:
+        if not self.total:
+            return 100 * self.fraction
+        return 100 * min((self.done + self.fraction) / self.total, 1.0)
+
+    def describe(self) -> str:
+        if not self.total:
+            return f"Processing ({self.percent:.0f}%)..."
+        label = f" `{self.label}`" if self.label else ""
+        return (
+            f"Processing step {min(self.done + 1, self.total)}/{self.total}"
+            f"{label} ({self.percent:.0f}%)..."
+        )
+
+    def update(self, **changes) -> None:
+        for name, value in changes.items():
+            setattr(self, name, value)
+        now = time.monotonic()
+        if self._on_change and now - self._last >= self._interval:
+            self._last = now
+            self.pending = asyncio.ensure_future(self._on_change(self))
+
+
+class CancelJobView(discord.ui.View):
+    def __init__(self, processor, owner_id: int):
+        super().__init__(timeout=None)
+        self.processor = processor
+        self.owner_id = owner_id
+
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.danger)
+    async def cancel_job(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message(
+                "Only the person who started this job can cancel it.", ephemeral=True
+            )
+            return
+        self.processor.cancel()
+        button.disabled = True
+        await interaction.response.edit_message(content="Cancelling...", view=self)
+
+
+class JobStatus(QueueNotice):
+    # one status message for a job: queue position while waiting, progress
+    # while running, and a cancel button
+    def __init__(self, ctx: commands.Context, processor):
+        super().__init__(ctx)
+        self.processor = processor
+        self.position = 0
+        self.closed = False
+        processor.queue_notice = self
+        processor.progress = JobProgress(on_change=self.show)
+
+    def _content(self) -> str:
+        if self.position:
+            return f"Queued for processing (position {self.position})..."
+        return self.processor.progress.describe()
+
+    async def _update(self, position: int) -> None:
+        self.position = position
+        if position or self.message is not None:
+            await self._render()
+
+    async def show(self, progress: JobProgress) -> None:
+        async with self.lock:
+            if not progress.cancelled and not self.closed:
+                await self._render()
+
+    async def _render(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self.message is None:
+                self.message = await self.ctx.send(
+                    self._content(),
+                    view=CancelJobView(self.processor, self.ctx.author.id),
+                )
+            else:
+                await self.message.edit(content=self._content())
+        except discord.HTTPException:
+            pass
+
+    async def close(self) -> None:
+        progress = self.processor.progress
+        progress._on_change = None
+        self.closed = True
+        if progress.pending is not None:
+            # a render already sending has to finish so its message is
+            # known here and deleted; one still waiting now does nothing
+            await asyncio.gather(progress.pending, return_exceptions=True)
+            progress.pending = None
+        async with self.lock:
+            if self.message is not None:
+                try:
+                    await self.message.delete()
+                except discord.HTTPException:
+                    pass
+                self.message = None
+
+
+# expression variable -> _get_full_media_info field, for the context media,
+# the overlay media and every other key (as "<key><suffix>")
+EXPR_CONTEXT_VARS = {
+    "iw": "width",
+    "ih": "height",
+    "W": "width",
+    "H": "height",
+    "width": "width",
+    "height": "height",
+    "main_w": "width",
+    "main_h": "height",
+    "duration": "duration",
+    "fps": "fps",
+    "frame_count": "frame_count",
+    "file_size": "file_size",
+    "bit_rate": "bit_rate",
+    "sample_rate": "sample_rate",
+    "channels": "channels",
+    "aspect_ratio": "aspect_ratio",
+    "codec": "codec",
+    "audio_codec": "audio_codec",
+    "has_audio": "has_audio",
+}
+EXPR_OVERLAY_VARS = {
+    "ow": "width",
+    "oh": "height",
+    "w": "width",
+    "h": "height",
+    "overlay_w": "width",
+    "overlay_h": "height",
+    "overlay_duration": "duration",
+    "overlay_fps": "fps",
+}
+EXPR_KEY_SUFFIXES = {
+    "_w": "width",
+    "_h": "height",
+    "_duration": "duration",
+    "_fps": "fps",
+    "_frame_count": "frame_count",
+    "w": "width",
+    "h": "height",
+}
+
+# Codec/container used for GScript steps between load and render. The file
+# keeps its original extension; the container is forced with -f.
+INTERMEDIATE_FORMATS = {
+    "ffv1": {
+        "video": ["-c:v", "ffv1", "-level", "3", "-g", "1", "-slices", "4"],
+        "audio": ["-c:a", "pcm_s16le"],
+        "format": "matroska",
+    },
+    "x264": {
+        "video": ["-c:v", "libx264", "-preset", "ultrafast", "-qp", "0"],
+        "audio": ["-c:a", "pcm_s16le"],
+        "format": "matroska",
+    },
+    "raw": {
+        "video": ["-c:v", "rawvideo"],
+        "audio": ["-c:a", "pcm_s16le"],
+        "format": "nut",
+    },
+}
+INTERMEDIATE_SUFFIXES = (".mp4", ".mov", ".webm", ".mkv", ".avi", ".wmv")
+# still images that the Pillow backend handles without spawning ffmpeg;
+# the value is the codec name ffprobe reports for them
+STILL_IMAGE_CODECS = {".png": "png", ".jpg": "mjpeg", ".jpeg": "mjpeg", ".webp": "webp"}
+PILLOW_FILTERS = (
+    "contrast",
+    "saturate",
+    "brightness",
+    "gamma",
+    "grayscale",
+    "sepia",
+    "invert",
+    "tint",
+    "resize",
+    "crop",
+    "rotate",
+)
+# ffmpeg feeds eq limited-range BT.601 yuv444p; Pillow's YCbCr is full range
+RGB_TO_YUV = (
+    0.256788,
+    0.504129,
+    0.097906,
+    16,
+    -0.148223,
+    -0.290993,
+    0.439216,
+    128,
+    0.439216,
+    -0.367788,
+    -0.071427,
+    128,
+)
+YUV_TO_RGB = (
+    1.164384,
+    0,
+    1.596027,
+    -222.921566,
+    1.164384,
+    -0.391762,
+    -0.812968,
+    135.575295,
+    1.164384,
+    2.017232,
+    0,
+    -276.835851,
+)
+# containers that can be cut and joined with -c copy
+STREAM_COPY_SUFFIXES = INTERMEDIATE_SUFFIXES + (
+    ".mp3",
+    ".m4a",
+    ".ogg",
+    ".opus",
+    ".flac",
+    ".wav",
+    ".mka",
+)
+DELIVERY_ARGS = {
+    ".mp4": [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "fast",
+        "-crf",
+        "23",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+        "-movflags",
+        "+faststart",
+    ],
+    ".mov": [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "fast",
+        "-crf",
+        "23",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+        "-movflags",
+        "+faststart",
+    ],
+    ".mkv": [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "fast",
+        "-crf",
+        "23",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+    ],
+    ".webm": [
+        "-c:v",
+        "libvpx-vp9",
+        "-crf",
+        "32",
+        "-b:v",
+        "0",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "libopus",
+    ],
+}
+# (minimum bits per pixel per frame, x264 preset): the fastest preset whose
+# floor the target bitrate clears is used
+DELIVERY_PRESETS = ((0.1, "veryfast"), (0.05, "faster"), (0.02, "fast"), (0, "medium"))
+DELIVERY_MIN_BPP = 0.02
+VP9_CPU_USED = {"veryfast": "5", "faster": "4", "fast": "3", "medium": "2"}
+# script cost is counted in decoded pixel-frames; spawning an ffmpeg process
+# is charged as roughly ten 1080p frames
+GSCRIPT_PROCESS_COST = 1920 * 1080 * 10
+# an ffmpeg run is killed after this long without progress, or this long
+# in total
+FFMPEG_STALL_SECONDS = bot_info.data.get("ffmpeg_stall_timeout", 120)
+FFMPEG_MAX_SECONDS = bot_info.data.get("ffmpeg_max_seconds", 900)
+GSCRIPT_COST_BUDGET = bot_info.data.get("gscript_cost_budget", 1920 * 1080 * 30 * 600)
+EMOJI_FETCH_CONCURRENCY = bot_info.data.get("emoji_fetch_concurrency", 8)
+# temp space a GScript run reserves up front; it grows a step at a time
+GSCRIPT_TEMP_RESERVE = bot_info.data.get("gscript_temp_reserve_mb", 64) * 1024 * 1024
+
+
+def upload_limit(ctx: commands.Context) -> int:
+    limit = getattr(ctx, "filesize_limit", None)
+    if not limit and ctx.guild:
+        limit = ctx.guild.filesize_limit
+    return limit or 10 * 1024 * 1024
+
+
 class MediaProcessor:
     def __init__(self):
         self.media_cache: Dict[str, str] = {}
         self.active_processes: Set[asyncio.subprocess.Process] = set()
-        base = Path(os.getenv("TEMP", "/tmp")) / "gscript"
-        self.temp_dir = base / uuid.uuid4().hex
-        self._temp_dir_created = False
+        self._lease = None
         self.temp_files = set()
+        self.intermediate = bot_info.data.get("gscript_intermediate", "ffv1")
+        self.owner_id = None
+        self.priority = FFmpegScheduler.INTERACTIVE
+        self.queue_notice = None
+        self.progress = JobProgress()
+        self.size_limit = None
+        self._intermediate_files: Set[str] = set()
+        self._expr_info: Dict[str, tuple] = {}
+        self._keyframes: Dict[str, list] = {}
+        # still images produced in-process and not written to disk yet
+        self._image_buffers: Dict[str, object] = {}
+        self._content_ids: Dict[str, str] = {}
         self.session = None
         self.command_specs = {
             "load": {
@@ -732,6 +1183,27 @@ class MediaProcessor:
             "foreachframe": self._foreachframe,
             "export": self._export_media,
         }
+        self.fuse_filters = True
+        self.memoise_steps = True
+        self.ffmpeg_runs = 0
+        self.fusible_filters = {
+            "contrast": ("v", "eq=contrast={contrast_level}"),
+            "saturate": ("v", "eq=saturation={saturation_level}"),
+            "hue": ("v", "hue=h={hue_shift}"),
+            "brightness": ("v", "eq=brightness={brightness_level}"),
+            "gamma": ("v", "eq=gamma={gamma_level}"),
+            "grayscale": ("v", "format=gray"),
+            "sepia": (
+                "v",
+                "colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131",
+            ),
+            "invert": ("v", "negate"),
+            "rotate": ("v", "rotate={angle}"),
+            "resize": ("v", "scale={width}:{height}"),
+            "crop": ("v", "crop={width}:{height}:{x}:{y}"),
+            "fps": ("v", "fps={fps_value}"),
+            "volume": ("a", "volume={volume_level}"),
+        }
 
     async def _handle_error(
         self, operation: str, error: Exception, details: str = ""
@@ -789,21 +1261,30 @@ class MediaProcessor:
 
         self.media_cache.clear()
         self.temp_files.clear()
+        self._intermediate_files.clear()
+        self._expr_info.clear()
+        self._keyframes.clear()
+        self._image_buffers.clear()
+        self._content_ids.clear()
+
+    @property
+    def temp_dir(self):
+        return self._lease.path if self._lease else None
 
     def _ensure_temp_dir(self) -> None:
-        if not self._temp_dir_created:
-            self.temp_dir.parent.mkdir(exist_ok=True)
-            self.temp_dir.mkdir(exist_ok=True)
-            self._temp_dir_created = True
+        if self._lease is None:
+            self._lease = TEMP_STORAGE.lease(
+                "gscript", self.owner_id, reserve=GSCRIPT_TEMP_RESERVE
+            )
+        else:
+            # fail here, before the next step writes, once the job outgrows
+            # what it may still reserve
+            self._lease.ensure()
 
     def _maybe_cleanup_temp_dir(self) -> None:
-        if self._temp_dir_created and not self.active_processes:
-            shutil.rmtree(self.temp_dir, ignore_errors=True)
-            self._temp_dir_created = False
-            try:
-                self.temp_dir.parent.rmdir()
-            except OSError:
-                pass
+        if self._lease is not None and not self.active_processes:
+            self._lease.release()
+            self._lease = None
 
     def _get_temp_path(self, extension: str = "") -> Path:
         self._ensure_temp_dir()
@@ -818,96 +1299,89 @@ class MediaProcessor:
         info = await self._get_full_media_info(media_key)
         return (info["width"], info["height"])
 
+    async def _expr_media_info(self, media_key: str) -> dict:
+        path = self.media_cache[media_key]
+        try:
+            st = os.stat(path)
+            signature = (path, st.st_size, st.st_mtime_ns)
+        except OSError:
+            signature = (path, None, None)
+        cached = self._expr_info.get(media_key)
+        if cached and cached[0] == signature:
+            return cached[1]
+        info = await self._get_full_media_info(media_key)
+        self._expr_info[media_key] = (signature, info)
+        return info
+
     async def _build_expr_vars(
         self,
         context_key: str = None,
         overlay_key: str = None,
         user_vars: dict = None,
+        names=None,
     ) -> dict:
         vars: dict = {}
+        if names is None:
+            names = set(EXPR_CONTEXT_VARS) | set(EXPR_OVERLAY_VARS)
+            names |= {
+                mk.replace("-", "_") + suffix
+                for mk in self.media_cache
+                for suffix in EXPR_KEY_SUFFIXES
+            }
+        user_vars = user_vars or {}
+        names = [n for n in names if n not in user_vars]
+
+        context_names = [n for n in names if n in EXPR_CONTEXT_VARS]
+        if context_names:
+            if context_key and context_key in self.media_cache:
+                info = await self._expr_media_info(context_key)
+                for n in context_names:
+                    value = info[EXPR_CONTEXT_VARS[n]]
+                    vars[n] = int(value) if n == "has_audio" else value
+            else:
+                for n in context_names:
+                    if n not in ("aspect_ratio", "codec", "audio_codec"):
+                        vars[n] = 0.0 if n in ("duration", "fps") else 0
+
+        overlay_names = [n for n in names if n in EXPR_OVERLAY_VARS]
+        if overlay_names:
+            if overlay_key and overlay_key in self.media_cache:
+                oi = await self._expr_media_info(overlay_key)
+                for n in overlay_names:
+                    vars[n] = oi[EXPR_OVERLAY_VARS[n]]
+            else:
+                for n in overlay_names:
+                    if n in ("ow", "oh", "w", "h"):
+                        vars[n] = 0
+
+        safe_keys = {
+            mk.replace("-", "_"): mk
+            for mk in self.media_cache
+            if mk not in (context_key, overlay_key)
+        }
+        for n in names:
+            for suffix, field in EXPR_KEY_SUFFIXES.items():
+                mk = safe_keys.get(n[: -len(suffix)]) if n.endswith(suffix) else None
+                if mk is not None:
+                    info = await self._expr_media_info(mk)
+                    vars[n] = info[field]
+                    break
 
-        if context_key and context_key in self.media_cache:
-            info = await self._get_full_media_info(context_key)
-            vars.update(
-                {
-                    "iw": info["width"],
-                    "ih": info["height"],
-                    "W": info["width"],
-                    "H": info["height"],
-                    "width": info["width"],
-                    "height": info["height"],
-                    "main_w": info["width"],
-                    "main_h": info["height"],
-                    "duration": info["duration"],
-                    "fps": info["fps"],
-                    "frame_count": info["frame_count"],
-                    "file_size": info["file_size"],
-                    "bit_rate": info["bit_rate"],
-                    "sample_rate": info["sample_rate"],
-                    "channels": info["channels"],
-                    "aspect_ratio": info["aspect_ratio"],
-                    "codec": info["codec"],
-                    "audio_codec": info["audio_codec"],
-                    "has_audio": int(info["has_audio"]),
-                }
-            )
-        else:
-            vars.update(
-                {
-                    "iw": 0,
-                    "ih": 0,
-                    "W": 0,
-                    "H": 0,
-                    "width": 0,
-                    "height": 0,
-                    "main_w": 0,
-                    "main_h": 0,
-                    "duration": 0.0,
-                    "fps": 0.0,
-                    "frame_count": 0,
-                    "file_size": 0,
-                    "bit_rate": 0,
-                    "sample_rate": 0,
-                    "channels": 0,
-                    "has_audio": 0,
-                }
-            )
-
-        if overlay_key and overlay_key in self.media_cache:
-            oi = await self._get_full_media_info(overlay_key)
-            vars.update(
-                {
-                    "ow": oi["width"],
-                    "oh": oi["height"],
-                    "w": oi["width"],
-                    "h": oi["height"],
-                    "overlay_w": oi["width"],
-                    "overlay_h": oi["height"],
-                    "overlay_duration": oi["duration"],
-                    "overlay_fps": oi["fps"],
-                }
-            )
-        else:
-            vars.update({"ow": 0, "oh": 0, "w": 0, "h": 0})
-
-        for mk in list(self.media_cache.keys()):
-            if mk in (context_key, overlay_key):
-                continue
-            info = await self._get_full_media_info(mk)
-            safe = mk.replace("-", "_")
-            vars[f"{safe}_w"] = info["width"]
-            vars[f"{safe}_h"] = info["height"]
-            vars[f"{safe}_duration"] = info["duration"]
-            vars[f"{safe}_fps"] = info["fps"]
-            vars[f"{safe}_frame_count"] = info["frame_count"]
-            vars[f"{safe}w"] = info["width"]
-            vars[f"{safe}h"] = info["height"]
-
-        if user_vars:
-            vars.update(user_vars)
-
+        vars.update(user_vars)
         return vars
 
+    @staticmethod
+    def _compile_expr(expr: str) -> tuple:
+        cached = EXPR_CACHE.get(expr)
+        if cached is None:
+            try:
+                code = compile(expr, "<expr>", "eval")
+                cached = (code, frozenset(code.co_names))
+            except (SyntaxError, ValueError):
+                cached = (None, frozenset())
+            EXPR_CACHE.put(expr, cached)
+        return cached
+
     async def _resolve_expr(
         self,
         expr: str,
@@ -926,7 +1400,15 @@ class MediaProcessor:
         except ValueError:
             pass
 
-        vars = await self._build_expr_vars(context_key, overlay_key, user_vars)
+        if expr.endswith("%"):
+            names = {"iw", "ih"}
+        else:
+            names = set(self._compile_expr(expr)[1])
+            if "(" in expr:
+                names |= {"iw", "ih"}
+        vars = await self._build_expr_vars(
+            context_key, overlay_key, user_vars, names=names
+        )
 
         safe_builtins = {
             "abs": abs,
@@ -943,7 +1425,10 @@ class MediaProcessor:
         }
 
         def _eval(e: str):
-            return eval(e, {"__builtins__": None, **safe_builtins}, vars)
+            code = self._compile_expr(e)[0]
+            if code is None:
+                raise SyntaxError(f"invalid expression: {e}")
+            return eval(code, {"__builtins__": None, **safe_builtins}, vars)
 
         if "(" in expr:
             m = re.match(r"(\w+)\((.+)\)$", expr.strip())
@@ -978,7 +1463,6 @@ class MediaProcessor:
         if expr.endswith("%"):
             try:
                 pct = float(expr[:-1]) / 100.0
-                vars = await self._build_expr_vars(context_key, overlay_key, user_vars)
 
                 if dimension_type == "width":
                     base = vars.get("iw", 0)
@@ -1046,23 +1530,24 @@ class MediaProcessor:
         )
         return str(val)
 
+    @classmethod
     def _parse_color(
-        self, color_str: str, size: tuple = None
+        cls, color_str: str, size: tuple = None
     ) -> Union[tuple, Image.Image]:
         if color_str.lower() in ("random", "rand"):
             if size is None:
-                return self._generate_random_color()
+                return cls._generate_random_color()
             else:
                 angle = random.randint(0, 359)
                 color_str = f"linear-gradient({angle}deg, random, random)"
 
         if color_str.startswith("#"):
-            return self._hex_to_rgb(color_str)
+            return cls._hex_to_rgb(color_str)
 
         if not color_str.startswith(("linear-gradient(", "radial-gradient(")):
-            return self._parse_single_color(color_str)
+            return cls._parse_single_color(color_str)
 
-        color_str = self._replace_random_in_gradient(color_str)
+        color_str = cls._replace_random_in_gradient(color_str)
         base_str = color_str
 
         body = base_str[base_str.index("(") + 1 : base_str.rindex(")")]
@@ -1122,8 +1607,8 @@ class MediaProcessor:
                             else:
                                 t = (pos - start_pos) / (end_pos - start_pos)
 
-                            c1 = self._parse_single_color(colors_and_stops[i][0])
-                            c2 = self._parse_single_color(colors_and_stops[i + 1][0])
+                            c1 = cls._parse_single_color(colors_and_stops[i][0])
+                            c2 = cls._parse_single_color(colors_and_stops[i + 1][0])
 
                             r = int(c1[0] + (c2[0] - c1[0]) * t)
                             g = int(c1[1] + (c2[1] - c1[1]) * t)
@@ -1155,8 +1640,8 @@ class MediaProcessor:
                             else:
                                 t = (dist - start_pos) / (end_pos - start_pos)
 
-                            c1 = self._parse_single_color(colors_and_stops[i][0])
-                            c2 = self._parse_single_color(colors_and_stops[i + 1][0])
+                            c1 = cls._parse_single_color(colors_and_stops[i][0])
+                            c2 = cls._parse_single_color(colors_and_stops[i + 1][0])
 
                             r = int(c1[0] + (c2[0] - c1[0]) * t)
                             g = int(c1[1] + (c2[1] - c1[1]) * t)
@@ -1168,7 +1653,8 @@ class MediaProcessor:
 
         return img
 
-    def _replace_random_in_gradient(self, gradient_str: str) -> str:
+    @classmethod
+    def _replace_random_in_gradient(cls, gradient_str: str) -> str:
         parts = gradient_str.split("(")
         prefix = parts[0]
         body = "(".join(parts[1:])
@@ -1197,16 +1683,17 @@ class MediaProcessor:
                 color_part, percent_part = part.rsplit("%", 1)
                 color_part = color_part.strip()
                 if color_part.lower() in ("random", "rand"):
-                    color_part = self._rgb_to_hex(self._generate_random_color())
+                    color_part = cls._rgb_to_hex(cls._generate_random_color())
                 processed_parts.append(f"{color_part}%{percent_part}")
             else:
                 if part.lower() in ("random", "rand"):
-                    part = self._rgb_to_hex(self._generate_random_color())
+                    part = cls._rgb_to_hex(cls._generate_random_color())
                 processed_parts.append(part)
 
         return f"{prefix}({', '.join(processed_parts)})"
 
-    def _generate_random_color(self, alpha: int = None) -> tuple:
+    @staticmethod
+    def _generate_random_color(alpha: int = None) -> tuple:
         return (
             random.randint(0, 255),
             random.randint(0, 255),
@@ -1214,12 +1701,14 @@ class MediaProcessor:
             alpha if alpha is not None else 255,
         )
 
-    def _rgb_to_hex(self, color: tuple) -> str:
+    @staticmethod
+    def _rgb_to_hex(color: tuple) -> str:
         if len(color) == 4:
             return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}{color[3]:02x}"
         return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}"
 
-    def _hex_to_rgb(self, hex_str: str) -> tuple:
+    @staticmethod
+    def _hex_to_rgb(hex_str: str) -> tuple:
         hex_str = hex_str.lstrip("#")
         length = len(hex_str)
         if length == 3:  # RGB
@@ -1234,17 +1723,18 @@ class MediaProcessor:
             return tuple(int(hex_str[i : i + 2], 16) for i in (0, 2, 4, 6))
         return (0, 0, 0, 255)
 
-    def _parse_single_color(self, color_str: str) -> tuple:
+    @classmethod
+    def _parse_single_color(cls, color_str: str) -> tuple:
         color_str = color_str.strip().lower()
 
         if color_str in ("none", "transparent"):
             return (0, 0, 0, 0)
 
         if color_str in ("random", "rand"):
-            return self._generate_random_color()
+            return cls._generate_random_color()
 
         if color_str.startswith("#"):
-            return self._hex_to_rgb(color_str)
+            return cls._hex_to_rgb(color_str)
 
         if color_str.startswith(("rgb(", "rgba(")):
             try:
@@ -1385,10 +1875,159 @@ class MediaProcessor:
         except Exception as e:
             raise ValueError(f"{cmd} command error: {str(e)}")
 
-    async def _run_ffmpeg(self, cmd: list) -> tuple:
+    def _apply_intermediate(self, cmd: list) -> list:
+        preset = INTERMEDIATE_FORMATS.get(self.intermediate)
+        if not preset or len(cmd) < 2:
+            return cmd
+        output = Path(cmd[-1])
+        if (
+            output.suffix.lower() not in INTERMEDIATE_SUFFIXES
+            or output.parent != self.temp_dir
+        ):
+            return cmd
+
+        last_input = max((i for i, arg in enumerate(cmd) if arg == "-i"), default=0)
+        head, tail = cmd[: last_input + 2], []
+        i = last_input + 2
+        while i < len(cmd) - 1:
+            if cmd[i] in ("-f", "-movflags"):
+                i += 2
+                continue
+            tail.append(cmd[i])
+            i += 1
+
+        copied = {tail[j] for j in range(len(tail) - 1) if tail[j + 1] == "copy"}
+        extra = []
+        if not copied & {"-c", "-c:v", "-vcodec"}:
+            extra += preset["video"]
+        if not copied & {"-c", "-c:a", "-acodec"}:
+            extra += preset["audio"]
+        extra += ["-f", preset["format"]]
+
+        self._intermediate_files.add(str(output))
+        return head + tail + extra + [cmd[-1]]
+
+    async def _delivery_args(
+        self, path: Path, suffix: str, budget_scale: float = 1.0
+    ) -> list:
+        args = list(DELIVERY_ARGS.get(suffix, []))
+        if not args or not self.size_limit:
+            return args
+        info = await self._get_full_media_info(str(path))
+        if info["duration"] <= 0:
+            return args
+
+        def set_arg(flag: str, value: str) -> None:
+            if flag in args:
+                args[args.index(flag) + 1] = value
+            else:
+                args.extend([flag, value])
+
+        # leave some room for the container
+        budget = self.size_limit * 8 * 0.92 * budget_scale / info["duration"]
+        audio_rate = 0
+        if info["has_audio"]:
+            audio_rate = 128_000 if budget > 1_000_000 else 64_000
+        video_rate = max(int(budget - audio_rate), 50_000)
+
+        bpp = video_rate / (info["width"] * info["height"] * (info["fps"] or 25))
+        if bpp < DELIVERY_MIN_BPP:
+            factor = max(math.sqrt(bpp / DELIVERY_MIN_BPP), 0.25)
+            set_arg(
+                "-vf", f"scale=trunc(iw*{factor:.3f}/2)*2:trunc(ih*{factor:.3f}/2)*2"
+            )
+            bpp = DELIVERY_MIN_BPP
+        preset = next(name for floor, name in DELIVERY_PRESETS if bpp >= floor)
+
+        if suffix == ".webm":
+            set_arg("-b:v", str(video_rate))
+            set_arg("-deadline", "good")
+            set_arg("-cpu-used", VP9_CPU_USED[preset])
+        else:
+            set_arg("-preset", preset)
+            set_arg("-maxrate", str(video_rate))
+            set_arg("-bufsize", str(video_rate * 2))
+        if audio_rate:
+            set_arg("-b:a", str(audio_rate))
+        return args
+
+    async def _deliver(self, path: Path) -> Path:
+        if str(path) not in self._intermediate_files and not (
+            self.size_limit
+            and path.suffix.lower() in DELIVERY_ARGS
+            and path.stat().st_size > self.size_limit
+        ):
+            return path
+
+        key = await self._encode_key("deliver", path, path.suffix.lower())
+        output_file = key and await self._restore_step(key)
+        if not output_file:
+            output_file = await self._encode_delivery(path)
+            if key:
+                await self._save_step(key, str(output_file))
+        for media_key, cached in self.media_cache.items():
+            if cached == str(path):
+                self.media_cache[media_key] = str(output_file)
+        return output_file
+
+    async def _encode_delivery(self, path: Path) -> Path:
+        budget_scale = 1.0
+        for _ in range(2):
+            output_file = self._get_temp_path(path.suffix[1:])
+            cmd = [
+                "ffmpeg",
+                "-hide_banner",
+                "-i",
+                path.as_posix(),
+                *await self._delivery_args(path, path.suffix.lower(), budget_scale),
+                "-y",
+                output_file.as_posix(),
+            ]
+            success, error = await self._run_ffmpeg(cmd, intermediate=False)
+            if not success:
+                raise RuntimeError(error)
+            size = output_file.stat().st_size
+            if not self.size_limit or size <= self.size_limit:
+                break
+            # the rate cap is only an estimate; retry once with the overshoot
+            # taken out of the budget
+            budget_scale *= self.size_limit / size * 0.95
+        return output_file
+
+    async def _run_ffmpeg(self, cmd: list, intermediate: bool = True) -> tuple:
+        if self._image_buffers:
+            pending = {Path(p).as_posix(): p for p in self._image_buffers}
+            await self._flush_images([pending[a] for a in cmd if a in pending])
         if platform.system() == "Windows":
             cmd[0] = "ffmpeg.exe"
+        if intermediate:
+            cmd = self._apply_intermediate(cmd)
+
+        async with FFMPEG_SCHEDULER.slot(
+            self.owner_id, self.priority, self.queue_notice
+        ):
+            return await self._exec_ffmpeg(FFMPEG_SCHEDULER.tune_threads(cmd))
+
+    def cancel(self) -> None:
+        self.progress.cancelled = True
+        for proc in list(self.active_processes):
+            if proc.returncode is None:
+                with contextlib.suppress(ProcessLookupError):
+                    proc.kill()
 
+    async def _ffmpeg_input_duration(self, cmd: list) -> float:
+        durations = []
+        for i, arg in enumerate(cmd[:-1]):
+            if arg == "-i" and os.path.isfile(cmd[i + 1]):
+                info = await self._get_full_media_info(cmd[i + 1])
+                durations.append(info["duration"])
+        return max(durations, default=0.0)
+
+    async def _exec_ffmpeg(self, cmd: list) -> tuple:
+        if self.progress.cancelled:
+            return False, "Error: GScript job was cancelled."
+        duration = await self._ffmpeg_input_duration(cmd)
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
         proc = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
@@ -1399,44 +2038,371 @@ class MediaProcessor:
         )
 
         self.active_processes.add(proc)
+        self.ffmpeg_runs += 1
+        FFMPEG_SCHEDULER.renice(proc.pid, self.priority)
+        stderr_task = asyncio.ensure_future(proc.stderr.read())
+        deadline = time.monotonic() + FFMPEG_MAX_SECONDS
 
         try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=120)
+            # -progress writes key=value blocks; the timeout only fires when
+            # ffmpeg stops reporting, not when a long job is still moving
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                line = await asyncio.wait_for(
+                    proc.stdout.readline(), min(FFMPEG_STALL_SECONDS, remaining)
+                )
+                if not line:
+                    break
+                key, _, value = line.decode("utf-8", errors="replace").partition("=")
+                if key == "out_time_us" and duration:
+                    with contextlib.suppress(ValueError):
+                        self.progress.update(
+                            fraction=min(int(value) / 1_000_000 / duration, 1.0)
+                        )
+            await proc.wait()
+            stderr = await stderr_task
+            if self.progress.cancelled:
+                return False, "Error: GScript job was cancelled."
             if proc.returncode != 0:
                 error_msg = stderr.decode("utf-8", errors="replace").strip()
                 if platform.system() == "Windows":
                     error_msg = error_msg.replace("\r\n", "\n")
                 return False, f"Error: FFmpeg error: {error_msg}"
-            return True, stdout.decode("utf-8", errors="replace").strip()
+            return True, ""
         except asyncio.TimeoutError:
             proc.kill()
-            return False, "Error: FFmpeg processing took longer than 120 seconds."
+            if time.monotonic() >= deadline:
+                return (
+                    False,
+                    f"Error: FFmpeg processing took longer than {FFMPEG_MAX_SECONDS} "
+                    "seconds.",
+                )
+            return (
+                False,
+                f"Error: FFmpeg made no progress for {FFMPEG_STALL_SECONDS} seconds.",
+            )
         except Exception as e:
             return False, f"Error: {str(e)}"
         finally:
+            stderr_task.cancel()
             self.active_processes.discard(proc)
 
-    async def _run_ffprobe(self, cmd: list) -> tuple:
-        if platform.system() == "Windows":
-            cmd[0] = "ffprobe.exe"
+    async def _content_id(self, path: str) -> str:
+        if path not in self._content_ids:
+            await self._flush_images([path])
+            self._content_ids[path] = await asyncio.to_thread(
+                MediaDownloadCache._hash_file, Path(path)
+            )
+        return self._content_ids[path]
+
+    async def _step_key(self, cmd: str, parsed: dict):
+        if not self.memoise_steps or cmd in (
+            "load",
+            "render",
+            "export",
+            "set",
+            "clone",
+        ):
+            return None
+        args = {k: v for k, v in parsed.items() if not k.startswith("_")}
+        if any("rand" in str(v).lower() for v in args.values()):
+            return None
+        inputs, outputs, _ = self._command_keys(cmd, parsed)
+        if len(outputs) != 1 or not all(k in self.media_cache for k in inputs):
+            return None
+
+        # inputs are identified by content, so renaming keys or re-uploading
+        # the same file still hits
+        digest = hashlib.sha256(f"{cmd}:{self.intermediate}".encode())
+        for name, value in sorted(args.items()):
+            if name == "output_key":
+                continue
+            if name == "input_keys":
+                value = [await self._content_id(self.media_cache[k]) for k in value]
+            elif name.endswith("_key") and value in inputs:
+                value = await self._content_id(self.media_cache[value])
+            digest.update(f"{name}={value!r};".encode())
+        return digest.hexdigest()
+
+    async def _chain_key(self, steps: list[tuple[str, dict]]):
+        if not self.memoise_steps:
+            return None
+        source = await self._content_id(self.media_cache[steps[0][1]["input_key"]])
+        digest = hashlib.sha256(f"chain:{self.intermediate}:{source}".encode())
+        for cmd, parsed in steps:
+            args = {
+                k: v
+                for k, v in parsed.items()
+                if k not in ("input_key", "output_key") and not k.startswith("_")
+            }
+            digest.update(f"{cmd}={sorted(args.items())!r};".encode())
+        return digest.hexdigest()
+
+    def _block_args(self, block: str, cmd: str, args: list[str]) -> list[str]:
+        # a body step's arguments as the block will run it; steps that leave
+        # out their keys read and write the block's own scratch keys, "" here
+        if block == "dobetween":
+            kw_args = self._positional_kwargs(cmd, args)
+            kw_args.setdefault("input_key", "")
+            kw_args.setdefault("output_key", "")
+            return [f"{k}={v}" for k, v in kw_args.items()]
+        if cmd in ("create", "load", "export"):
+            return args
+        named = {a.split("=", 1)[0] for a in args if "=" in a}
+        return args + [f"{k}=" for k in ("input_key", "output_key") if k not in named]
+
+    async def _block_outputs(self, block: str, body: list[str]) -> set:
+        # the body shares the media cache, so keys it writes are visible
+        # after the block
+        outputs = set()
+        for line in body:
+            try:
+                parts = shlex.split(line)
+            except ValueError:
+                continue
+            cmd = parts[0].lower() if parts else ""
+            if cmd not in self.command_specs or cmd == "set":
+                continue
+            try:
+                parsed = await self._parse_command_args(
+                    cmd, self._block_args(block, cmd, parts[1:])
+                )
+            except ValueError:
+                continue
+            outputs |= self._command_keys(cmd, parsed)[1]
+        return outputs - {""}
+
+    async def _block_key(
+        self, header: str, body: list[str], user_vars: dict, output_key: str
+    ):
+        text = "\n".join([header, *body])
+        if not self.memoise_steps or re.search(r"rand|^(load|export)\b", text, re.M):
+            return None
+        # a hit only restores output_key, so a body that writes any other
+        # key always runs
+        block = header.split()[0].lower()
+        if await self._block_outputs(block, body) - {output_key}:
+            return None
+        digest = hashlib.sha256(f"block:{self.intermediate}:{text}".encode())
+        digest.update(repr(sorted(user_vars.items())).encode())
+        # the body can read any key, not just the block's input
+        for key, path in sorted(self.media_cache.items()):
+            if re.search(rf"(?<![\w-]){re.escape(key)}", text):
+                digest.update(f"{key}={await self._content_id(path)};".encode())
+        return digest.hexdigest()
+
+    async def _encode_key(self, kind: str, path: Path, ext: str):
+        if not self.memoise_steps:
+            return None
+        intermediate = str(path) in self._intermediate_files
+        content = await self._content_id(str(path))
+        return hashlib.sha256(
+            f"{kind}:{content}:{ext}:{self.size_limit}:{intermediate}".encode()
+        ).hexdigest()
+
+    async def _restore_step(self, key: str):
+        cached = STEP_CACHE.lookup(key)
+        if not cached:
+            return None
+        artifact, intermediate = cached
+        output_file = self._get_temp_path(artifact.suffix[1:])
+        await asyncio.to_thread(MediaDownloadCache.link, artifact, output_file)
+        if intermediate:
+            self._intermediate_files.add(str(output_file))
+        self._content_ids[str(output_file)] = key
+        return output_file
+
+    async def _save_step(self, key: str, path: str) -> None:
+        self._content_ids[path] = key
+        # buffered stills are cheaper to redo than to encode early
+        if path not in self._image_buffers and os.path.exists(path):
+            await STEP_CACHE.store(key, Path(path), path in self._intermediate_files)
+
+    async def _memoised(self, key, output_key: str, produce) -> str:
+        if key:
+            restored = await self._restore_step(key)
+            if restored:
+                self.media_cache[output_key] = str(restored)
+                return f"media://{restored.as_posix()}"
+        result = await produce()
+        if (
+            key
+            and isinstance(result, str)
+            and result.startswith("media://")
+            and output_key in self.media_cache
+        ):
+            await self._save_step(key, self.media_cache[output_key])
+        return result
 
+    @staticmethod
+    def _timestamp_seconds(ts) -> float:
+        parts = str(ts).split(":")
+        return sum(float(p) * 60**i for i, p in enumerate(reversed(parts)))
+
+    async def _keyframe_times(self, path: Path) -> list[float]:
+        if str(path) in self._keyframes:
+            return self._keyframes[str(path)]
+        cmd = [
+            "ffprobe.exe" if platform.system() == "Windows" else "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            path.as_posix(),
+        ]
         proc = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            creationflags=subprocess.CREATE_NO_WINDOW
-            if platform.system() == "Windows"
-            else 0,
+            stderr=asyncio.subprocess.DEVNULL,
+            creationflags=(
+                subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0
+            ),
         )
-
         try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=20)
-            if proc.returncode != 0:
-                error_msg = stderr.decode("utf-8", errors="replace").strip()
-                return False, f"Error: FFprobe error: {error_msg}"
-            return True, stdout.decode("utf-8", errors="replace").strip()
-        except Exception as e:
-            return False, f"Error: {str(e)}"
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=20)
+        except asyncio.TimeoutError:
+            proc.kill()
+            return []
+        keyframes = []
+        for row in stdout.decode("utf-8", errors="replace").splitlines():
+            pts, _, flags = row.partition(",")
+            if "K" in flags:
+                try:
+                    keyframes.append(float(pts))
+                except ValueError:
+                    pass
+        keyframes.sort()
+        self._keyframes[str(path)] = keyframes
+        return keyframes
+
+    async def _copy_cut(self, input_path: Path, start: float, end: float = None):
+        if input_path.suffix.lower() not in STREAM_COPY_SUFFIXES:
+            return None
+        info = await self._get_full_media_info(str(input_path))
+        if info["codec"]:
+            # the cut has to start on a keyframe; where it ends does not matter
+            keyframes = await self._keyframe_times(input_path)
+            tolerance = 0.5 / (info["fps"] or 25)
+            nearest = min(keyframes, key=lambda k: abs(k - start), default=None)
+            if nearest is None or abs(nearest - start) > tolerance:
+                return None
+            start = nearest
+
+        output_file = self._get_temp_path(input_path.suffix[1:])
+        cmd = ["ffmpeg", "-hide_banner", "-ss", f"{start:.6f}"]
+        cmd += ["-i", input_path.as_posix()]
+        if end is not None:
+            cmd += ["-t", f"{end - start:.6f}"]
+        cmd += ["-c", "copy", "-avoid_negative_ts", "make_zero", "-y"]
+        cmd.append(output_file.as_posix())
+        success, _ = await self._run_ffmpeg(
+            cmd, intermediate=str(input_path) in self._intermediate_files
+        )
+        return output_file if success else None
+
+    async def _stream_signature(self, path: Path):
+        success, data = await MEDIA_PROBE.probe(str(path))
+        if not success:
+            return None
+        fields = (
+            "codec_type",
+            "codec_name",
+            "width",
+            "height",
+            "pix_fmt",
+            "r_frame_rate",
+            "sample_rate",
+            "channels",
+            "extradata_hash",
+        )
+        return tuple(
+            tuple(stream.get(f) for f in fields)
+            for stream in data.get("streams", [])
+            if stream.get("codec_type") in ("video", "audio")
+        )
+
+    async def _concat_copy(self, input_paths: list[Path]):
+        suffix = input_paths[0].suffix.lower()
+        if suffix not in STREAM_COPY_SUFFIXES or any(
+            p.suffix.lower() != suffix for p in input_paths
+        ):
+            return None
+        signatures = await asyncio.gather(
+            *(self._stream_signature(p) for p in input_paths)
+        )
+        if not signatures[0] or any(sig != signatures[0] for sig in signatures):
+            return None
+
+        list_file = self._get_temp_path("txt")
+        list_file.write_text(
+            "".join(
+                "file '{}'\n".format(p.resolve().as_posix().replace("'", "'\\''"))
+                for p in input_paths
+            ),
+            encoding="utf-8",
+        )
+        output_file = self._get_temp_path(suffix[1:])
+        cmd = [
+            "ffmpeg",
+            "-hide_banner",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_file.as_posix(),
+            "-c",
+            "copy",
+            "-y",
+            output_file.as_posix(),
+        ]
+        success, _ = await self._run_ffmpeg(
+            cmd,
+            intermediate=any(str(p) in self._intermediate_files for p in input_paths),
+        )
+        return output_file if success else None
+
+    async def _copy_window(self, input_key: str, start: float, end: float, prefix: str):
+        input_path = Path(self.media_cache[input_key])
+        if input_path.suffix.lower() not in INTERMEDIATE_SUFFIXES:
+            return None
+        info = await self._get_full_media_info(input_key)
+        keyframes = await self._keyframe_times(input_path)
+        if not keyframes or not info["duration"]:
+            return None
+
+        # widen [start, end] to the surrounding keyframes; everything outside
+        # that window is copied as-is
+        tolerance = 0.5 / (info["fps"] or 25)
+        window_start = max((k for k in keyframes if k <= start + tolerance), default=0)
+        window_end = min((k for k in keyframes if k >= end - tolerance), default=None)
+        if window_end is not None and window_end >= info["duration"] - tolerance:
+            window_end = None
+        if window_start <= tolerance and window_end is None:
+            return None
+
+        cuts = [("window", window_start, window_end)]
+        if window_start > tolerance:
+            cuts.insert(0, ("head", 0.0, window_start))
+        if window_end is not None:
+            cuts.append(("tail", window_end, None))
+        outputs = await asyncio.gather(
+            *(self._copy_cut(input_path, a, b) for _, a, b in cuts)
+        )
+        if not all(outputs):
+            return None
+
+        window = {"offset": window_start}
+        for (name, _, _), output in zip(cuts, outputs):
+            self.media_cache[f"{prefix}_{name}"] = str(output)
+            window[name] = f"{prefix}_{name}"
+        return window
 
     async def _probe_media_info(self, path: Path) -> tuple:
         info = await self._get_full_media_info(str(path))
@@ -1448,11 +2414,6 @@ class MediaProcessor:
         else:
             file_path = path_or_key
 
-        if not hasattr(self, "_meta_cache"):
-            self._meta_cache: dict = {}
-        if file_path in self._meta_cache:
-            return self._meta_cache[file_path]
-
         default = {
             "width": 1,
             "height": 1,
@@ -1469,26 +2430,25 @@ class MediaProcessor:
             "channels": 0,
         }
 
-        cmd = [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "stream=codec_type,codec_name,width,height,duration,r_frame_rate,"
-            "nb_frames,sample_rate,channels",
-            "-show_entries",
-            "format=duration,size,bit_rate",
-            "-of",
-            "json",
-            file_path,
-        ]
-        success, output = await self._run_ffprobe(cmd)
+        image = self._image_buffers.get(file_path)
+        if isinstance(image, Image.Image):
+            g = math.gcd(image.width, image.height)
+            return {
+                **default,
+                "width": image.width,
+                "height": image.height,
+                "duration": 0.04,
+                "fps": 25.0,
+                "frame_count": 1,
+                "codec": STILL_IMAGE_CODECS[Path(file_path).suffix.lower()],
+                "aspect_ratio": f"{image.width // g}:{image.height // g}",
+            }
+
+        success, data = await MEDIA_PROBE.probe(file_path)
         if not success:
-            self._meta_cache[file_path] = default
             return default
 
         try:
-            data = json.loads(output)
             streams = data.get("streams", [])
             fmt = data.get("format", {})
 
@@ -1561,69 +2521,945 @@ class MediaProcessor:
                     except (ValueError, TypeError):
                         pass
 
-            self._meta_cache[file_path] = result
             return result
 
         except Exception:
-            self._meta_cache[file_path] = default
             return default
 
-    def _invalidate_meta_cache(self, media_key: str) -> None:
-        if not hasattr(self, "_meta_cache"):
-            return
-        path = self.media_cache.get(media_key)
-        if path and path in self._meta_cache:
-            del self._meta_cache[path]
-
-    async def execute_media_script(
-        self, script, exec_registry: dict = None, user_vars: dict = None
-    ):
-        try:
-            lines = [line.strip() for line in script.splitlines() if line.strip()]
-            output_files = []
-            errors = []
-            last_output_key = None
-            produced_outputs = set()
-            exported_keys = set()
-            final_output_key = None
-            _user_vars: dict = dict(user_vars) if user_vars else {}
-            i = 0
+    async def _plan_filter_chain(
+        self,
+        lines: list[str],
+        start: int,
+        keep_keys: set,
+        min_steps: int = 2,
+        check_input: bool = True,
+    ) -> list[tuple[str, dict]]:
+        steps = []
+        idx = start
+        while idx < len(lines):
+            try:
+                parts = shlex.split(lines[idx])
+                cmd = parts[0].lower() if parts else ""
+                if cmd not in self.fusible_filters:
+                    break
+                parsed = await self._parse_command_args(cmd, parts[1:])
+            except ValueError:
+                break
 
-            while i < len(lines):
-                line = lines[i]
+            literal = True
+            for k, v in parsed.items():
+                if k in ("input_key", "output_key") or not isinstance(v, str):
+                    continue
                 try:
-                    cmd_head = line.split()[0].lower() if line.split() else ""
+                    float(v)
+                except ValueError:
+                    literal = False
+            if not literal:
+                break
 
-                    if cmd_head == "dobetween":
-                        try:
-                            parts = line.split()
-                            if len(parts) < 5:
-                                raise ValueError(
-                                    "dobetween requires input_key, start_time, end_time, output_key"
-                                )
-                            input_key = parts[1]
-                            start = parts[2]
-                            end = parts[3]
-                            output_key = parts[4]
-                            segment_key = parts[5] if len(parts) > 5 else "segment"
-                            sub_script = []
-                            i += 1
-                            while i < len(lines) and lines[i].lower() != "end":
-                                sub_script.append(lines[i])
-                                i += 1
-                            if i >= len(lines):
-                                raise ValueError("Missing 'end' for dobetween")
+            if steps:
+                previous_key = steps[-1][1]["output_key"]
+                if parsed["input_key"] != previous_key:
+                    break
+                # the previous output is only an intermediate if nothing
+                # else reads it before it is overwritten
+                if parsed["output_key"] != previous_key and (
+                    previous_key in keep_keys
+                    or any(
+                        re.search(rf"(?<![\w-]){re.escape(previous_key)}", line)
+                        for line in lines[idx + 1 :]
+                    )
+                ):
+                    break
+            steps.append((cmd, parsed))
+            idx += 1
 
-                            result = await self._dobetween_media(
-                                input_key=input_key,
-                                start_time=start,
-                                end_time=end,
-                                output_key=output_key,
-                                segment_key=segment_key,
-                                sub_script="\n".join(sub_script),
-                                _exec_registry=exec_registry,
-                                _user_vars=_user_vars,
-                            )
+        if len(steps) < min_steps or not steps:
+            return []
+        if not check_input:
+            return steps
+        if steps[0][1]["input_key"] not in self.media_cache:
+            return []
+
+        suffix = Path(self.media_cache[steps[0][1]["input_key"]]).suffix.lower()
+        if suffix in STILL_IMAGE_CODECS and all(
+            cmd in PILLOW_FILTERS for cmd, _ in steps
+        ):
+            # cheaper to run in-process one by one than to start ffmpeg
+            return []
+        video_suffixes = (".mp4", ".mov", ".webm", ".mkv", ".avi", ".wmv")
+        allowed_suffixes = {
+            "v": video_suffixes + (".gif", ".png", ".jpg", ".jpeg", ".webp"),
+            "a": video_suffixes
+            + (".mp3", ".ogg", ".wav", ".opus", ".flac", ".m4a", ".wma", ".mka"),
+        }
+        if any(
+            suffix not in allowed_suffixes[self.fusible_filters[cmd][0]]
+            for cmd, _ in steps
+        ):
+            return []
+        return steps
+
+    async def _run_filter_chain(self, steps: list[tuple[str, dict]]) -> str:
+        output_key = steps[-1][1]["output_key"]
+        result = await self._memoised(
+            await self._chain_key(steps),
+            output_key,
+            lambda: self._run_filter_chain_impl(steps),
+        )
+        if result.startswith("media://"):
+            for _, parsed in steps[:-1]:
+                if parsed["output_key"] != output_key:
+                    self.media_cache.pop(parsed["output_key"], None)
+        return result
+
+    async def _run_filter_chain_impl(self, steps: list[tuple[str, dict]]) -> str:
+        input_path = Path(self.media_cache[steps[0][1]["input_key"]])
+        output_file = self._get_temp_path(input_path.suffix[1:])
+
+        video_filters = []
+        audio_filters = []
+        for cmd, parsed in steps:
+            params = dict(parsed)
+            if cmd in ("resize", "crop"):
+                params["width"] = int(float(params["width"]))
+                params["height"] = int(float(params["height"]))
+            stream, template = self.fusible_filters[cmd]
+            target = video_filters if stream == "v" else audio_filters
+            target.append(template.format(**params))
+
+        cmd = ["ffmpeg", "-hide_banner", "-i", input_path.as_posix()]
+        if video_filters:
+            cmd += ["-vf", ",".join(video_filters)]
+        if audio_filters:
+            cmd += ["-af", ",".join(audio_filters)]
+        cmd += ["-y", output_file.as_posix()]
+
+        success, error = await self._run_ffmpeg(cmd)
+        if not success:
+            return error
+        self.media_cache[steps[-1][1]["output_key"]] = str(output_file)
+        return f"media://{output_file.as_posix()}"
+
+    @staticmethod
+    def _command_keys(cmd: str, parsed: dict) -> tuple[set, set, str]:
+        key_params = ("input_key", "base_key", "overlay_key", "audio_key", "media_key")
+        outputs = {parsed["output_key"]} if "output_key" in parsed else set()
+        if cmd in ("load", "create"):
+            outputs.add(parsed["media_key"])
+        inputs = {
+            parsed[p]
+            for p in key_params
+            if p in parsed and not (p == "media_key" and cmd in ("load", "create"))
+        }
+        inputs.update(parsed.get("input_keys", []))
+        # everything else may still name a key inside an expression
+        text = " ".join(
+            str(v)
+            for k, v in parsed.items()
+            if k not in key_params + ("output_key", "input_keys")
+        )
+        return inputs, outputs, text
+
+    async def _analyse_script(
+        self, lines: list[str], keep_keys: set
+    ) -> tuple[list[str], set[int]]:
+        problems = []
+        statements = []
+        i = 0
+        while i < len(lines):
+            start = i
+            try:
+                parts = shlex.split(lines[i])
+            except ValueError as e:
+                problems.append(f"Error: line {i + 1}: {e}")
+                i += 1
+                continue
+            cmd = parts[0].lower() if parts else ""
+
+            if cmd in ("dobetween", "foreachframe"):
+                i += 1
+                while i < len(lines) and lines[i].lower() != "end":
+                    i += 1
+                if i >= len(lines):
+                    problems.append(f"Error: line {start + 1}: missing 'end' for {cmd}")
+                    break
+                out_index = 4 if cmd == "dobetween" else 2
+                if len(parts) <= out_index:
+                    problems.append(
+                        f"Error: line {start + 1}: {cmd} requires input_key and output_key"
+                    )
+                else:
+                    body_outputs = await self._block_outputs(cmd, lines[start + 1 : i])
+                    statements.append(
+                        {
+                            "cmd": cmd,
+                            "lines": range(start, i + 1),
+                            "inputs": {parts[1]},
+                            "outputs": {parts[out_index]} | body_outputs,
+                            "primary": parts[out_index],
+                            "text": " ".join(parts[2:out_index] + lines[start + 1 : i]),
+                            "context": False,
+                            "root": False,
+                        }
+                    )
+                i += 1
+                continue
+
+            if cmd == "set":
+                statements.append(
+                    {
+                        "cmd": cmd,
+                        "lines": range(i, i + 1),
+                        "inputs": set(),
+                        "outputs": set(),
+                        "primary": None,
+                        "text": " ".join(parts[2:]),
+                        "context": True,
+                        "root": True,
+                    }
+                )
+                i += 1
+                continue
+
+            if cmd not in self.gscript_commands:
+                problems.append(f"Error: line {i + 1}: unknown command '{cmd}'")
+                i += 1
+                continue
+            try:
+                parsed = await self._parse_command_args(cmd, parts[1:])
+            except ValueError as e:
+                problems.append(f"Error: line {i + 1}: {e}")
+                i += 1
+                continue
+
+            for param, spec in self.command_specs[cmd].items():
+                value = parsed.get(param)
+                if spec.get("type") in (int, float) and isinstance(value, str):
+                    try:
+                        ast.parse(value, mode="eval")
+                    except SyntaxError:
+                        problems.append(
+                            f"Error: line {i + 1}: {param}={value} is not a number "
+                            "or expression"
+                        )
+
+            inputs, outputs, text = self._command_keys(cmd, parsed)
+            statements.append(
+                {
+                    "cmd": cmd,
+                    "lines": range(i, i + 1),
+                    "inputs": inputs,
+                    "outputs": outputs,
+                    "primary": parsed.get("output_key"),
+                    "text": text,
+                    "context": not any(
+                        p in parsed for p in ("input_key", "base_key", "media_key")
+                    ),
+                    "root": cmd in ("render", "export"),
+                }
+            )
+            i += 1
+
+        defined = set(self.media_cache)
+        for st in statements:
+            for key in st["inputs"] - defined:
+                problems.append(
+                    f"Error: line {st['lines'][0] + 1}: unknown media key '{key}'"
+                )
+            defined |= st["outputs"]
+        if problems:
+            problems.sort(key=lambda p: int(re.match(r"Error: line (\d+)", p)[1]))
+            return problems, set()
+
+        # references inside expressions ({key}_w, {key}_duration, ...) and
+        # the implicit "last output" context also count as reads
+        last_output = None
+        for st in statements:
+            st["inputs"] |= {
+                key
+                for key in defined
+                if re.search(
+                    rf"(?<![\w-]){re.escape(key.replace('-', '_'))}", st["text"]
+                )
+                or re.search(rf"(?<![\w-]){re.escape(key)}", st["text"])
+            }
+            if st["context"] and last_output:
+                st["inputs"].add(last_output)
+            if st["primary"]:
+                last_output = st["primary"]
+
+        producers = [st for st in statements if st["outputs"] and not st["root"]]
+        if not producers:
+            return [], set()
+        final_outputs = {
+            producers[-1]["primary"] or next(iter(producers[-1]["outputs"]))
+        }
+        if any(
+            st["cmd"] == "export" and st["inputs"] & final_outputs for st in statements
+        ):
+            # every exported result is returned in this case, keep them all
+            return [], set()
+
+        live = set(keep_keys) | final_outputs
+        dead = set()
+        for st in reversed(statements):
+            if st["root"] or not st["outputs"] or st["outputs"] & live:
+                live -= st["outputs"] - st["inputs"]
+                live |= st["inputs"]
+            else:
+                dead.update(st["lines"])
+        return [], dead
+
+    async def _estimate_script_cost(self, lines: list[str]) -> float:
+        shapes = {}
+
+        async def shape_of(key):
+            if key not in shapes:
+                w, h, frames, fps = 1280, 720, 300, 30.0
+                path = self.media_cache.get(key)
+                if path and os.path.exists(path):
+                    info = await self._get_full_media_info(path)
+                    w = info.get("width") or w
+                    h = info.get("height") or h
+                    fps = info.get("fps") or fps
+                    duration = info.get("duration") or 0
+                    frames = max(1.0, duration * fps) if duration else 1.0
+                shapes[key] = [float(w), float(h), float(frames), float(fps)]
+            return shapes[key]
+
+        def number(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+
+        cost = 0.0
+        last_key = None
+        i = 0
+        while i < len(lines):
+            parts = shlex.split(lines[i])
+            cmd = parts[0].lower() if parts else ""
+            if cmd in ("dobetween", "foreachframe"):
+                body = []
+                i += 1
+                while i < len(lines) and lines[i].lower() != "end":
+                    body.append(lines[i])
+                    i += 1
+                w, h, frames, fps = await shape_of(parts[1])
+                if cmd == "foreachframe":
+                    streamable = self.fuse_filters and all(
+                        self.fusible_filters.get(line.split()[0].lower(), ("",))[0]
+                        == "v"
+                        for line in body
+                    )
+                    # a filter-only body runs as one pass over the stream
+                    per_frame = 0 if streamable else GSCRIPT_PROCESS_COST
+                    cost += frames * len(body) * (w * h + per_frame)
+                else:
+                    start, end = number(parts[2]), number(parts[3])
+                    span = frames
+                    if start is not None and end is not None:
+                        span = min(frames, max(1.0, (end - start) * fps))
+                    cost += 2 * w * h * frames + len(body) * (
+                        w * h * span + GSCRIPT_PROCESS_COST
+                    )
+                out = parts[4] if cmd == "dobetween" else parts[2]
+                shapes[out] = [w, h, frames, fps]
+                last_key = out
+                i += 1
+                continue
+            if cmd in ("", "set", "export") or cmd not in self.gscript_commands:
+                i += 1
+                continue
+            parsed = await self._parse_command_args(cmd, parts[1:])
+            if cmd in ("load", "create"):
+                shape = await shape_of(parsed["media_key"])
+                if cmd == "create":
+                    shape[0] = number(parsed.get("width")) or shape[0]
+                    shape[1] = number(parsed.get("height")) or shape[1]
+                last_key = parsed["media_key"]
+                i += 1
+                continue
+
+            keys = [
+                parsed[k]
+                for k in (
+                    "input_key",
+                    "base_key",
+                    "overlay_key",
+                    "audio_key",
+                    "media_key",
+                )
+                if k in parsed
+            ] + list(parsed.get("input_keys", []))
+            if not keys and last_key:
+                keys = [last_key]
+            inputs = [await shape_of(k) for k in keys]
+            cost += GSCRIPT_PROCESS_COST + sum(w * h * f for w, h, f, _ in inputs)
+
+            w, h, frames, fps = inputs[0] if inputs else (1280.0, 720.0, 1.0, 30.0)
+            if cmd == "concat":
+                frames = sum(shape[2] for shape in inputs)
+            if cmd in ("resize", "crop"):
+                w = number(parsed.get("width")) or w
+                h = number(parsed.get("height")) or h
+            elif cmd == "trim":
+                start = number(parsed.get("start_time")) or 0.0
+                end = number(parsed.get("end_time"))
+                if end is not None:
+                    frames = min(frames, max(1.0, (end - start) * fps))
+            elif cmd == "speed":
+                factor = number(parsed.get("speed"))
+                if factor:
+                    frames = max(1.0, frames / factor)
+            elif cmd == "fps":
+                rate = number(parsed.get("fps_value"))
+                if rate:
+                    frames, fps = max(1.0, frames * rate / fps), rate
+            if "output_key" in parsed:
+                shapes[parsed["output_key"]] = [w, h, frames, fps]
+                last_key = parsed["output_key"]
+            i += 1
+        return cost
+
+    async def _run_script_command(
+        self, line: str, context_key: str, user_vars: dict, exec_registry: dict
+    ) -> tuple[str, dict, str]:
+        parts = shlex.split(line)
+        cmd = parts[0].lower()
+        args = parts[1:]
+
+        if cmd not in self.gscript_commands:
+            raise ValueError(f"Unknown command: '{cmd}'")
+
+        parsed = await self._parse_command_args(cmd, args)
+
+        context_key = (
+            parsed.get("input_key")
+            or parsed.get("base_key")
+            or parsed.get("media_key")
+            or context_key
+        )
+        overlay_key = parsed.get("overlay_key")
+        _skip_resolve = {
+            "input_key",
+            "output_key",
+            "base_key",
+            "media_key",
+            "audio_key",
+            "overlay_key",
+            "segment_key",
+            "registry_key",
+            "url",
+            "format",
+            "text",
+            "font",
+            "color",
+            "background_color",
+            "outline_color",
+            "shadow_color",
+            "codec",
+        }
+        for k, v in list(parsed.items()):
+            if not isinstance(v, str) or k in _skip_resolve:
+                continue
+            try:
+                float(v)
+                continue
+            except ValueError:
+                pass
+            resolved = await self._resolve_expr(
+                v,
+                context_key=context_key,
+                overlay_key=overlay_key,
+                user_vars=user_vars,
+                as_float=True,
+            )
+            parsed[k] = str(resolved)
+
+        async def run() -> str:
+            if cmd in PILLOW_FILTERS:
+                result = await self._run_pillow_filter(cmd, parsed)
+                if result is not None:
+                    return result
+            # everything else reads its inputs from disk
+            await self._flush_images()
+
+            if exec_registry is not None:
+                parsed["_exec_registry"] = exec_registry
+            parsed["_user_vars"] = user_vars
+
+            func = self.gscript_commands[cmd]
+            return await func(**parsed)
+
+        step_key = await self._step_key(cmd, parsed)
+        output_key = next(iter(self._command_keys(cmd, parsed)[1]), None)
+        return cmd, parsed, await self._memoised(step_key, output_key, run)
+
+    async def _pillow_image(self, path: str):
+        pending = self._image_buffers.get(path)
+        if isinstance(pending, Image.Image):
+            return pending
+        if pending is not None:
+            await pending
+
+        def load():
+            image = Image.open(path)
+            if getattr(image, "is_animated", False):
+                return None
+            image.load()
+            return image
+
+        try:
+            return await asyncio.to_thread(load)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_image(image: Image.Image, path: Path) -> None:
+        suffix = path.suffix.lower()
+        if suffix in (".jpg", ".jpeg"):
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(path, "JPEG", quality=95)
+        elif suffix == ".webp":
+            image.save(path, "WEBP", quality=90)
+        else:
+            image.save(path, "PNG")
+
+    async def _flush_images(self, paths: list = None) -> None:
+        for path in list(self._image_buffers if paths is None else paths):
+            pending = self._image_buffers.get(path)
+            if isinstance(pending, Image.Image):
+                pending = asyncio.ensure_future(
+                    asyncio.to_thread(self._save_image, pending, Path(path))
+                )
+                self._image_buffers[path] = pending
+            if pending is None:
+                continue
+            await pending
+            if self._image_buffers.get(path) is pending:
+                del self._image_buffers[path]
+
+    @staticmethod
+    def _eq_lut(contrast: float, brightness: float, gamma: float):
+        # the per-plane table libavfilter's eq builds, integer path included;
+        # eq keeps its settings as floats, which decides where int() lands
+        contrast, brightness, gamma = struct.unpack(
+            "3f", struct.pack("3f", contrast, brightness, gamma)
+        )
+        if contrast == 1 and brightness == 0 and gamma == 1:
+            return None
+        if gamma == 1 and abs(contrast) < 7.9:
+            c = int(contrast * 256 * 16)
+            b = int(100 * brightness + 100) * 511 // 200 - 128 - int(c / 32)
+            return [min(max(((i * c) >> 12) + b, 0), 255) for i in range(256)]
+        lut = []
+        for i in range(256):
+            v = contrast * (i / 255 - 0.5) + 0.5 + brightness
+            if v <= 0:
+                lut.append(0)
+            else:
+                v **= 1 / gamma
+                lut.append(255 if v >= 1 else int(256 * v))
+        return lut
+
+    @staticmethod
+    def _rotate_like_ffmpeg(image: Image.Image, angle: float, fill: int):
+        # vf_rotate turns clockwise about the centre pixel, keeps the frame
+        # size and samples with clamped edges anywhere within a pixel of it
+        w, h = image.size
+        cos, sin = math.cos(angle), math.sin(angle)
+        cx, cy = (w - 1) / 2, (h - 1) / 2
+
+        def affine(offset: float) -> tuple:
+            # output pixel centre -> input pixel, shifted by `offset`
+            c = cx - cos * cx - sin * cy + offset - (cos + sin) / 2
+            f = cy + sin * cx - cos * cy + offset - (cos - sin) / 2
+            return (cos, sin, c, -sin, cos, f)
+
+        padded = Image.new(image.mode, (w + 4, h + 4))
+        padded.paste(image, (2, 2))
+        for box, at in (
+            ((2, 2, w + 2, 3), (2, 0)),
+            ((2, h + 1, w + 2, h + 2), (2, h + 2)),
+            ((2, 0, 3, h + 4), (0, 0)),
+            ((w + 1, 0, w + 2, h + 4), (w + 2, 0)),
+        ):
+            strip = padded.crop(box)
+            size = (2, strip.height) if strip.width == 1 else (strip.width, 2)
+            padded.paste(strip.resize(size, Image.NEAREST), at)
+        rotated = padded.transform((w, h), Image.AFFINE, affine(2.5), Image.BILINEAR)
+        inside = Image.new("L", (w + 2, h + 2), 255).transform(
+            (w, h), Image.AFFINE, affine(1), Image.NEAREST, fillcolor=0
+        )
+        return Image.composite(rotated, Image.new(image.mode, (w, h), fill), inside)
+
+    @staticmethod
+    def _pillow_filter(cmd: str, image: Image.Image, params: dict):
+        # same maths as the ffmpeg filter each command uses (eq, negate,
+        # colorchannelmixer, lutrgb, scale, crop, rotate)
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            transparent = "transparency" in image.info or image.mode.endswith("A")
+            image = image.convert("RGBA" if transparent else "RGB")
+        alpha = image.getchannel("A") if image.mode in ("RGBA", "LA") else None
+        base = image.convert("L" if image.mode in ("L", "LA") else "RGB")
+
+        if cmd in ("contrast", "brightness", "gamma", "saturate"):
+            contrast = min(max(float(params.get("contrast_level", 1)), -1000), 1000)
+            brightness = min(max(float(params.get("brightness_level", 0)), -1), 1)
+            gamma = min(max(float(params.get("gamma_level", 1)), 0.1), 10)
+            saturation = min(max(float(params.get("saturation_level", 1)), 0), 3)
+            luma = MediaProcessor._eq_lut(contrast, brightness, gamma)
+            if alpha is None and base.mode == "L":
+                # gray goes through eq as it is, and has no chroma to saturate
+                if luma is not None:
+                    base = base.point(luma)
+            else:
+                # anything else reaches eq as limited-range yuv(a)444p, so even
+                # a no-op costs ffmpeg this round trip
+                y, u, v = base.convert("RGB").convert("RGB", RGB_TO_YUV).split()
+                chroma = MediaProcessor._eq_lut(saturation, 0, 1)
+                if luma is not None:
+                    y = y.point(luma)
+                if chroma is not None:
+                    u, v = u.point(chroma), v.point(chroma)
+                base = Image.merge("RGB", (y, u, v)).convert("RGB", YUV_TO_RGB)
+        elif cmd == "grayscale":
+            return base.convert("L")
+        elif cmd == "sepia":
+            base = base.convert("RGB").convert(
+                "RGB",
+                (
+                    0.393,
+                    0.769,
+                    0.189,
+                    0,
+                    0.349,
+                    0.686,
+                    0.168,
+                    0,
+                    0.272,
+                    0.534,
+                    0.131,
+                    0,
+                ),
+            )
+        elif cmd == "invert":
+            base = base.point([255 - i for i in range(256)] * len(base.getbands()))
+        elif cmd == "tint":
+            lut = []
+            for band in ("red", "green", "blue"):
+                factor = float(params.get(band, 255)) / 255
+                lut += [min(max(int(i * factor), 0), 255) for i in range(256)]
+            # the ffmpeg path converts to yuv420p, which drops alpha
+            return base.convert("RGB").point(lut)
+        elif cmd == "resize":
+            width, height = int(params["width"]), int(params["height"])
+            if width <= 0 and height <= 0:
+                return None
+            if width <= 0:
+                width = max(round(base.width * height / base.height), 1)
+                width += width % 2 if params["width"] == -2 else 0
+            if height <= 0:
+                height = max(round(base.height * width / base.width), 1)
+                height += height % 2 if params["height"] == -2 else 0
+            base = base.resize((width, height), Image.BICUBIC)
+            if alpha is not None:
+                alpha = alpha.resize((width, height), Image.BICUBIC)
+        elif cmd == "crop":
+            x, y = int(params["x"]), int(params["y"])
+            width, height = int(params["width"]), int(params["height"])
+            if (
+                width <= 0
+                or height <= 0
+                or x < 0
+                or y < 0
+                or x + width > base.width
+                or y + height > base.height
+            ):
+                # let ffmpeg report it
+                return None
+            box = (x, y, x + width, y + height)
+            base = base.crop(box)
+            if alpha is not None:
+                alpha = alpha.crop(box)
+        elif cmd == "rotate":
+            angle = float(params["angle"])
+            base = MediaProcessor._rotate_like_ffmpeg(base, angle, 0)
+            if alpha is not None:
+                # the black fill is opaque
+                alpha = MediaProcessor._rotate_like_ffmpeg(alpha, angle, 255)
+        else:
+            return None
+
+        if alpha is None:
+            return base
+        base = base.convert("RGBA" if base.mode == "RGB" else "LA")
+        base.putalpha(alpha)
+        return base
+
+    async def _run_pillow_filter(self, cmd: str, parsed: dict):
+        input_key = parsed.get("input_key")
+        path = self.media_cache.get(input_key)
+        if not path or Path(path).suffix.lower() not in STILL_IMAGE_CODECS:
+            return None
+
+        params = dict(parsed)
+        try:
+            if cmd in ("resize", "crop"):
+                params["width"] = await self._resolve_dimension(
+                    parsed["width"], input_key, dimension_type="width"
+                )
+                params["height"] = await self._resolve_dimension(
+                    parsed["height"], input_key, dimension_type="height"
+                )
+            if cmd == "crop":
+                params["x"], params["y"] = float(parsed["x"]), float(parsed["y"])
+            image = await self._pillow_image(path)
+            if image is None:
+                return None
+            result = await asyncio.to_thread(self._pillow_filter, cmd, image, params)
+        except (ValueError, TypeError, OSError):
+            return None
+        if result is None:
+            return None
+
+        output_file = self._get_temp_path(Path(path).suffix[1:])
+        self._image_buffers[str(output_file)] = result
+        self.media_cache[parsed["output_key"]] = str(output_file)
+        return f"media://{output_file.as_posix()}"
+
+    async def _plan_script_window(
+        self,
+        lines: list[str],
+        start: int,
+        keep_keys: set,
+        context_key: str,
+        loads_only: bool,
+    ) -> list[dict]:
+        tasks = []
+        writers = {}
+        readers = {}
+        known = set(self.media_cache)
+        idx = start
+        while idx < len(lines):
+            try:
+                parts = shlex.split(lines[idx])
+                cmd = parts[0].lower() if parts else ""
+                if cmd not in self.gscript_commands:
+                    break
+                parsed = await self._parse_command_args(cmd, parts[1:])
+            except ValueError:
+                break
+            # render and export touch the delivered files and the exec
+            # registry, so they always run on their own
+            if cmd in ("render", "export") or (loads_only and cmd != "load"):
+                break
+
+            steps = []
+            if self.fuse_filters and not loads_only:
+                steps = await self._plan_filter_chain(
+                    lines, idx, keep_keys, check_input=False
+                )
+            span = range(idx, idx + max(1, len(steps)))
+            reads, writes, contexts = set(), set(), []
+            for n in span:
+                if n != idx:
+                    parts = shlex.split(lines[n])
+                    cmd = parts[0].lower()
+                    parsed = await self._parse_command_args(cmd, parts[1:])
+                inputs, outputs, text = self._command_keys(cmd, parsed)
+                if not any(p in parsed for p in ("input_key", "base_key", "media_key")):
+                    inputs.add(context_key)
+                known |= outputs
+                inputs |= {
+                    key
+                    for key in known
+                    if re.search(rf"(?<![\w-]){re.escape(key)}", text)
+                    or re.search(rf"(?<![\w-]){re.escape(key.replace('-', '_'))}", text)
+                }
+                contexts.append(context_key)
+                if "output_key" in parsed:
+                    context_key = parsed["output_key"]
+                reads |= inputs
+                writes |= outputs
+            reads.discard(None)
+
+            deps = {writers[k] for k in reads | writes if k in writers}
+            for k in writes:
+                deps.update(readers.pop(k, ()))
+            for k in reads:
+                readers.setdefault(k, set()).add(len(tasks))
+            for k in writes:
+                writers[k] = len(tasks)
+            tasks.append(
+                {
+                    "lines": span,
+                    "contexts": contexts,
+                    "fused": bool(steps),
+                    "deps": sorted(deps),
+                }
+            )
+            idx = span[-1] + 1
+
+        if not tasks:
+            tasks.append(
+                {
+                    "lines": range(start, start + 1),
+                    "contexts": [context_key],
+                    "fused": False,
+                    "deps": [],
+                }
+            )
+        return tasks
+
+    async def _run_script_task(
+        self,
+        lines: list[str],
+        task: dict,
+        keep_keys: set,
+        user_vars: dict,
+        exec_registry: dict,
+    ) -> list[tuple]:
+        if task["fused"]:
+            first = task["lines"][0]
+            try:
+                steps = await self._plan_filter_chain(lines, first, keep_keys)
+                if len(steps) == len(task["lines"]):
+                    result = await self._run_filter_chain(steps)
+                    if result.startswith("media://"):
+                        return [(lines[first], None, steps, result)]
+            except Exception:
+                pass
+            # run the steps one by one to get the usual errors
+
+        outcomes = []
+        for idx, context_key in zip(task["lines"], task["contexts"]):
+            try:
+                cmd, parsed, result = await self._run_script_command(
+                    lines[idx], context_key, user_vars, exec_registry
+                )
+            except Exception as e:
+                cmd, parsed, result = None, None, e
+            outcomes.append((lines[idx], cmd, parsed, result))
+        return outcomes
+
+    async def _run_script_window(
+        self,
+        lines: list[str],
+        tasks: list[dict],
+        keep_keys: set,
+        user_vars: dict,
+        exec_registry: dict,
+    ) -> list[tuple]:
+        futures = []
+
+        async def run(task, deps):
+            if deps:
+                await asyncio.wait(deps)
+            return await self._run_script_task(
+                lines, task, keep_keys, user_vars, exec_registry
+            )
+
+        for task in tasks:
+            deps = [futures[d] for d in task["deps"]]
+            futures.append(asyncio.ensure_future(run(task, deps)))
+        try:
+            results = await asyncio.gather(*futures)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        # report in script order no matter which branch finished first
+        return [outcome for result in results for outcome in result]
+
+    async def execute_media_script(
+        self,
+        script,
+        exec_registry: dict = None,
+        user_vars: dict = None,
+        keep_keys: set = None,
+        finalize: bool = True,
+    ):
+        try:
+            lines = [line.strip() for line in script.splitlines() if line.strip()]
+            output_files = []
+            errors = []
+            last_output_key = None
+            produced_outputs = set()
+            exported_keys = set()
+            final_output_key = None
+            _user_vars: dict = dict(user_vars) if user_vars else {}
+            keep_keys = set(keep_keys or ())
+            cost_checked = not finalize
+            if finalize:
+                problems, dead = await self._analyse_script(lines, keep_keys)
+                if problems:
+                    return problems
+                lines = [line for n, line in enumerate(lines) if n not in dead]
+                self.progress.update(total=len(lines), done=0)
+            i = 0
+
+            while i < len(lines):
+                line = lines[i]
+                if self.progress.cancelled:
+                    return ["Error: GScript job was cancelled."]
+                if self._lease is not None:
+                    # _get_temp_path checks the quota against this figure
+                    await self._lease.refresh(max_age=1.0)
+                if finalize:
+                    self.progress.update(done=i, fraction=0.0, label=line.split()[0])
+                if not cost_checked and line.split()[0].lower() not in ("load", "set"):
+                    # sources are loaded by now, so their real sizes are known
+                    cost_checked = True
+                    cost = await self._estimate_script_cost(lines[i:])
+                    if cost > GSCRIPT_COST_BUDGET:
+                        return [
+                            f"Error: script is too expensive (estimated "
+                            f"{cost:.3g} pixel-frames, budget "
+                            f"{GSCRIPT_COST_BUDGET:.3g})"
+                        ]
+                try:
+                    cmd_head = line.split()[0].lower() if line.split() else ""
+
+                    if cmd_head == "dobetween":
+                        try:
+                            parts = line.split()
+                            if len(parts) < 5:
+                                raise ValueError(
+                                    "dobetween requires input_key, start_time, end_time, output_key"
+                                )
+                            input_key = parts[1]
+                            start = parts[2]
+                            end = parts[3]
+                            output_key = parts[4]
+                            segment_key = parts[5] if len(parts) > 5 else "segment"
+                            sub_script = []
+                            i += 1
+                            while i < len(lines) and lines[i].lower() != "end":
+                                sub_script.append(lines[i])
+                                i += 1
+                            if i >= len(lines):
+                                raise ValueError("Missing 'end' for dobetween")
+
+                            result = await self._memoised(
+                                await self._block_key(
+                                    line, sub_script, _user_vars, output_key
+                                ),
+                                output_key,
+                                lambda: self._dobetween_media(
+                                    input_key=input_key,
+                                    start_time=start,
+                                    end_time=end,
+                                    output_key=output_key,
+                                    segment_key=segment_key,
+                                    sub_script="\n".join(sub_script),
+                                    _exec_registry=exec_registry,
+                                    _user_vars=_user_vars,
+                                ),
+                            )
                             if isinstance(result, str) and result.startswith(
                                 "media://"
                             ):
@@ -1660,13 +3496,19 @@ class MediaProcessor:
                             if i >= len(lines):
                                 raise ValueError("Missing 'end' for foreachframe")
 
-                            result = await self._foreachframe(
-                                input_key=input_key,
-                                output_key=output_key,
-                                frame_dir_key=frame_dir_key,
-                                sub_script="\n".join(sub_script),
-                                _exec_registry=exec_registry,
-                                _user_vars=_user_vars,
+                            result = await self._memoised(
+                                await self._block_key(
+                                    line, sub_script, _user_vars, output_key
+                                ),
+                                output_key,
+                                lambda: self._foreachframe(
+                                    input_key=input_key,
+                                    output_key=output_key,
+                                    frame_dir_key=frame_dir_key,
+                                    sub_script="\n".join(sub_script),
+                                    _exec_registry=exec_registry,
+                                    _user_vars=_user_vars,
+                                ),
                             )
                             if isinstance(result, str) and result.startswith(
                                 "media://"
@@ -1713,69 +3555,34 @@ class MediaProcessor:
                             continue
 
                     else:
-                        try:
-                            parts = shlex.split(line)
-                            if not parts:
-                                i += 1
-                                continue
-
-                            cmd = parts[0].lower()
-                            args = parts[1:]
-
-                            if cmd not in self.gscript_commands:
-                                raise ValueError(f"Unknown command: '{cmd}'")
-
-                            parsed = await self._parse_command_args(cmd, args)
+                        tasks = await self._plan_script_window(
+                            lines,
+                            i,
+                            keep_keys,
+                            last_output_key,
+                            loads_only=not cost_checked,
+                        )
+                        outcomes = await self._run_script_window(
+                            lines, tasks, keep_keys, _user_vars, exec_registry
+                        )
+                        i = tasks[-1]["lines"][-1] + 1
 
-                            context_key = (
-                                parsed.get("input_key")
-                                or parsed.get("base_key")
-                                or parsed.get("media_key")
-                                or last_output_key
-                            )
-                            overlay_key = parsed.get("overlay_key")
-                            _skip_resolve = {
-                                "input_key",
-                                "output_key",
-                                "base_key",
-                                "media_key",
-                                "audio_key",
-                                "overlay_key",
-                                "segment_key",
-                                "registry_key",
-                                "url",
-                                "format",
-                                "text",
-                                "font",
-                                "color",
-                                "background_color",
-                                "outline_color",
-                                "shadow_color",
-                                "codec",
-                            }
-                            for k, v in list(parsed.items()):
-                                if not isinstance(v, str) or k in _skip_resolve:
-                                    continue
-                                try:
-                                    float(v)
-                                    continue
-                                except ValueError:
-                                    pass
-                                resolved = await self._resolve_expr(
-                                    v,
-                                    context_key=context_key,
-                                    overlay_key=overlay_key,
-                                    user_vars=_user_vars,
-                                    as_float=True,
+                        for step_line, cmd, parsed, result in outcomes:
+                            if isinstance(result, Exception):
+                                errors.append(
+                                    await self._handle_error(
+                                        "command", result, f"in line: {step_line}"
+                                    )
                                 )
-                                parsed[k] = str(resolved)
-
-                            if exec_registry is not None:
-                                parsed["_exec_registry"] = exec_registry
-                            parsed["_user_vars"] = _user_vars
-
-                            func = self.gscript_commands[cmd]
-                            result = await func(**parsed)
+                                continue
+                            if cmd is None:
+                                for _, step in parsed:
+                                    produced_outputs.add(step["output_key"])
+                                last_output_key = parsed[-1][1]["output_key"]
+                                final_output_key = last_output_key
+                                if last_output_key not in exported_keys:
+                                    output_files.append(result[8:])
+                                continue
 
                             if cmd == "export":
                                 exported_keys.add(parsed.get("media_key"))
@@ -1793,17 +3600,13 @@ class MediaProcessor:
                                 if parsed.get("output_key") not in exported_keys:
                                     output_files.append(path)
                             if isinstance(result, str) and result.startswith("Error"):
-                                raise RuntimeError(result)
-
-                            i += 1
-                        except Exception as e:
-                            errors.append(
-                                await self._handle_error(
-                                    "command", e, f"in line: {line}"
+                                errors.append(
+                                    await self._handle_error(
+                                        "command",
+                                        RuntimeError(result),
+                                        f"in line: {step_line}",
+                                    )
                                 )
-                            )
-                            i += 1
-                            continue
 
                 except Exception as e:
                     errors.append(
@@ -1812,6 +3615,7 @@ class MediaProcessor:
                     i += 1
                     continue
 
+            await self._flush_images()
             exported_paths = {
                 self.media_cache[k] for k in exported_keys if k in self.media_cache
             }
@@ -1824,8 +3628,15 @@ class MediaProcessor:
             ):
                 final_path = self.media_cache.get(final_output_key)
                 if final_path and os.path.exists(final_path):
+                    if finalize:
+                        final_path = str(await self._deliver(Path(final_path)))
                     return [final_path]
 
+            if finalize and not errors:
+                output_files = [
+                    str(await self._deliver(Path(p))) if os.path.exists(p) else p
+                    for p in output_files
+                ]
             return errors if errors else output_files
 
         except Exception as e:
@@ -1851,64 +3662,24 @@ class MediaProcessor:
             entry = exec_registry.get(reg_key)
             if not entry:
                 return f"Error: '{url}' not found in exec file registry. "
-            reg_bytes, reg_filename = entry
+            reg_path, reg_filename = entry
             ext = Path(reg_filename).suffix.lstrip(".")
             temp_file = self._get_temp_path(ext)
-            with temp_file.open("wb") as f:
-                f.write(reg_bytes)
+            await asyncio.to_thread(shutil.copyfile, reg_path, temp_file)
             self.media_cache[media_key] = str(temp_file)
             return f"Loaded {media_key} from {reg_key} ({reg_filename})"
 
         try:
-            temp_file = self._get_temp_path()
-            ydl_opts = {
-                "quiet": True,
-                "no_warnings": True,
-                "outtmpl": f"{temp_file}.%(ext)s",
-                "noplaylist": True,
-            }
-
-            def sync_ydl_download():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    return ydl.prepare_filename(info)
-
-            downloaded_path = await asyncio.get_event_loop().run_in_executor(
-                None, sync_ydl_download
+            temp_file, digest = await MEDIA_DOWNLOAD_CACHE.fetch(
+                url, self._get_temp_path
             )
-            downloaded_path = Path(downloaded_path)
-
-            if not downloaded_path.exists():
-                raise RuntimeError("Downloaded file not found")
-
-            ext = downloaded_path.suffix[1:]
-            final_temp_file = self._get_temp_path(ext)
-
-            shutil.move(str(downloaded_path), final_temp_file)
-            downloaded_path.unlink(missing_ok=True)
-
-            self.media_cache[media_key] = str(final_temp_file)
-            return f"Loaded {media_key} via yt-dlp"
-
-        except Exception:
-            try:
-                await self.ensure_session()
-                async with self.session.get(url) as resp:
-                    if resp.status != 200:
-                        return f"HTTP Error {resp.status}"
-
-                    ext = Path(url.split("?")[0]).suffix[1:]
-                    temp_file = self._get_temp_path(ext)
-
-                    with temp_file.open("wb") as f:
-                        async for chunk in resp.content.iter_chunked(8192):
-                            f.write(chunk)
-
-                    self.media_cache[media_key] = str(temp_file)
-                    return f"Loaded {media_key}"
+        except Exception as e:
+            return f"Download error: {str(e)}"
 
-            except Exception as http_error:
-                return f"Download error: {str(http_error)}"
+        # the cache already hashed the content, no need to do it again
+        self._content_ids[str(temp_file)] = digest
+        self.media_cache[media_key] = str(temp_file)
+        return f"Loaded {media_key}"
 
     async def _export_media(self, **kwargs) -> str:
         try:
@@ -1924,11 +3695,11 @@ class MediaProcessor:
             path = Path(self.media_cache[media_key])
             if not path.exists():
                 return f"Error: file for '{media_key}' no longer exists on disk"
+            path = await self._deliver(path)
 
-            with path.open("rb") as f:
-                file_bytes = f.read()
-
-            exec_registry[registry_key] = (file_bytes, path.name)
+            spooled = exec_registry.spool_path(path.name)
+            await asyncio.to_thread(shutil.copyfile, path, spooled)
+            exec_registry[registry_key] = (spooled, path.name)
             return f"Exported {media_key} -> registry as {registry_key} ({path.name})"
         except Exception as e:
             return await self._handle_error("export", e)
@@ -2015,6 +3786,11 @@ class MediaProcessor:
             return f"Error: Missing input keys: {', '.join(missing)}"
 
         input_paths = [Path(self.media_cache[k]) for k in input_keys]
+        if len(input_paths) > 1:
+            joined = await self._concat_copy(input_paths)
+            if joined:
+                self.media_cache[output_key] = str(joined)
+                return f"media://{joined.as_posix()}"
 
         def is_video(p: Path) -> bool:
             return p.suffix.lower() in (".mp4", ".mov", ".webm", ".mkv", ".avi", ".wmv")
@@ -2249,21 +4025,29 @@ class MediaProcessor:
                 output_format.split("/")[-1] if "/" in output_format else output_format,
             )
 
-            new_path = self._get_temp_path(new_ext)
-            cmd = [
-                "ffmpeg",
-                "-hide_banner",
-                "-i",
-                path.as_posix(),
-                "-y",
-                new_path.as_posix(),
-            ]
+            key = await self._encode_key("render", path, new_ext)
+            new_path = key and await self._restore_step(key)
+            if not new_path:
+                new_path = self._get_temp_path(new_ext)
+                cmd = [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-i",
+                    path.as_posix(),
+                ]
+                if str(path) in self._intermediate_files or self.size_limit:
+                    cmd += await self._delivery_args(path, new_path.suffix.lower())
+                cmd += ["-y", new_path.as_posix()]
 
-            success, error = await self._run_ffmpeg(cmd)
-            if not success:
-                return error
+                success, error = await self._run_ffmpeg(cmd, intermediate=False)
+                if not success:
+                    return error
+                if key:
+                    await self._save_step(key, str(new_path))
 
             path = new_path
+        else:
+            path = await self._deliver(path)
 
         if output_filename:
             final_path = self._get_temp_path(path.suffix[1:])
@@ -2601,6 +4385,8 @@ class MediaProcessor:
         output_file = self._get_temp_path(input_path.suffix[1:])
 
         shutil.copy(input_path, output_file)
+        if str(input_path) in self._intermediate_files:
+            self._intermediate_files.add(str(output_file))
 
         self.media_cache[output_key] = str(output_file)
         return f"media://{output_file.as_posix()}"
@@ -3011,6 +4797,14 @@ class MediaProcessor:
             return f"Error: {input_key} not found"
 
         input_path = Path(self.media_cache[input_key])
+        copied = await self._copy_cut(
+            input_path,
+            self._timestamp_seconds(start_time),
+            self._timestamp_seconds(end_time),
+        )
+        if copied:
+            self.media_cache[output_key] = str(copied)
+            return f"media://{copied.as_posix()}"
         output_file = self._get_temp_path(input_path.suffix[1:])
 
         cmd = [
@@ -3387,53 +5181,32 @@ class MediaProcessor:
         except Exception as e:
             return await self._handle_error("text", e)
 
+    @staticmethod
+    def _decode_emoji(data: bytes) -> Image.Image:
+        emoji_img = Image.open(BytesIO(data))
+        if getattr(emoji_img, "is_animated", False):
+            emoji_img.seek(0)
+        return emoji_img.convert("RGBA")
+
+    async def _fetch_emoji_image(self, url: str):
+        async with self.session.get(url) as resp:
+            if resp.status != 200:
+                return None
+            emoji_data = await resp.read()
+        return await asyncio.to_thread(self._decode_emoji, emoji_data)
+
     async def _fetch_discord_emoji(self, emoji_id: str, animated: bool = False):
         try:
-            async with aiohttp.ClientSession() as session:
-                if animated:
-                    url = f"https://cdn.discordapp.com/emojis/{emoji_id}.gif"
-                    async with session.get(url) as resp:
-                        if resp.status == 200:
-                            emoji_data = await resp.read()
-                            emoji_img = await asyncio.to_thread(
-                                Image.open, BytesIO(emoji_data)
-                            )
-
-                            if getattr(emoji_img, "is_animated", False):
-                                emoji_img.seek(0)
-
-                            if emoji_img.mode != "RGBA":
-                                emoji_img = await asyncio.to_thread(
-                                    emoji_img.convert, "RGBA"
-                                )
-                            return emoji_img
-
-                url = f"https://cdn.discordapp.com/emojis/{emoji_id}.webp"
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        emoji_data = await resp.read()
-                        emoji_img = await asyncio.to_thread(
-                            Image.open, BytesIO(emoji_data)
-                        )
-                        if emoji_img.mode != "RGBA":
-                            emoji_img = await asyncio.to_thread(
-                                emoji_img.convert, "RGBA"
-                            )
-                        return emoji_img
-
-                url = f"https://cdn.discordapp.com/emojis/{emoji_id}.png"
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        emoji_data = await resp.read()
-                        emoji_img = await asyncio.to_thread(
-                            Image.open, BytesIO(emoji_data)
-                        )
-                        if emoji_img.mode != "RGBA":
-                            emoji_img = await asyncio.to_thread(
-                                emoji_img.convert, "RGBA"
-                            )
-                        return emoji_img
-
+            await self.ensure_session()
+            # the CDN serves every static emoji as webp; png and the gif for
+            # animated ones are fallbacks
+            extensions = ("gif", "webp", "png") if animated else ("webp", "png")
+            for extension in extensions:
+                emoji_img = await self._fetch_emoji_image(
+                    f"https://cdn.discordapp.com/emojis/{emoji_id}.{extension}"
+                )
+                if emoji_img is not None:
+                    return emoji_img
         except Exception:
             return None
         return None
@@ -3448,284 +5221,352 @@ class MediaProcessor:
 
             url = f"https://cdn.jsdelivr.net/gh/jdecked/twemoji@latest/assets/72x72/{codepoints}.png"
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        emoji_data = await resp.read()
-                        emoji_img = await asyncio.to_thread(
-                            Image.open, BytesIO(emoji_data)
-                        )
-                        return await asyncio.to_thread(emoji_img.convert, "RGBA")
+            await self.ensure_session()
+            return await self._fetch_emoji_image(url)
         except Exception:
             return None
-        return None
 
-    async def _text_impl(self, **kwargs) -> str:
-        def get_text_size(font, text):
-            bbox = font.getbbox(text)
-            width = bbox[2] - bbox[0]
-            height = bbox[3] - bbox[1]
-            return width, height
-
-        def get_visual_width(text, font, font_size):
-            width = 0
-            i = 0
-            emoji_positions = {
-                e["match_start"]: e["emoji"] for e in emoji_lib.emoji_list(text)
-            }
-            while i < len(text):
-                if text[i:].startswith("<") and ":" in text[i:]:
-                    m = re.match(r"<(a?):([^:]+):(\d+)>", text[i:])
-                    if m:
-                        width += font_size
-                        i += len(m.group(0))
-                        continue
-                if i in emoji_positions:
+    @staticmethod
+    def _get_text_size(font, text):
+        bbox = font.getbbox(text)
+        width = bbox[2] - bbox[0]
+        height = bbox[3] - bbox[1]
+        return width, height
+
+    @staticmethod
+    def _get_visual_width(text, font, font_size):
+        width = 0
+        i = 0
+        emoji_positions = {
+            e["match_start"]: e["emoji"] for e in emoji_lib.emoji_list(text)
+        }
+        while i < len(text):
+            if text[i:].startswith("<") and ":" in text[i:]:
+                m = re.match(r"<(a?):([^:]+):(\d+)>", text[i:])
+                if m:
                     width += font_size
-                    i += len(emoji_positions[i])
+                    i += len(m.group(0))
                     continue
-                width += font.getlength(text[i])
-                i += 1
-            return int(width)
-
-        def wrap_text(text, font, font_size, max_width):
-            words = text.split(" ")
-            lines = []
-            current_line = ""
-            for word in words:
-                test_line = current_line + word + " "
-                if get_visual_width(test_line, font, font_size) <= max_width:
-                    current_line = test_line
-                else:
-                    lines.append(current_line.rstrip())
-                    current_line = word + " "
-            if current_line:
+            if i in emoji_positions:
+                width += font_size
+                i += len(emoji_positions[i])
+                continue
+            width += font.getlength(text[i])
+            i += 1
+        return int(width)
+
+    @classmethod
+    def _wrap_text(cls, text, font, font_size, max_width):
+        words = text.split(" ")
+        lines = []
+        current_line = ""
+        for word in words:
+            test_line = current_line + word + " "
+            if cls._get_visual_width(test_line, font, font_size) <= max_width:
+                current_line = test_line
+            else:
                 lines.append(current_line.rstrip())
-            return lines
+                current_line = word + " "
+        if current_line:
+            lines.append(current_line.rstrip())
+        return lines
+
+    @staticmethod
+    def _text_layer_cache_key(**params) -> Union[str, None]:
+        # Random colours must be re-rolled on every call, so they are never cached.
+        for name in ("color", "outline_color", "shadow_color", "background_color"):
+            value = params.get(name)
+            if value and "rand" in str(value).lower():
+                return None
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
+    @staticmethod
+    def _composite_text_layers(base_img: Image.Image, layers: dict) -> Image.Image:
+        if layers.get("shadow") is not None:
+            base_img = Image.alpha_composite(base_img, layers["shadow"])
+        if layers.get("outline") is not None:
+            base_img = Image.alpha_composite(base_img, layers["outline"])
+        if layers.get("text_mask") is not None:
+            fill = layers["text_fill"]
+            if isinstance(fill, Image.Image):
+                base_img = Image.composite(fill, base_img, layers["text_mask"])
+            else:
+                ImageDraw.Draw(base_img).bitmap((0, 0), layers["text_mask"], fill=fill)
+        if layers.get("emoji") is not None:
+            base_img = Image.alpha_composite(base_img, layers["emoji"])
+        return base_img
+
+    @staticmethod
+    def _image_size(path) -> tuple:
+        with Image.open(path) as img:
+            return img.size
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _render_font(path, size: int):
+        # render workers reload fonts by path, once each
+        if path is None:
+            return ImageFont.load_default()
+        return ImageFont.truetype(path, size)
+
+    @classmethod
+    def _draw_text(
+        cls, base_img: Image.Image, spec: dict, layers: dict = None
+    ) -> tuple[Image.Image, dict, bool]:
+        font_size = spec["font_size"]
+        line_spacing = spec["line_spacing"]
+        font = cls._render_font(spec["font_path"], font_size)
+
+        if spec["wrap_width"]:
+            lines = cls._wrap_text(spec["text"], font, font_size, spec["wrap_width"])
+        else:
+            lines = [spec["text"]]
+
+        text_width = max(cls._get_visual_width(line, font, font_size) for line in lines)
+        text_height_total = (
+            sum(cls._get_text_size(font, line)[1] + line_spacing for line in lines)
+            - line_spacing
+        )
+
+        center_x = spec["x"] == "center"
+        if center_x:
+            x = (base_img.width - text_width) // 2
+        else:
+            x = max(0, min(spec["x"], base_img.width - text_width))
+        if spec["y"] == "center":
+            y = (base_img.height - text_height_total) // 2
+        else:
+            y = max(0, min(spec["y"], base_img.height - text_height_total))
+
+        complete = True
+        if layers is None:
+            layers, complete = cls._draw_text_layers(
+                size=base_img.size,
+                lines=lines,
+                x=x,
+                y=y,
+                center_x=center_x,
+                font=font,
+                font_size=font_size,
+                color=spec["color"],
+                emoji=spec["emoji"],
+                outline_color=spec["outline_color"],
+                outline_width=spec["outline_width"],
+                shadow_color=spec["shadow_color"],
+                shadow_offset=spec["shadow_offset"],
+                shadow_blur=spec["shadow_blur"],
+                line_spacing=line_spacing,
+                preserve_emoji_colors=spec["preserve_emoji_colors"],
+            )
+        return cls._composite_text_layers(base_img, layers), layers, complete
+
+    @classmethod
+    def _render_text_job(
+        cls,
+        input_path: str,
+        output_path: str,
+        spec: dict,
+        layers: dict,
+        size: tuple = None,
+    ) -> tuple[dict, bool]:
+        if input_path is None:
+            # animated inputs only get the text layer, ffmpeg composites it
+            base_img = Image.new("RGBA", size, (0, 0, 0, 0))
+        else:
+            with Image.open(input_path) as img:
+                base_img = img.convert("RGBA")
+        base_img, layers, complete = cls._draw_text(base_img, spec, layers)
+        base_img.save(output_path)
+        # fresh layers only travel back when the caller is going to cache them
+        return (layers if spec["keep_layers"] else None), complete
+
+    async def _prefetch_emoji(self, text: str) -> dict:
+        # every emoji in the text, fetched together before layout starts
+        fetches = {}
+        for match in re.finditer(r"<(a?):([^:]+):(\d+)>", text):
+            fetches.setdefault(
+                ("custom", match.group(3)),
+                (self._fetch_discord_emoji, match.group(3), match.group(1) == "a"),
+            )
+        for found in emoji_lib.emoji_list(text):
+            fetches.setdefault(found["emoji"], (self._download_twemoji, found["emoji"]))
+        if not fetches:
+            return {}
+
+        await self.ensure_session()
+        semaphore = asyncio.Semaphore(EMOJI_FETCH_CONCURRENCY)
+
+        async def fetch(func, *args):
+            async with semaphore:
+                return await func(*args)
+
+        images = await asyncio.gather(*(fetch(*job) for job in fetches.values()))
+        return {key: img for key, img in zip(fetches, images) if img is not None}
+
+    async def _finish_text_spec(
+        self, spec: dict, font_name: str, fetch_emoji: bool = True
+    ) -> None:
+        # everything a render job needs from the network or the font lookup
+        font = await self.load_font(font_name, spec["font_size"])
+        path = getattr(font, "path", None)
+        spec["font_path"] = path if isinstance(path, str) else None
+        spec["emoji"] = await self._prefetch_emoji(spec["text"]) if fetch_emoji else {}
+
+    async def _text_impl(self, **kwargs) -> str:
         try:
             input_key = kwargs["input_key"]
-            text = kwargs["text"]
-            text = emoji_lib.emojize(text, language="alias")
             x_raw = kwargs.get("x", "0")
             y_raw = kwargs.get("y", "0")
-            font_size = kwargs["font_size"]
-            color = kwargs["color"]
             output_key = kwargs["output_key"]
             font_name = kwargs["font"]
-            preserve_emoji_colors = kwargs.get("preserve_emoji_colors", True)
-
-            outline_color = kwargs.get("outline_color", None)
-            outline_width = kwargs.get("outline_width", None)
-
-            shadow_color = kwargs.get("shadow_color", None)
-            shadow_offset = kwargs.get("shadow_offset", 2)
-            shadow_blur = kwargs.get("shadow_blur", 0)
-
-            wrap_width = kwargs.get("wrap_width", None)
-            line_spacing = kwargs.get("line_spacing", 5)
 
             if input_key not in self.media_cache:
                 return f"Error: {input_key} not found"
 
             input_path = Path(self.media_cache[input_key])
-            base_img = await asyncio.to_thread(Image.open, input_path)
-            base_img = await asyncio.to_thread(base_img.convert, "RGBA")
-
-            font = await self.load_font(font_name, font_size)
-            if not isinstance(font, ImageFont.FreeTypeFont):
-                font = await asyncio.to_thread(ImageFont.load_default)
-
-            draw = await asyncio.to_thread(ImageDraw.Draw, base_img)
-
-            if wrap_width:
-                lines = await asyncio.to_thread(
-                    wrap_text, text, font, font_size, wrap_width
-                )
-            else:
-                lines = [text]
-
-            text_width = max(get_visual_width(line, font, font_size) for line in lines)
-            text_height_total = (
-                sum(get_text_size(font, line)[1] + line_spacing for line in lines)
-                - line_spacing
-            )
-
-            if str(x_raw).lower() == "center":
-                x = (base_img.width - text_width) // 2
+            animated = input_path.suffix.lower() in (".gif", *INTERMEDIATE_SUFFIXES)
+            if animated:
+                width, height, _, _ = await self._probe_media_info(input_path)
+                size = (width, height)
             else:
-                x = await self._resolve_dimension(
-                    x_raw, input_key, dimension_type="width"
-                )
-                x = max(0, min(x, base_img.width - text_width))
-
-            if str(y_raw).lower() == "center":
-                y = (base_img.height - text_height_total) // 2
-            else:
-                y = await self._resolve_dimension(
-                    y_raw, input_key, dimension_type="height"
-                )
-                y = max(0, min(y, base_img.height - text_height_total))
-
-            txt_layer = await asyncio.to_thread(Image.new, "L", base_img.size, 0)
-            txt_draw = await asyncio.to_thread(ImageDraw.Draw, txt_layer)
-
-            emoji_layer = await asyncio.to_thread(
-                Image.new, "RGBA", base_img.size, (0, 0, 0, 0)
-            )
+                size = await asyncio.to_thread(self._image_size, input_path)
 
-            cur_y = y
-            for line in lines:
-                line_width = get_visual_width(line, font, font_size)
-                line_height = get_text_size(font, line)[1]
-                emoji_positions = {
-                    e["match_start"]: e["emoji"] for e in emoji_lib.emoji_list(line)
-                }
-                cur_x = (
-                    (base_img.width - line_width) // 2
+            spec = {
+                "text": emoji_lib.emojize(kwargs["text"], language="alias"),
+                "x": (
+                    "center"
                     if str(x_raw).lower() == "center"
-                    else x
+                    else await self._resolve_dimension(
+                        x_raw, input_key, dimension_type="width"
+                    )
+                ),
+                "y": (
+                    "center"
+                    if str(y_raw).lower() == "center"
+                    else await self._resolve_dimension(
+                        y_raw, input_key, dimension_type="height"
+                    )
+                ),
+                "font_size": kwargs["font_size"],
+                "color": kwargs["color"],
+                "outline_color": kwargs.get("outline_color", None),
+                "outline_width": kwargs.get("outline_width", None),
+                "shadow_color": kwargs.get("shadow_color", None),
+                "shadow_offset": kwargs.get("shadow_offset", 2),
+                "shadow_blur": kwargs.get("shadow_blur", 0),
+                "wrap_width": kwargs.get("wrap_width", None),
+                "line_spacing": kwargs.get("line_spacing", 5),
+                "preserve_emoji_colors": kwargs.get("preserve_emoji_colors", True),
+            }
+            cache_key = self._text_layer_cache_key(
+                kind="text", size=size, font=font_name, **spec
+            )
+            layers = TEXT_LAYER_CACHE.get(cache_key) if cache_key else None
+            await self._finish_text_spec(spec, font_name, fetch_emoji=layers is None)
+            spec["keep_layers"] = bool(cache_key) and layers is None
+
+            if animated:
+                layer_file = self._get_temp_path("png")
+                new_layers, complete = await RENDER_POOL.run(
+                    self._render_text_job, None, str(layer_file), spec, layers, size
                 )
-                char_x = cur_x
-                i = 0
-                while i < len(line):
-                    char = line[i]
-
-                    if line[i:].startswith("<") and ":" in line[i:]:
-                        custom_match = re.match(r"<(a?):([^:]+):(\d+)>", line[i:])
-                        if custom_match:
-                            animated = custom_match.group(1) == "a"
-                            emoji_id = custom_match.group(3)
-                            emoji_len = len(custom_match.group(0))
-
-                            emoji_img = await self._fetch_discord_emoji(
-                                emoji_id, animated
-                            )
-                            if emoji_img:
-                                emoji_size = int(font_size)
-                                emoji_img = await asyncio.to_thread(
-                                    emoji_img.resize, (emoji_size, emoji_size)
-                                )
-
-                                if preserve_emoji_colors:
-                                    await asyncio.to_thread(
-                                        emoji_layer.paste,
-                                        emoji_img,
-                                        (char_x, cur_y),
-                                        emoji_img,
-                                    )
-                                else:
-                                    color_result = await asyncio.to_thread(
-                                        self._parse_color, color, emoji_img.size
-                                    )
+            else:
+                output_file = self._get_temp_path("png")
+                new_layers, complete = await RENDER_POOL.run(
+                    self._render_text_job,
+                    str(input_path),
+                    str(output_file),
+                    spec,
+                    layers,
+                )
+            if new_layers is not None and complete:
+                TEXT_LAYER_CACHE.put(cache_key, new_layers)
 
-                                    if isinstance(color_result, tuple):
-                                        tinted_data = []
-                                        original_data = emoji_img.getdata()
-                                        tint_color = color_result
-
-                                        for original_pixel in original_data:
-                                            alpha = original_pixel[3]
-                                            if alpha > 0:
-                                                luminance = int(
-                                                    0.299 * original_pixel[0]
-                                                    + 0.587 * original_pixel[1]
-                                                    + 0.114 * original_pixel[2]
-                                                )
-                                                factor = luminance / 255.0
-                                                r = int(tint_color[0] * factor)
-                                                g = int(tint_color[1] * factor)
-                                                b = int(tint_color[2] * factor)
-                                                tinted_pixel = (r, g, b, alpha)
-                                            else:
-                                                tinted_pixel = (0, 0, 0, 0)
-                                            tinted_data.append(tinted_pixel)
-
-                                        tinted = await asyncio.to_thread(
-                                            Image.new, "RGBA", emoji_img.size
-                                        )
-                                        await asyncio.to_thread(
-                                            tinted.putdata, tinted_data
-                                        )
-                                    else:
-                                        gradient_img = color_result
-                                        tinted = await asyncio.to_thread(
-                                            Image.new, "RGBA", emoji_img.size
-                                        )
-                                        original_data = emoji_img.getdata()
-                                        if gradient_img.size != emoji_img.size:
-                                            gradient_img = await asyncio.to_thread(
-                                                gradient_img.resize, emoji_img.size
-                                            )
-                                        gradient_data = gradient_img.getdata()
+            if animated:
+                output_file = self._get_temp_path(input_path.suffix[1:])
+                success, error = await self._run_ffmpeg(
+                    self._layer_overlay_cmd(input_path, layer_file, output_file, size)
+                )
+                if not success:
+                    return error
 
-                                        tinted_data = []
-                                        for original_pixel, gradient_pixel in zip(
-                                            original_data, gradient_data
-                                        ):
-                                            alpha = original_pixel[3]
-                                            if alpha > 0:
-                                                luminance = int(
-                                                    0.299 * original_pixel[0]
-                                                    + 0.587 * original_pixel[1]
-                                                    + 0.114 * original_pixel[2]
-                                                )
-                                                factor = luminance / 255.0
-                                                r = int(gradient_pixel[0] * factor)
-                                                g = int(gradient_pixel[1] * factor)
-                                                b = int(gradient_pixel[2] * factor)
-                                                tinted_pixel = (r, g, b, alpha)
-                                            else:
-                                                tinted_pixel = (0, 0, 0, 0)
-                                            tinted_data.append(tinted_pixel)
-
-                                        await asyncio.to_thread(
-                                            tinted.putdata, tinted_data
-                                        )
+            self.media_cache[output_key] = str(output_file)
+            return f"media://{output_file.as_posix()}"
 
-                                    await asyncio.to_thread(
-                                        emoji_layer.paste,
-                                        tinted,
-                                        (char_x, cur_y),
-                                        tinted,
-                                    )
+        except Exception as e:
+            return f"Text error: {str(e)}"
 
-                                char_x += emoji_size
-                            else:
-                                await asyncio.to_thread(
-                                    txt_draw.text,
-                                    (char_x, cur_y),
-                                    char,
-                                    font=font,
-                                    fill=255,
-                                )
-                                char_x += get_text_size(font, char)[0]
+    @classmethod
+    def _draw_text_layers(
+        cls,
+        size: tuple,
+        lines: list[str],
+        x: int,
+        y: int,
+        center_x: bool,
+        font: ImageFont.FreeTypeFont,
+        font_size: int,
+        color: str,
+        emoji: dict,
+        outline_color: str = None,
+        outline_width: int = None,
+        shadow_color: str = None,
+        shadow_offset: int = 2,
+        shadow_blur: int = 0,
+        line_spacing: int = 5,
+        preserve_emoji_colors: bool = True,
+    ) -> tuple[dict, bool]:
+        layers = {
+            "shadow": None,
+            "outline": None,
+            "text_mask": None,
+            "text_fill": None,
+            "emoji": None,
+        }
+        # Emoji that failed to download fall back to plain glyphs; such a render
+        # is still returned but must not be cached.
+        complete = True
 
-                            i += emoji_len
-                            continue
+        txt_layer = Image.new("L", size, 0)
+        txt_draw = ImageDraw.Draw(txt_layer)
 
-                    if i in emoji_positions:
-                        emoji_str = emoji_positions[i]
-                        emoji_end = i + len(emoji_str)
+        emoji_layer = Image.new("RGBA", size, (0, 0, 0, 0))
 
-                        emoji_img = await self._download_twemoji(emoji_str)
+        cur_y = y
+        for line in lines:
+            line_width = cls._get_visual_width(line, font, font_size)
+            line_height = cls._get_text_size(font, line)[1]
+            emoji_positions = {
+                e["match_start"]: e["emoji"] for e in emoji_lib.emoji_list(line)
+            }
+            cur_x = (size[0] - line_width) // 2 if center_x else x
+            char_x = cur_x
+            i = 0
+            while i < len(line):
+                char = line[i]
+
+                if line[i:].startswith("<") and ":" in line[i:]:
+                    custom_match = re.match(r"<(a?):([^:]+):(\d+)>", line[i:])
+                    if custom_match:
+                        emoji_id = custom_match.group(3)
+                        emoji_len = len(custom_match.group(0))
+
+                        emoji_img = emoji.get(("custom", emoji_id))
+                        if emoji_img is None:
+                            complete = False
                         if emoji_img:
                             emoji_size = int(font_size)
-                            emoji_img = await asyncio.to_thread(
-                                emoji_img.resize, (emoji_size, emoji_size)
-                            )
+                            emoji_img = emoji_img.resize((emoji_size, emoji_size))
 
                             if preserve_emoji_colors:
-                                await asyncio.to_thread(
-                                    emoji_layer.paste,
+                                emoji_layer.paste(
                                     emoji_img,
                                     (char_x, cur_y),
                                     emoji_img,
                                 )
                             else:
-                                color_result = await asyncio.to_thread(
-                                    self._parse_color, color, emoji_img.size
-                                )
+                                color_result = cls._parse_color(color, emoji_img.size)
 
                                 if isinstance(color_result, tuple):
                                     tinted_data = []
@@ -3749,19 +5590,15 @@ class MediaProcessor:
                                             tinted_pixel = (0, 0, 0, 0)
                                         tinted_data.append(tinted_pixel)
 
-                                    tinted = await asyncio.to_thread(
-                                        Image.new, "RGBA", emoji_img.size
-                                    )
-                                    await asyncio.to_thread(tinted.putdata, tinted_data)
+                                    tinted = Image.new("RGBA", emoji_img.size)
+                                    tinted.putdata(tinted_data)
                                 else:
                                     gradient_img = color_result
-                                    tinted = await asyncio.to_thread(
-                                        Image.new, "RGBA", emoji_img.size
-                                    )
+                                    tinted = Image.new("RGBA", emoji_img.size)
                                     original_data = emoji_img.getdata()
                                     if gradient_img.size != emoji_img.size:
-                                        gradient_img = await asyncio.to_thread(
-                                            gradient_img.resize, emoji_img.size
+                                        gradient_img = gradient_img.resize(
+                                            emoji_img.size
                                         )
                                     gradient_data = gradient_img.getdata()
 
@@ -3785,10 +5622,9 @@ class MediaProcessor:
                                             tinted_pixel = (0, 0, 0, 0)
                                         tinted_data.append(tinted_pixel)
 
-                                    await asyncio.to_thread(tinted.putdata, tinted_data)
+                                    tinted.putdata(tinted_data)
 
-                                await asyncio.to_thread(
-                                    emoji_layer.paste,
+                                emoji_layer.paste(
                                     tinted,
                                     (char_x, cur_y),
                                     tinted,
@@ -3796,227 +5632,267 @@ class MediaProcessor:
 
                             char_x += emoji_size
                         else:
-                            await asyncio.to_thread(
-                                txt_draw.text,
+                            txt_draw.text(
                                 (char_x, cur_y),
                                 char,
                                 font=font,
                                 fill=255,
                             )
-                            char_x += get_text_size(font, char)[0]
+                            char_x += cls._get_text_size(font, char)[0]
 
-                        i = emoji_end
+                        i += emoji_len
                         continue
 
+                if i in emoji_positions:
+                    emoji_str = emoji_positions[i]
+                    emoji_end = i + len(emoji_str)
+
+                    emoji_img = emoji.get(emoji_str)
+                    if emoji_img is None:
+                        complete = False
+                    if emoji_img:
+                        emoji_size = int(font_size)
+                        emoji_img = emoji_img.resize((emoji_size, emoji_size))
+
+                        if preserve_emoji_colors:
+                            emoji_layer.paste(
+                                emoji_img,
+                                (char_x, cur_y),
+                                emoji_img,
+                            )
+                        else:
+                            color_result = cls._parse_color(color, emoji_img.size)
+
+                            if isinstance(color_result, tuple):
+                                tinted_data = []
+                                original_data = emoji_img.getdata()
+                                tint_color = color_result
+
+                                for original_pixel in original_data:
+                                    alpha = original_pixel[3]
+                                    if alpha > 0:
+                                        luminance = int(
+                                            0.299 * original_pixel[0]
+                                            + 0.587 * original_pixel[1]
+                                            + 0.114 * original_pixel[2]
+                                        )
+                                        factor = luminance / 255.0
+                                        r = int(tint_color[0] * factor)
+                                        g = int(tint_color[1] * factor)
+                                        b = int(tint_color[2] * factor)
+                                        tinted_pixel = (r, g, b, alpha)
+                                    else:
+                                        tinted_pixel = (0, 0, 0, 0)
+                                    tinted_data.append(tinted_pixel)
+
+                                tinted = Image.new("RGBA", emoji_img.size)
+                                tinted.putdata(tinted_data)
+                            else:
+                                gradient_img = color_result
+                                tinted = Image.new("RGBA", emoji_img.size)
+                                original_data = emoji_img.getdata()
+                                if gradient_img.size != emoji_img.size:
+                                    gradient_img = gradient_img.resize(emoji_img.size)
+                                gradient_data = gradient_img.getdata()
+
+                                tinted_data = []
+                                for original_pixel, gradient_pixel in zip(
+                                    original_data, gradient_data
+                                ):
+                                    alpha = original_pixel[3]
+                                    if alpha > 0:
+                                        luminance = int(
+                                            0.299 * original_pixel[0]
+                                            + 0.587 * original_pixel[1]
+                                            + 0.114 * original_pixel[2]
+                                        )
+                                        factor = luminance / 255.0
+                                        r = int(gradient_pixel[0] * factor)
+                                        g = int(gradient_pixel[1] * factor)
+                                        b = int(gradient_pixel[2] * factor)
+                                        tinted_pixel = (r, g, b, alpha)
+                                    else:
+                                        tinted_pixel = (0, 0, 0, 0)
+                                    tinted_data.append(tinted_pixel)
+
+                                tinted.putdata(tinted_data)
+
+                            emoji_layer.paste(
+                                tinted,
+                                (char_x, cur_y),
+                                tinted,
+                            )
+
+                        char_x += emoji_size
                     else:
-                        await asyncio.to_thread(
-                            txt_draw.text, (char_x, cur_y), char, font=font, fill=255
+                        txt_draw.text(
+                            (char_x, cur_y),
+                            char,
+                            font=font,
+                            fill=255,
                         )
-                        char_x += get_text_size(font, char)[0]
-                        i += 1
+                        char_x += cls._get_text_size(font, char)[0]
 
-                cur_y += line_height + line_spacing
+                    i = emoji_end
+                    continue
 
-            if shadow_color:
-                shadow_layer = await asyncio.to_thread(Image.new, "L", base_img.size, 0)
-                shadow_draw = await asyncio.to_thread(ImageDraw.Draw, shadow_layer)
-                ox = int(shadow_offset)
-                oy = int(shadow_offset)
-
-                cur_y = y
-                for line in lines:
-                    line_width = get_visual_width(line, font, font_size)
-                    line_height = get_text_size(font, line)[1]
-                    emoji_positions = {
-                        e["match_start"]: e["emoji"] for e in emoji_lib.emoji_list(line)
-                    }
-                    cur_x = (
-                        (base_img.width - line_width) // 2
-                        if str(x_raw).lower() == "center"
-                        else x
-                    )
-                    temp_x = cur_x
-                    temp_i = 0
-                    while temp_i < len(line):
-                        char = line[temp_i]
-
-                        if line[temp_i:].startswith("<") and ":" in line[temp_i:]:
-                            custom_match = re.match(
-                                r"<(a?):([^:]+):(\d+)>", line[temp_i:]
-                            )
-                            if custom_match:
-                                emoji_len = len(custom_match.group(0))
-                                temp_x += font_size
-                                temp_i += emoji_len
-                                continue
-                        elif temp_i in emoji_positions and preserve_emoji_colors:
-                            emoji_str = emoji_positions[temp_i]
-                            temp_i += len(emoji_str)
+                else:
+                    txt_draw.text((char_x, cur_y), char, font=font, fill=255)
+                    char_x += cls._get_text_size(font, char)[0]
+                    i += 1
+
+            cur_y += line_height + line_spacing
+
+        if shadow_color:
+            shadow_layer = Image.new("L", size, 0)
+            shadow_draw = ImageDraw.Draw(shadow_layer)
+            ox = int(shadow_offset)
+            oy = int(shadow_offset)
+
+            cur_y = y
+            for line in lines:
+                line_width = cls._get_visual_width(line, font, font_size)
+                line_height = cls._get_text_size(font, line)[1]
+                emoji_positions = {
+                    e["match_start"]: e["emoji"] for e in emoji_lib.emoji_list(line)
+                }
+                cur_x = (size[0] - line_width) // 2 if center_x else x
+                temp_x = cur_x
+                temp_i = 0
+                while temp_i < len(line):
+                    char = line[temp_i]
+
+                    if line[temp_i:].startswith("<") and ":" in line[temp_i:]:
+                        custom_match = re.match(r"<(a?):([^:]+):(\d+)>", line[temp_i:])
+                        if custom_match:
+                            emoji_len = len(custom_match.group(0))
                             temp_x += font_size
+                            temp_i += emoji_len
                             continue
-                        else:
-                            await asyncio.to_thread(
-                                shadow_draw.text,
-                                (temp_x + ox, cur_y + oy),
-                                char,
-                                font=font,
-                                fill=255,
-                            )
-                            temp_x += get_text_size(font, char)[0]
-                            temp_i += 1
-                    cur_y += line_height + line_spacing
-
-                if shadow_blur > 0:
-                    shadow_layer = await asyncio.to_thread(
-                        shadow_layer.filter,
-                        ImageFilter.GaussianBlur(radius=shadow_blur),
-                    )
+                    elif temp_i in emoji_positions and preserve_emoji_colors:
+                        emoji_str = emoji_positions[temp_i]
+                        temp_i += len(emoji_str)
+                        temp_x += font_size
+                        continue
+                    else:
+                        shadow_draw.text(
+                            (temp_x + ox, cur_y + oy),
+                            char,
+                            font=font,
+                            fill=255,
+                        )
+                        temp_x += cls._get_text_size(font, char)[0]
+                        temp_i += 1
+                cur_y += line_height + line_spacing
 
-                shadow_img = await asyncio.to_thread(
-                    Image.new, "RGBA", base_img.size, (0, 0, 0, 0)
-                )
-                shadow_color_parsed = await asyncio.to_thread(
-                    self._parse_color, shadow_color, base_img.size
+            if shadow_blur > 0:
+                shadow_layer = shadow_layer.filter(
+                    ImageFilter.GaussianBlur(radius=shadow_blur),
                 )
 
-                if isinstance(shadow_color_parsed, tuple):
-                    await asyncio.to_thread(
-                        shadow_img.paste, shadow_color_parsed, (0, 0), mask=shadow_layer
-                    )
-                else:
-                    await asyncio.to_thread(
-                        shadow_img.paste, shadow_color_parsed, (0, 0), mask=shadow_layer
-                    )
+            shadow_img = Image.new("RGBA", size, (0, 0, 0, 0))
+            shadow_color_parsed = cls._parse_color(shadow_color, size)
 
-                base_img = await asyncio.to_thread(
-                    Image.alpha_composite, base_img, shadow_img
-                )
+            if isinstance(shadow_color_parsed, tuple):
+                shadow_img.paste(shadow_color_parsed, (0, 0), mask=shadow_layer)
+            else:
+                shadow_img.paste(shadow_color_parsed, (0, 0), mask=shadow_layer)
 
-            if outline_color:
-                if outline_width is None:
-                    outline_width = max(1, font_size // 20)
+            layers["shadow"] = shadow_img
 
-                outline_layer = await asyncio.to_thread(
-                    Image.new, "L", base_img.size, 0
-                )
-                outline_draw = await asyncio.to_thread(ImageDraw.Draw, outline_layer)
-
-                cur_y = y
-                for line in lines:
-                    line_width = get_visual_width(line, font, font_size)
-                    line_height = get_text_size(font, line)[1]
-                    cur_x = (
-                        (base_img.width - line_width) // 2
-                        if str(x_raw).lower() == "center"
-                        else x
-                    )
-                    for dx in range(-outline_width, outline_width + 1):
-                        for dy in range(-outline_width, outline_width + 1):
-                            if dx * dx + dy * dy <= outline_width * outline_width:
-                                emoji_positions = {
-                                    e["match_start"]: e["emoji"]
-                                    for e in emoji_lib.emoji_list(line)
-                                }
-                                temp_x = cur_x
-                                temp_i = 0
-                                while temp_i < len(line):
-                                    char = line[temp_i]
-
-                                    if (
-                                        line[temp_i:].startswith("<")
-                                        and ":" in line[temp_i:]
-                                    ):
-                                        custom_match = re.match(
-                                            r"<(a?):([^:]+):(\d+)>", line[temp_i:]
-                                        )
-                                        if custom_match:
-                                            emoji_len = len(custom_match.group(0))
-                                            temp_x += font_size
-                                            temp_i += emoji_len
-                                            continue
-                                    elif (
-                                        temp_i in emoji_positions
-                                        and preserve_emoji_colors
-                                    ):
-                                        emoji_str = emoji_positions[temp_i]
-                                        temp_i += len(emoji_str)
+        if outline_color:
+            if outline_width is None:
+                outline_width = max(1, font_size // 20)
+
+            outline_layer = Image.new("L", size, 0)
+            outline_draw = ImageDraw.Draw(outline_layer)
+
+            cur_y = y
+            for line in lines:
+                line_width = cls._get_visual_width(line, font, font_size)
+                line_height = cls._get_text_size(font, line)[1]
+                cur_x = (size[0] - line_width) // 2 if center_x else x
+                for dx in range(-outline_width, outline_width + 1):
+                    for dy in range(-outline_width, outline_width + 1):
+                        if dx * dx + dy * dy <= outline_width * outline_width:
+                            emoji_positions = {
+                                e["match_start"]: e["emoji"]
+                                for e in emoji_lib.emoji_list(line)
+                            }
+                            temp_x = cur_x
+                            temp_i = 0
+                            while temp_i < len(line):
+                                char = line[temp_i]
+
+                                if (
+                                    line[temp_i:].startswith("<")
+                                    and ":" in line[temp_i:]
+                                ):
+                                    custom_match = re.match(
+                                        r"<(a?):([^:]+):(\d+)>", line[temp_i:]
+                                    )
+                                    if custom_match:
+                                        emoji_len = len(custom_match.group(0))
                                         temp_x += font_size
+                                        temp_i += emoji_len
                                         continue
-                                    else:
-                                        await asyncio.to_thread(
-                                            outline_draw.text,
-                                            (temp_x + dx, cur_y + dy),
-                                            char,
-                                            font=font,
-                                            fill=255,
-                                        )
-                                        temp_x += get_text_size(font, char)[0]
-                                        temp_i += 1
-                    cur_y += line_height + line_spacing
-
-                outline_img = await asyncio.to_thread(
-                    Image.new, "RGBA", base_img.size, (0, 0, 0, 0)
-                )
-                outline_color_parsed = await asyncio.to_thread(
-                    self._parse_color, outline_color, base_img.size
-                )
+                                elif (
+                                    temp_i in emoji_positions and preserve_emoji_colors
+                                ):
+                                    emoji_str = emoji_positions[temp_i]
+                                    temp_i += len(emoji_str)
+                                    temp_x += font_size
+                                    continue
+                                else:
+                                    outline_draw.text(
+                                        (temp_x + dx, cur_y + dy),
+                                        char,
+                                        font=font,
+                                        fill=255,
+                                    )
+                                    temp_x += cls._get_text_size(font, char)[0]
+                                    temp_i += 1
+                cur_y += line_height + line_spacing
 
-                if isinstance(outline_color_parsed, tuple):
-                    await asyncio.to_thread(
-                        outline_img.paste,
-                        outline_color_parsed,
-                        (0, 0),
-                        mask=outline_layer,
-                    )
-                else:
-                    await asyncio.to_thread(
-                        outline_img.paste,
-                        outline_color_parsed,
-                        (0, 0),
-                        mask=outline_layer,
-                    )
+            outline_img = Image.new("RGBA", size, (0, 0, 0, 0))
+            outline_color_parsed = cls._parse_color(outline_color, size)
 
-                base_img = await asyncio.to_thread(
-                    Image.alpha_composite, base_img, outline_img
+            if isinstance(outline_color_parsed, tuple):
+                outline_img.paste(
+                    outline_color_parsed,
+                    (0, 0),
+                    mask=outline_layer,
                 )
-
-            bbox = txt_layer.getbbox()
-            if bbox:
-                gradient_img = await asyncio.to_thread(
-                    self._parse_color, color, (bbox[2] - bbox[0], bbox[3] - bbox[1])
+            else:
+                outline_img.paste(
+                    outline_color_parsed,
+                    (0, 0),
+                    mask=outline_layer,
                 )
-                if isinstance(gradient_img, Image.Image):
-                    gradient_crop = await asyncio.to_thread(
-                        gradient_img.crop, (0, 0, bbox[2] - bbox[0], bbox[3] - bbox[1])
-                    )
-                    temp_grad = await asyncio.to_thread(
-                        Image.new, "RGBA", base_img.size, (0, 0, 0, 0)
-                    )
-                    await asyncio.to_thread(
-                        temp_grad.paste, gradient_crop, (bbox[0], bbox[1])
-                    )
-                    mask = txt_layer.point(lambda p: 255 if p > 0 else 0, mode="1")
-                    colored = await asyncio.to_thread(
-                        Image.composite, temp_grad, base_img, mask
-                    )
-                    base_img = colored
-                else:
-                    solid_color = gradient_img
-                    mask = txt_layer.point(lambda p: 255 if p > 0 else 0, mode="1")
-                    await asyncio.to_thread(draw.bitmap, (0, 0), mask, fill=solid_color)
 
-            if emoji_layer.getbbox():
-                base_img = await asyncio.to_thread(
-                    Image.alpha_composite, base_img, emoji_layer
+            layers["outline"] = outline_img
+
+        bbox = txt_layer.getbbox()
+        if bbox:
+            gradient_img = cls._parse_color(
+                color, (bbox[2] - bbox[0], bbox[3] - bbox[1])
+            )
+            mask = txt_layer.point(lambda p: 255 if p > 0 else 0, mode="1")
+            if isinstance(gradient_img, Image.Image):
+                gradient_crop = gradient_img.crop(
+                    (0, 0, bbox[2] - bbox[0], bbox[3] - bbox[1])
                 )
+                temp_grad = Image.new("RGBA", size, (0, 0, 0, 0))
+                temp_grad.paste(gradient_crop, (bbox[0], bbox[1]))
+                layers["text_fill"] = temp_grad
+            else:
+                layers["text_fill"] = gradient_img
+            layers["text_mask"] = mask
 
-            output_file = self._get_temp_path("png")
-            await asyncio.to_thread(base_img.save, output_file)
-            self.media_cache[output_key] = str(output_file)
-            return f"media://{output_file.as_posix()}"
+        if emoji_layer.getbbox():
+            layers["emoji"] = emoji_layer
 
-        except Exception as e:
-            return f"Text error: {str(e)}"
+        return layers, complete
 
     async def _apply_caption(self, **kwargs) -> str:
         try:
@@ -4064,6 +5940,121 @@ class MediaProcessor:
             return False
         return found_at_least_one_emoji
 
+    @classmethod
+    def _render_caption_job(
+        cls,
+        output_path: str,
+        spec: dict,
+        size: tuple,
+        padding: int,
+        auto_padding: bool,
+        background_color: str,
+        long_text: bool,
+    ) -> tuple[int, bool]:
+        width, height = size
+        font_size = spec["font_size"]
+        canvas = Image.new("RGBA", (int(spec["wrap_width"]), height * 2), (0, 0, 0, 0))
+        calc_img, _, complete = cls._draw_text(canvas, spec)
+
+        bbox = calc_img.getbbox()
+        if bbox:
+            text_width = bbox[2] - bbox[0]
+            text_height = bbox[3] - bbox[1]
+            temp_cropped = calc_img.crop(bbox)
+        else:
+            text_width = 0
+            text_height = 0
+            temp_cropped = None
+
+        if auto_padding:
+            padding = text_height + int(font_size * 0.5)
+        padding = int(padding)
+
+        if text_height > padding:
+            padding = text_height + int(font_size * 0.3)
+
+        if long_text:
+            padding = padding + int(font_size * 0.2)
+
+        y_center = max(0, (padding - text_height) // 2)
+        x_center = max(0, (width - text_width) // 2)
+
+        bg_img = cls._parse_color(background_color, (width, padding))
+        if isinstance(bg_img, tuple):
+            bg_img = Image.new("RGBA", (width, padding), bg_img)
+
+        if temp_cropped:
+            if x_center + text_width > width:
+                x_center = max(0, width - text_width)
+            if y_center + text_height > padding:
+                y_center = max(0, padding - text_height)
+
+            bg_img.paste(temp_cropped, (x_center, y_center), temp_cropped)
+
+        bg_img.save(output_path)
+        return padding, complete
+
+    def _layer_overlay_cmd(
+        self,
+        input_path: Path,
+        layer_path: Path,
+        output_file: Path,
+        size: tuple,
+        pad_top: int = 0,
+    ) -> list:
+        # One pass for every frame: pad, overlay the pre-rendered layer and, for
+        # GIFs, build and apply the palette without an extra encode.
+        suffix = input_path.suffix.lower()
+        is_video = suffix in INTERMEDIATE_SUFFIXES
+        width, height = size
+        graph = "[0:v]"
+        if pad_top:
+            padded_width, padded_height = width, height + pad_top
+            if is_video:
+                padded_width += padded_width % 2
+                padded_height += padded_height % 2
+            graph += (
+                f"pad=width={padded_width}:height={padded_height}"
+                f":y={pad_top}:color=black[padded];[padded]"
+            )
+        graph += "[1:v]overlay=0:0"
+        if suffix == ".gif":
+            graph += ",split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse"
+        graph += "[outv]"
+
+        cmd = [
+            "ffmpeg",
+            "-hide_banner",
+            "-i",
+            str(input_path),
+            "-i",
+            str(layer_path),
+            "-filter_complex",
+            graph,
+            "-map",
+            "[outv]",
+        ]
+        if suffix == ".webp":
+            cmd += [
+                "-c:v",
+                "libwebp",
+                "-lossless",
+                "0",
+                "-compression_level",
+                "6",
+                "-loop",
+                "0",
+                "-f",
+                "webp",
+            ]
+        elif is_video:
+            cmd += ["-map", "0:a?", "-c:a", "copy", "-pix_fmt", "yuv420p"]
+        elif suffix == ".gif":
+            cmd += ["-f", "gif", "-gifflags", "+transdiff"]
+        else:
+            cmd += ["-frames:v", "1"]
+        return cmd + ["-y", output_file.as_posix()]
+
     async def _apply_caption_impl(self, **kwargs) -> str:
         input_key = kwargs["input_key"]
         text = kwargs["text"]
@@ -4092,16 +6083,6 @@ class MediaProcessor:
             return f"Error: {input_key} not found"
 
         input_path = Path(self.media_cache[input_key])
-        is_video = input_path.suffix.lower() in (
-            ".mp4",
-            ".mov",
-            ".webm",
-            ".mkv",
-            ".avi",
-            ".wmv",
-        )
-        is_gif = input_path.suffix.lower() == ".gif"
-        is_webp = input_path.suffix.lower() == ".webp"
 
         width, height, _, _ = await self._probe_media_info(input_path)
         if width == 0 or height == 0:
@@ -4119,134 +6100,56 @@ class MediaProcessor:
         if auto_wrap_width:
             wrap_width = width - int(width * 0.1)
 
-        temp_calc_key = f"{output_key}_calc"
-        await self._create_image(
-            media_key=temp_calc_key,
-            width=str(wrap_width),
-            height=str(height * 2),
-            color="transparent",
-        )
-
-        await self._text(
-            input_key=temp_calc_key,
-            text=text,
-            x="0",
-            y="0",
-            color=color,
-            output_key=temp_calc_key,
-            font_size=font_size,
+        spec = {
+            "text": emoji_lib.emojize(text, language="alias"),
+            "x": 0,
+            "y": 0,
+            "font_size": font_size,
+            "color": color,
+            "outline_color": outline_color,
+            "outline_width": outline_width,
+            "shadow_color": shadow_color,
+            "shadow_offset": shadow_offset,
+            "shadow_blur": shadow_blur,
+            "wrap_width": wrap_width,
+            "line_spacing": line_spacing,
+            "preserve_emoji_colors": preserve_emoji_colors,
+        }
+        cache_key = self._text_layer_cache_key(
+            kind="caption",
+            size=(width, height),
             font=font,
-            outline_color=outline_color,
-            outline_width=outline_width,
-            shadow_color=shadow_color,
-            shadow_offset=shadow_offset,
-            shadow_blur=shadow_blur,
-            wrap_width=wrap_width,
-            line_spacing=line_spacing,
-            preserve_emoji_colors=preserve_emoji_colors,
-        )
-
-        calc_path = Path(self.media_cache[temp_calc_key])
-        calc_img = await asyncio.to_thread(Image.open, calc_path)
-        calc_img = await asyncio.to_thread(calc_img.convert, "RGBA")
-
-        bbox = calc_img.getbbox()
-        if bbox:
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            temp_cropped = await asyncio.to_thread(calc_img.crop, bbox)
-        else:
-            text_width = 0
-            text_height = 0
-            temp_cropped = None
-
-        if auto_padding:
-            padding = text_height + int(font_size * 0.5)
-        padding = int(padding)
-
-        if text_height > padding:
-            padding = text_height + int(font_size * 0.3)
-
-        if text.count("\n") > 1 or len(text) > 100:
-            padding = padding + int(font_size * 0.2)
-
-        y_center = max(0, (padding - text_height) // 2)
-        x_center = max(0, (width - text_width) // 2)
-
-        bg_img = await asyncio.to_thread(
-            self._parse_color, background_color, (width, padding)
+            background_color=background_color,
+            padding=padding,
+            auto_padding=auto_padding,
+            **spec,
         )
-        if isinstance(bg_img, tuple):
-            bg_img = await asyncio.to_thread(
-                Image.new, "RGBA", (width, padding), bg_img
-            )
-
-        if temp_cropped:
-            if x_center + text_width > width:
-                x_center = max(0, width - text_width)
-            if y_center + text_height > padding:
-                y_center = max(0, padding - text_height)
-
-            await asyncio.to_thread(
-                bg_img.paste, temp_cropped, (x_center, y_center), temp_cropped
-            )
-
+        cached = TEXT_LAYER_CACHE.get(cache_key) if cache_key else None
         caption_file = self._get_temp_path("png")
-        await asyncio.to_thread(bg_img.save, caption_file)
-
-        output_file = self._get_temp_path(input_path.suffix[1:])
-        overlay_height = padding
-        padded_height = height + overlay_height
-
-        cmd = [
-            "ffmpeg",
-            "-hide_banner",
-            "-i",
-            str(input_path),
-            "-i",
-            str(caption_file),
-            "-filter_complex",
-            f"[0:v]pad=width={width}:height={padded_height}:y={overlay_height}:color=black[padded];"
-            "[1:v]scale=iw:ih[bg];"
-            "[padded][bg]overlay=0:0[outv]",
-            "-map",
-            "[outv]",
-            "-map",
-            "0:a?",
-            "-y",
-            output_file.as_posix(),
-        ]
-
-        if is_webp:
-            cmd.extend(
-                [
-                    "-c:v",
-                    "libwebp",
-                    "-lossless",
-                    "0",
-                    "-compression_level",
-                    "6",
-                    "-loop",
-                    "0",
-                    "-f",
-                    "webp",
-                ]
-            )
-        elif is_video or is_gif:
-            cmd.extend(
-                [
-                    "-preset",
-                    "fast",
-                    "-crf",
-                    "23",
-                    "-pix_fmt",
-                    "yuv420p",
-                    "-movflags",
-                    "+faststart",
-                ]
-            )
+
+        if cached is not None:
+            caption_png, padding = cached
+            await asyncio.to_thread(caption_file.write_bytes, caption_png)
         else:
-            cmd.extend(["-frames:v", "1"])
+            await self._finish_text_spec(spec, font)
+            padding, complete = await RENDER_POOL.run(
+                self._render_caption_job,
+                str(caption_file),
+                spec,
+                (width, height),
+                padding,
+                auto_padding,
+                background_color,
+                text.count("\n") > 1 or len(text) > 100,
+            )
+            if cache_key and complete:
+                caption_png = await asyncio.to_thread(caption_file.read_bytes)
+                TEXT_LAYER_CACHE.put(cache_key, (caption_png, padding))
+
+        output_file = self._get_temp_path(input_path.suffix[1:])
+        cmd = self._layer_overlay_cmd(
+            input_path, caption_file, output_file, (width, height), pad_top=padding
+        )
 
         success, error = await self._run_ffmpeg(cmd)
         if success:
@@ -4873,28 +6776,55 @@ class MediaProcessor:
         before_key = f"{segment_key}_before"
         after_key = f"{segment_key}_after"
         edited_key = f"{segment_key}_edited"
+        spliced_key = f"{segment_key}_spliced"
+        window = await self._copy_window(
+            input_key,
+            self._timestamp_seconds(resolved_start),
+            self._timestamp_seconds(resolved_end),
+            segment_key,
+        )
         segment_key = f"{segment_key}_main"
 
+        # only the keyframe window around the edit is decoded; the untouched
+        # head and tail were stream-copied by _copy_window
+        source_key = input_key
+        has_before = has_after = True
+        if window:
+            source_key = window["window"]
+            offset = window["offset"]
+            start_s = self._timestamp_seconds(resolved_start) - offset
+            end_s = self._timestamp_seconds(resolved_end) - offset
+            window_duration = (await self._get_full_media_info(source_key))["duration"]
+            has_before = start_s > 0.01
+            has_after = window_duration - end_s > 0.01
+            resolved_start, resolved_end = str(max(start_s, 0)), str(end_s)
+
         trim_tasks = [
             self._trim_media(
-                input_key=input_key,
-                start_time="0",
-                end_time=resolved_start,
-                output_key=before_key,
-            ),
-            self._trim_media(
-                input_key=input_key,
+                input_key=source_key,
                 start_time=resolved_start,
                 end_time=resolved_end,
                 output_key=segment_key,
-            ),
-            self._trim_media(
-                input_key=input_key,
-                start_time=resolved_end,
-                end_time="100%",
-                output_key=after_key,
-            ),
+            )
         ]
+        if has_before:
+            trim_tasks.append(
+                self._trim_media(
+                    input_key=source_key,
+                    start_time="0",
+                    end_time=resolved_start,
+                    output_key=before_key,
+                )
+            )
+        if has_after:
+            trim_tasks.append(
+                self._trim_media(
+                    input_key=source_key,
+                    start_time=resolved_end,
+                    end_time="100%",
+                    output_key=after_key,
+                )
+            )
 
         results = await asyncio.gather(*trim_tasks)
         if any(r.startswith("Error") for r in results):
@@ -4909,25 +6839,7 @@ class MediaProcessor:
 
                 parts = shlex.split(line)
                 cmd = parts[0]
-                raw_args = parts[1:]
-
-                spec = self.command_specs.get(cmd.lower(), {})
-                spec_params = [p for p in spec if p not in ("input_keys", "extra_args")]
-                kw_args = {}
-                pos_idx = 0
-                for arg in raw_args:
-                    if "=" in arg and not arg.startswith(("http://", "https://")):
-                        k, v = arg.split("=", 1)
-                        kw_args[k.strip().lower()] = v
-                    else:
-                        while (
-                            pos_idx < len(spec_params)
-                            and spec_params[pos_idx] in kw_args
-                        ):
-                            pos_idx += 1
-                        if pos_idx < len(spec_params):
-                            kw_args[spec_params[pos_idx]] = arg
-                            pos_idx += 1
+                kw_args = self._positional_kwargs(cmd, parts[1:])
 
                 if "input_key" not in kw_args:
                     kw_args["input_key"] = segment_key
@@ -4939,7 +6851,11 @@ class MediaProcessor:
 
             patched_script = "\n".join(patched_lines)
             script_result = await self.execute_media_script(
-                patched_script, exec_registry=exec_registry, user_vars=user_vars
+                patched_script,
+                exec_registry=exec_registry,
+                user_vars=user_vars,
+                keep_keys={edited_key},
+                finalize=False,
             )
             if any(r.startswith("Error") for r in script_result):
                 return f"Sub-script error: {script_result}"
@@ -4950,11 +6866,49 @@ class MediaProcessor:
         else:
             segment_to_use = segment_key
 
-        concat_result = await self._concat_media(
-            input_keys=[before_key, segment_to_use, after_key], output_key=output_key
+        pieces = [
+            key
+            for key, present in (
+                (before_key, has_before),
+                (segment_to_use, True),
+                (after_key, has_after),
+            )
+            if present
+        ]
+        if not window:
+            return await self._concat_media(input_keys=pieces, output_key=output_key)
+
+        if len(pieces) == 1:
+            spliced_key = pieces[0]
+        else:
+            spliced = await self._concat_media(
+                input_keys=pieces, output_key=spliced_key
+            )
+            if spliced.startswith("Error"):
+                return spliced
+        pieces = [window.get("head"), spliced_key, window.get("tail")]
+        return await self._concat_media(
+            input_keys=[k for k in pieces if k], output_key=output_key
         )
 
-        return concat_result
+    def _positional_kwargs(self, cmd: str, raw_args: list[str]) -> dict:
+        # dobetween bodies name every argument before running, so positional
+        # and key=value arguments can be mixed freely
+        spec = self.command_specs.get(cmd.lower(), {})
+        spec_params = [p for p in spec if p not in ("input_keys", "extra_args")]
+        kw_args = {}
+        pos_idx = 0
+        for arg in raw_args:
+            if "=" in arg and not arg.startswith(("http://", "https://")):
+                k, v = arg.split("=", 1)
+                kw_args[k.strip().lower()] = v
+            else:
+                while pos_idx < len(spec_params) and spec_params[pos_idx] in kw_args:
+                    pos_idx += 1
+                if pos_idx < len(spec_params):
+                    kw_args[spec_params[pos_idx]] = arg
+                    pos_idx += 1
+        return kw_args
 
     async def _set_variable(self, **kwargs) -> str:
         var_name = kwargs.get("var_name", "")
@@ -4974,6 +6928,39 @@ class MediaProcessor:
         user_vars[var_name] = val
         return f"set {var_name} = {val}"
 
+    async def _plan_frame_filters(
+        self, input_key: str, output_key: str, body: list, frame_dir_key: str
+    ) -> list[tuple[str, dict]]:
+        suffix = Path(self.media_cache[input_key]).suffix.lower()
+        if not self.fuse_filters or suffix not in INTERMEDIATE_SUFFIXES + (".gif",):
+            return []
+
+        lines = []
+        current_key = input_key
+        for step, (cmd_name, pos_args, kw_args) in enumerate(body):
+            stream = self.fusible_filters.get(cmd_name.lower(), ("",))[0]
+            if (
+                stream != "v"
+                or cmd_name.lower() == "fps"
+                or pos_args
+                or "input_key" in kw_args
+                or "output_key" in kw_args
+            ):
+                return []
+            step_out_key = (
+                output_key
+                if step == len(body) - 1
+                else f"{frame_dir_key}_stream_step{step}"
+            )
+            kw_args = {**kw_args, "input_key": current_key, "output_key": step_out_key}
+            lines.append(
+                shlex.join([cmd_name] + [f"{k}={v}" for k, v in kw_args.items()])
+            )
+            current_key = step_out_key
+
+        steps = await self._plan_filter_chain(lines, 0, set(), min_steps=1)
+        return steps if len(steps) == len(lines) else []
+
     async def _foreachframe(self, **kwargs) -> str:
         try:
             input_key = kwargs.get("input_key")
@@ -4990,6 +6977,28 @@ class MediaProcessor:
             if not sub_script:
                 return "Error: foreachframe - no sub-script (missing 'end'?)"
 
+            body = []
+            for line in sub_script.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                parts = shlex.split(line)
+                body.append(
+                    (
+                        parts[0],
+                        [p for p in parts[1:] if "=" not in p],
+                        dict(p.split("=", 1) for p in parts[1:] if "=" in p),
+                    )
+                )
+
+            steps = await self._plan_frame_filters(
+                input_key, output_key, body, frame_dir_key
+            )
+            if steps:
+                result = await self._run_filter_chain(steps)
+                if result.startswith("media://"):
+                    return result
+
             input_path = Path(self.media_cache[input_key])
             info = await self._get_full_media_info(input_key)
             fps = info["fps"] or 25.0
@@ -5024,71 +7033,95 @@ class MediaProcessor:
             processed_dir.mkdir(parents=True, exist_ok=True)
             self.temp_files.add(str(processed_dir))
 
-            for idx, frame_file in enumerate(frame_files):
-                frame_key = f"{frame_dir_key}_frame_{idx}"
-                self.media_cache[frame_key] = str(frame_file)
+            # frames only run concurrently when every step writes to its own
+            # auto-generated per-frame key
+            parallel = all(
+                cmd_name not in ("create", "load", "export")
+                and (cmd_name == "set" or not pos_args)
+                and "input_key" not in kw_args
+                and "output_key" not in kw_args
+                for cmd_name, pos_args, kw_args in body
+            )
+            workers = (
+                max(1, bot_info.data.get("foreachframe_workers", os.cpu_count() or 4))
+                if parallel
+                else 1
+            )
+            semaphore = asyncio.Semaphore(workers)
+            transfer = os.replace if parallel else shutil.copyfile
+
+            async def process_frame(idx: int, frame_file: Path) -> None:
+                async with semaphore:
+                    frame_key = f"{frame_dir_key}_frame_{idx}"
+                    self.media_cache[frame_key] = str(frame_file)
+
+                    frame_user_vars = dict(user_vars)
+                    frame_user_vars["frame_index"] = float(idx)
+                    frame_user_vars["frame_count"] = float(actual_total)
+                    frame_user_vars["frame_time"] = round(idx / fps, 6)
+
+                    current_key = frame_key
+                    frame_keys = [frame_key]
+                    step = 0
+                    patched_lines = []
+                    for cmd_name, pos_args, kw_args in body:
+                        kw_args = dict(kw_args)
+                        if cmd_name not in ("create", "load", "set", "export"):
+                            if "input_key" not in kw_args:
+                                kw_args["input_key"] = current_key
+                            step_out_key = f"{frame_dir_key}_out_{idx}_step{step}"
+                            if "output_key" not in kw_args:
+                                kw_args["output_key"] = step_out_key
+                            current_key = kw_args["output_key"]
+                            frame_keys.append(step_out_key)
+                            step += 1
+
+                        new_parts = (
+                            [cmd_name]
+                            + pos_args
+                            + [f"{k}={v}" for k, v in kw_args.items()]
+                        )
+                        patched_lines.append(shlex.join(new_parts))
 
-                frame_user_vars = dict(user_vars)
-                frame_user_vars["frame_index"] = float(idx)
-                frame_user_vars["frame_count"] = float(actual_total)
-                frame_user_vars["frame_time"] = round(idx / fps, 6)
+                    processed_frame_key = current_key
 
-                current_key = frame_key
-                step = 0
-                patched_lines = []
-                for line in sub_script.splitlines():
-                    line = line.strip()
-                    if not line:
-                        continue
-                    parts = shlex.split(line)
-                    cmd_name = parts[0]
-                    pos_args = [p for p in parts[1:] if "=" not in p]
-                    kw_args = dict(p.split("=", 1) for p in parts[1:] if "=" in p)
-
-                    if cmd_name not in ("create", "load", "set", "export"):
-                        if "input_key" not in kw_args:
-                            kw_args["input_key"] = current_key
-                        step_out_key = f"{frame_dir_key}_out_{idx}_step{step}"
-                        if "output_key" not in kw_args:
-                            kw_args["output_key"] = step_out_key
-                        current_key = kw_args["output_key"]
-                        step += 1
-
-                    new_parts = (
-                        [cmd_name] + pos_args + [f"{k}={v}" for k, v in kw_args.items()]
+                    patched_script = "\n".join(patched_lines)
+                    await self.execute_media_script(
+                        patched_script,
+                        exec_registry=exec_registry,
+                        user_vars=frame_user_vars,
+                        keep_keys={processed_frame_key},
+                        finalize=False,
                     )
-                    patched_lines.append(shlex.join(new_parts))
 
-                processed_frame_key = current_key
-
-                patched_script = "\n".join(patched_lines)
-                await self.execute_media_script(
-                    patched_script,
-                    exec_registry=exec_registry,
-                    user_vars=frame_user_vars,
-                )
-
-                if processed_frame_key in self.media_cache:
                     out_frame_path = processed_dir / f"frame_{idx:08d}.png"
-                    src = Path(self.media_cache[processed_frame_key])
+                    src = Path(self.media_cache.get(processed_frame_key, frame_file))
                     if src.suffix.lower() != ".png":
-                        conv_out = self._get_temp_path("png")
                         conv_cmd = [
                             "ffmpeg",
                             "-hide_banner",
                             "-y",
                             "-i",
                             src.as_posix(),
-                            conv_out.as_posix(),
+                            "-frames:v",
+                            "1",
+                            out_frame_path.as_posix(),
                         ]
-                        await self._run_ffmpeg(conv_cmd)
-                        shutil.copy(str(conv_out), str(out_frame_path))
+                        ok, _ = await self._run_ffmpeg(conv_cmd)
+                        if not ok:
+                            transfer(frame_file, out_frame_path)
                     else:
-                        shutil.copy(str(src), str(out_frame_path))
-                else:
-                    shutil.copy(
-                        str(frame_file), str(processed_dir / f"frame_{idx:08d}.png")
-                    )
+                        transfer(src, out_frame_path)
+
+                    if parallel:
+                        for key in frame_keys:
+                            path = self.media_cache.pop(key, None)
+                            if path and os.path.exists(path):
+                                os.unlink(path)
+
+            await asyncio.gather(
+                *(process_frame(idx, f) for idx, f in enumerate(frame_files))
+            )
 
             suffix = input_path.suffix.lower()
             out_ext = (
@@ -5099,20 +7132,6 @@ class MediaProcessor:
             output_file = self._get_temp_path(out_ext)
 
             if has_audio:
-                audio_path = self._get_temp_path("aac")
-                audio_cmd = [
-                    "ffmpeg",
-                    "-hide_banner",
-                    "-y",
-                    "-i",
-                    input_path.as_posix(),
-                    "-vn",
-                    "-acodec",
-                    "aac",
-                    str(audio_path),
-                ]
-                await self._run_ffmpeg(audio_cmd)
-
                 encode_cmd = [
                     "ffmpeg",
                     "-hide_banner",
@@ -5122,7 +7141,11 @@ class MediaProcessor:
                     "-i",
                     str(processed_dir / "frame_%08d.png"),
                     "-i",
-                    str(audio_path),
+                    input_path.as_posix(),
+                    "-map",
+                    "0:v:0",
+                    "-map",
+                    "1:a:0",
                     "-c:v",
                     "libx264",
                     "-pix_fmt",
@@ -5316,10 +7339,357 @@ class MediaProcessor:
             return error
 
 
+class MathFallback(Exception):
+    pass
+
+
+class MathEvaluator:
+    BIN_OPS = {
+        ast.Add: lambda a, b: a + b,
+        ast.Sub: lambda a, b: a - b,
+        ast.Mult: lambda a, b: a * b,
+        ast.Div: lambda a, b: a / b,
+        ast.Pow: lambda a, b: a**b,
+    }
+    UNARY_OPS = {
+        ast.UAdd: lambda a: +a,
+        ast.USub: lambda a: -a,
+    }
+    CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+    FUNCTIONS = {
+        "sqrt": math.sqrt,
+        "cbrt": lambda x: math.copysign(abs(x) ** (1 / 3), x),
+        "abs": abs,
+        "round": lambda x: math.copysign(math.floor(abs(x) + 0.5), x),
+        "floor": math.floor,
+        "ceil": math.ceil,
+        "trunc": math.trunc,
+        "exp": math.exp,
+        "ln": math.log,
+        "log": math.log,
+        "log10": math.log10,
+        "log2": math.log2,
+        "factorial": math.factorial,
+        "gcd": math.gcd,
+        "lcm": math.lcm,
+        "hypot": math.hypot,
+        "mod": lambda a, b: a % b,
+        "min": min,
+        "max": max,
+    }
+    UNITS = {
+        "mm": ("length", 0.001),
+        "cm": ("length", 0.01),
+        "m": ("length", 1),
+        "km": ("length", 1000),
+        "in": ("length", 0.0254),
+        "ft": ("length", 0.3048),
+        "yd": ("length", 0.9144),
+        "mi": ("length", 1609.344),
+        "mg": ("mass", 0.001),
+        "g": ("mass", 1),
+        "kg": ("mass", 1000),
+        "t": ("mass", 1_000_000),
+        "oz": ("mass", 28.349523125),
+        "lb": ("mass", 453.59237),
+        "ms": ("time", 0.001),
+        "s": ("time", 1),
+        "min": ("time", 60),
+        "h": ("time", 3600),
+        "d": ("time", 86400),
+        "ml": ("volume", 0.001),
+        "l": ("volume", 1),
+        "B": ("data", 1),
+        "KB": ("data", 1000),
+        "MB": ("data", 1000**2),
+        "GB": ("data", 1000**3),
+        "TB": ("data", 1000**4),
+        "KiB": ("data", 1024),
+        "MiB": ("data", 1024**2),
+        "GiB": ("data", 1024**3),
+        "TiB": ("data", 1024**4),
+    }
+    UNIT_PATTERN = re.compile(
+        r"^(?P<value>.+?)\s*(?P<src>[A-Za-z]+)\s+(?:to|in|->)\s+(?P<dst>[A-Za-z]+)$"
+    )
+    MAX_NODES = 200
+    MAX_INT_BITS = 4096
+    MAX_FACTORIAL = 500
+
+    def __init__(self, cache_entries: int = 1024):
+        self.cache = LRUCache(max_entries=cache_entries)
+
+    def evaluate(self, expr: str) -> str:
+        expr = expr.strip()
+        cached = self.cache.get(expr)
+        if cached is not None:
+            return cached
+        result = self._evaluate(expr)
+        self.cache.put(expr, result)
+        return result
+
+    def _evaluate(self, expr: str) -> str:
+        if len(expr) > 500 or "%" in expr or "\n" in expr:
+            raise MathFallback(expr)
+
+        match = self.UNIT_PATTERN.match(expr)
+        if match:
+            src = self.UNITS.get(match["src"])
+            dst = self.UNITS.get(match["dst"])
+            if not src or not dst or src[0] != dst[0]:
+                raise MathFallback(expr)
+            value = self._compute(match["value"]) * src[1] / dst[1]
+            return f"{self._format_number(value)} {match['dst']}"
+
+        return self._format_number(self._compute(expr))
+
+    def _compute(self, expr: str):
+        expr = (
+            expr.replace("^", "**")
+            .replace("×", "*")
+            .replace("÷", "/")
+            .replace("−", "-")
+        )
+        try:
+            tree = ast.parse(expr, mode="eval")
+        except SyntaxError:
+            raise MathFallback(expr)
+        if sum(1 for _ in ast.walk(tree)) > self.MAX_NODES:
+            raise MathFallback(expr)
+        try:
+            value = self._eval_node(tree.body)
+        except (ArithmeticError, ValueError, TypeError):
+            raise MathFallback(expr)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise MathFallback(expr)
+        if isinstance(value, float) and not math.isfinite(value):
+            raise MathFallback(expr)
+        return value
+
+    def _eval_node(self, node):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise MathFallback(node.value)
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in self.CONSTANTS:
+                raise MathFallback(node.id)
+            return self.CONSTANTS[node.id]
+        if isinstance(node, ast.UnaryOp) and type(node.op) in self.UNARY_OPS:
+            return self.UNARY_OPS[type(node.op)](self._eval_node(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in self.BIN_OPS:
+            left = self._eval_node(node.left)
+            right = self._eval_node(node.right)
+            if isinstance(node.op, ast.Pow):
+                self._check_power(left, right)
+            return self._check_int(self.BIN_OPS[type(node.op)](left, right))
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in self.FUNCTIONS
+            and not node.keywords
+        ):
+            args = [self._eval_node(arg) for arg in node.args]
+            if node.func.id == "factorial" and (
+                len(args) != 1
+                or not isinstance(args[0], int)
+                or args[0] > self.MAX_FACTORIAL
+            ):
+                raise MathFallback(args)
+            return self._check_int(self.FUNCTIONS[node.func.id](*args))
+        raise MathFallback(ast.dump(node))
+
+    def _check_int(self, value):
+        if isinstance(value, int) and value.bit_length() > self.MAX_INT_BITS:
+            raise MathFallback(value)
+        return value
+
+    def _check_power(self, base, exponent) -> None:
+        if isinstance(base, complex) or isinstance(exponent, complex):
+            raise MathFallback(base)
+        if isinstance(base, (int, float)) and base < 0 and exponent != int(exponent):
+            raise MathFallback(base)
+        if abs(base) > 1 and abs(exponent) * math.log2(abs(base)) > self.MAX_INT_BITS:
+            raise MathFallback(base)
+
+    @staticmethod
+    def _format_number(value) -> str:
+        if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+            value = int(value)
+        if isinstance(value, int):
+            if abs(value) < 10**20:
+                return str(value)
+            digits = str(abs(value))
+            digits = str(round(abs(value), 10 - len(digits)))
+            mantissa = f"{digits[0]}.{digits[1:10]}".rstrip("0").rstrip(".")
+            sign = "-" if value < 0 else ""
+            return f"{sign}{mantissa}E{len(digits) - 1}"
+        text = f"{value:.10g}"
+        if "e" in text:
+            mantissa, exponent = text.split("e")
+            text = f"{mantissa}E{int(exponent)}"
+        return text
+
+
+class QalcWorker:
+    COMMAND_PATTERN = re.compile(
+        r"^\s*(set|save|store|assume|base|mode|variable|function|delete|keep|"
+        r"unkeep|exrates|stack|clear|exit|quit|help|info|list|find|rpn|MC|MS|MR|M\+|M-)\b",
+        re.IGNORECASE,
+    )
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self.proc = None
+        self.disabled = False
+        self._responded = False
+        self._lock = asyncio.Lock()
+
+    def accepts(self, expr: str) -> bool:
+        return (
+            not self.disabled
+            and "\n" not in expr
+            and ":=" not in expr
+            and not self.COMMAND_PATTERN.match(expr)
+        )
+
+    async def _ensure_started(self):
+        if self.proc is None or self.proc.returncode is not None:
+            self.proc = await asyncio.create_subprocess_exec(
+                "qalc",
+                "-t",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+
+    async def evaluate(self, expr: str) -> str:
+        async with self._lock:
+            await self._ensure_started()
+            sentinel = str(random.randint(10**14, 10**15 - 1))
+            try:
+                self.proc.stdin.write(f"{expr}\n{sentinel}\n".encode())
+                await self.proc.stdin.drain()
+                lines = []
+                while True:
+                    line = await asyncio.wait_for(
+                        self.proc.stdout.readline(), timeout=self.timeout
+                    )
+                    if not line:
+                        raise ConnectionResetError("qalc worker exited")
+                    line = line.decode(errors="replace").strip()
+                    if line == sentinel:
+                        break
+                    if line:
+                        lines.append(line)
+                self._responded = True
+                return "\n".join(lines)
+            except BaseException:
+                # a worker that never answered is not usable in pipe mode
+                self.disabled = not self._responded
+                await self._kill()
+                raise
+
+    async def _kill(self):
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+            await self.proc.wait()
+        self.proc = None
+
+    async def close(self):
+        async with self._lock:
+            await self._kill()
+
+
+async def run_qalc(expr: str, timeout: float = 5.0) -> str:
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "qalc",
+            "-t",
+            expr,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+
+        if proc.returncode != 0:
+            err = stderr.decode().strip()
+            out = stdout.decode().strip()
+            return (
+                err or out or f"[math error: qalc returned exit code {proc.returncode}]"
+            )
+
+        return stdout.decode().strip()
+    except asyncio.TimeoutError:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        return "[math error: timed out]"
+    except FileNotFoundError:
+        return "[math error: qalc not installed]"
+    except Exception as e:
+        return f"[math error: {e}]"
+
+
+MATH_EVALUATOR = MathEvaluator(bot_info.data.get("math_cache_entries", 1024))
+QALC_WORKER = QalcWorker()
+
+
+async def evaluate_math(expr: str) -> str:
+    expr = expr.strip()
+    try:
+        return MATH_EVALUATOR.evaluate(expr)
+    except MathFallback:
+        pass
+    if QALC_WORKER.accepts(expr):
+        try:
+            return await QALC_WORKER.evaluate(expr)
+        except FileNotFoundError:
+            return "[math error: qalc not installed]"
+        except asyncio.TimeoutError:
+            if not QALC_WORKER.disabled:
+                return "[math error: timed out]"
+        except (ConnectionError, OSError):
+            pass
+    return await run_qalc(expr)
+
+
+class VariableScope:
+    __slots__ = ("_values", "_chars", "max_vars", "max_chars")
+
+    def __init__(self, max_vars: int = 256, max_chars: int = 100_000):
+        self._values: dict[str, str] = {}
+        self._chars = 0
+        self.max_vars = max_vars
+        self.max_chars = max_chars
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, name: str, default: str = "") -> str:
+        return self._values.get(name, default)
+
+    def set(self, name: str, value: str) -> None:
+        old = self._values.get(name)
+        chars = self._chars - (len(name) + len(old) if old is not None else 0)
+        chars += len(name) + len(value)
+        if old is None and len(self._values) >= self.max_vars:
+            raise ValueError(f"variable limit of {self.max_vars} reached")
+        if chars > self.max_chars:
+            raise ValueError(f"variables exceed {self.max_chars} characters")
+        self._values[name] = value
+        self._chars = chars
+
+    def clear(self) -> None:
+        self._values.clear()
+        self._chars = 0
+
+
 class TagFormatter:
     def __init__(self):
         self.functions: Dict[str, Callable] = {}
         self._component_tags = {"embed", "button", "select", "component", "cv2"}
+        self.batch_executor: Callable | None = None
 
     def register(self, name: str):
         def decorator(func: Callable):
@@ -5340,6 +7710,32 @@ class TagFormatter:
     ]:
         if "_tag_settings" not in kwargs:
             kwargs["_tag_settings"] = {}
+        owns_scope = kwargs.get("_variables") is None
+        owns_batch = False
+        if owns_scope:
+            kwargs["_variables"] = VariableScope()
+            if self.batch_executor and "_exec_batch" not in kwargs:
+                kwargs["_exec_batch"] = await self.batch_executor(ctx, content)
+                owns_batch = True
+        try:
+            return await self._format(content, ctx, **kwargs)
+        finally:
+            if owns_scope:
+                kwargs["_variables"].clear()
+            if owns_batch:
+                # files of batched blocks that never ran were spooled anyway
+                for _, (_, files) in kwargs["_exec_batch"]:
+                    for _, path in files:
+                        Path(path).unlink(missing_ok=True)
+
+    async def _format(
+        self, content: str, ctx: commands.Context, **kwargs
+    ) -> tuple[
+        str,
+        list[discord.Embed],
+        discord.ui.View | discord.ui.LayoutView | None,
+        list[discord.File],
+    ]:
         text_parts = []
         embeds = []
         view = None
@@ -5484,94 +7880,207 @@ class TagFormatter:
         return ctx.author
 
 
+async def _read_exec_batch(
+    reader: aiohttp.MultipartReader, registry: ExecFileRegistry
+) -> list[tuple[dict, list[tuple[str, Path]]]] | None:
+    # the /batch/execute response: the results as JSON, then each job's files
+    # as parts named by the job's index
+    part = await reader.next()
+    if part is None:
+        return None
+    batch = await part.json()
+    results = [(result, []) for result in batch["results"]]
+    try:
+        while (part := await reader.next()) is not None:
+            files = results[int(part.name)][1]
+            if len(files) >= 10:
+                await part.release()
+                continue
+            path = registry.spool_path(part.filename)
+            files.append((part.filename, path))
+            with path.open("wb") as f:
+                while chunk := await part.read_chunk(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+    except BaseException:
+        for _, files in results:
+            for _, path in files:
+                path.unlink(missing_ok=True)
+        raise
+    return results
+
+
 class Tags(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.pool = bot.pool
-        self._variables = {}
         self.formatter = TagFormatter()
+        self.formatter.batch_executor = self.prepare_exec_batch
         self.processor = MediaProcessor()
-        self._exec_file_registry: dict[str, tuple[bytes, str]] = {}
+        self._exec_file_registry = ExecFileRegistry()
         self.setup_formatters()
         self.setup_media_formatters()
         self.active_processes = set()
 
-    async def execute_language(self, ctx, language: str, code: str, **kwargs):
-        await self.processor.ensure_session()
-        url = f"http://localhost:8000/{language}/execute"
-        suppress_files: bool = kwargs.get("suppress_files", False)
+    @contextlib.contextmanager
+    def _exec_form(self, ctx):
+        # the registry files stay open until the request has been sent
         data = aiohttp.FormData()
-        data.add_field("code", code)
-
-        attachments = ctx.message.attachments
-        if attachments:
-            for attachment in attachments:
-                try:
-                    file_bytes = await attachment.read()
-                    data.add_field(
-                        "files",
-                        BytesIO(file_bytes),
-                        filename=attachment.filename,
-                        content_type=attachment.content_type
-                        or "application/octet-stream",
-                    )
-                except Exception as e:
-                    return f"[{language} error: Failed to process attachment {attachment.filename}: {str(e)}]"
+        stack = contextlib.ExitStack()
 
-        for reg_key in sorted(self._exec_file_registry):
-            reg_bytes, reg_filename = self._exec_file_registry[reg_key]
+        for attachment in ctx.message.attachments:
             data.add_field(
                 "files",
-                BytesIO(reg_bytes),
-                filename=reg_filename,
-                content_type="application/octet-stream",
+                stream_attachment(self.processor.session, attachment),
+                filename=attachment.filename,
+                content_type=attachment.content_type or "application/octet-stream",
             )
 
-        try:
-            async with self.processor.session.post(url, data=data) as response:
-                if response.status != 200:
-                    return f"[{language} error: HTTP {response.status}]"
-                result = await response.json()
+        with stack:
+            for reg_key in sorted(self._exec_file_registry):
+                reg_path, reg_filename = self._exec_file_registry[reg_key]
+                data.add_field(
+                    "files",
+                    stack.enter_context(open(reg_path, "rb")),
+                    filename=reg_filename,
+                    content_type="application/octet-stream",
+                )
+            yield data
+
+    def _collect_exec_batch(self, content: str) -> list[tuple[str, str]]:
+        # the batch runs before any other tag, so it only takes the static
+        # code blocks that already come first; a tag in between may have side
+        # effects ({set}, {math}, ...) the blocks must not overtake
+        blocks = []
+        top_level = 0
+        leading = True
+        for chunk in self.formatter._split_chunks(content):
+            if not (chunk.startswith("{") and chunk.endswith("}")):
+                continue
+            name, _, body = chunk[1:-1].strip().partition(":")
+            if name.strip() not in CODE_TAGS:
+                leading = False
+                continue
+            top_level += 1
+            if leading and "{" not in body:
+                blocks.append((CODE_TAGS[name.strip()], body.strip()))
+            else:
+                leading = False
+
+        if len(blocks) < 2:
+            return []
+        # and only when every code block is at the top level, where they run
+        # in order, and nothing else can touch the file registry in between
+        names = "|".join(re.escape(name) for name in CODE_TAGS)
+        occurrences = re.findall(rf"\{{\s*(?:{names})\s*:", content)
+        if len(occurrences) != top_level or re.search(
+            r"\{\s*(?:gscript|gmanscript)\s*:", content
+        ):
+            return []
+        return blocks
+
+    async def prepare_exec_batch(self, ctx, content: str) -> list:
+        blocks = self._collect_exec_batch(content)
+        if not blocks:
+            return []
+        results = await self.execute_batch(ctx, blocks)
+        return list(zip(blocks, results)) if results else []
+
+    async def execute_batch(
+        self, ctx, blocks: list[tuple[str, str]]
+    ) -> list[tuple[dict, list[tuple[str, Path]]]] | None:
+        await self.processor.ensure_session()
+        with self._exec_form(ctx) as data:
+            data.add_field(
+                "jobs",
+                json.dumps(
+                    [{"language": language, "code": code} for language, code in blocks]
+                ),
+            )
+            data.add_field(
+                "registry_keys", json.dumps(sorted(self._exec_file_registry))
+            )
+
+            try:
+                async with self.processor.session.post(
+                    "http://localhost:8000/batch/execute", data=data
+                ) as response:
+                    if response.status != 200:
+                        return None
+                    return await _read_exec_batch(
+                        aiohttp.MultipartReader.from_response(response),
+                        self._exec_file_registry,
+                    )
+            except Exception:
+                return None
 
-                output = result.get("output", "").replace("\r\n", "\n").strip()
-                has_error = result.get("error") or "error" in output.lower()
+    async def execute_language(self, ctx, language: str, code: str, **kwargs):
+        await self.processor.ensure_session()
+        suppress_files: bool = kwargs.get("suppress_files", False)
+
+        batch = kwargs.get("_exec_batch")
+        if batch and batch[0][0] == (language, code):
+            _, (result, files) = batch.pop(0)
+            return self._handle_exec_result(language, result, files, suppress_files)
+
+        url = f"http://localhost:8000/{language}/execute"
+        with self._exec_form(ctx) as data:
+            data.add_field("code", code)
+
+            try:
+                async with self.processor.session.post(url, data=data) as response:
+                    if response.status != 200:
+                        return f"[{language} error: HTTP {response.status}]"
+                    result = await response.json()
 
-                if result.get("files"):
+                    files = []
                     job_id = result.get("job_id", "")
-                    file_objs = []
-                    for idx, filename in enumerate(result["files"][:10], start=1):
+                    for filename in result.get("files", [])[:10]:
                         file_url = f"http://localhost:8000/files/{job_id}/{filename}"
+                        path = self._exec_file_registry.spool_path(filename)
                         try:
-                            async with self.processor.session.get(
-                                file_url
-                            ) as file_resp:
-                                if file_resp.status == 200:
-                                    file_data = await file_resp.read()
-                                    self._exec_file_registry[f"FILE_{idx}"] = (
-                                        file_data,
-                                        filename,
-                                    )
-                                    if not suppress_files:
-                                        file_objs.append(
-                                            discord.File(
-                                                BytesIO(file_data), filename=filename
-                                            )
-                                        )
+                            if await download_to_path(
+                                self.processor.session, file_url, path
+                            ):
+                                files.append((filename, path))
                         except Exception as e:
-                            output += f"\n[File fetch failure for {filename}: {str(e)}"
+                            result["output"] = (
+                                result.get("output", "")
+                                + f"\n[File fetch failure for {filename}: {str(e)}"
+                            )
+
+                    return self._handle_exec_result(
+                        language, result, files, suppress_files
+                    )
+            except Exception as e:
+                return f"[{language} exception: {str(e)}]"
 
-                    if has_error:
-                        error_msg = f"[{language} error: {output or 'Code execution failed with no output'}]"
-                        if file_objs:
-                            return (error_msg, [], None, file_objs[:10])
-                        return error_msg
+    def _handle_exec_result(
+        self,
+        language: str,
+        result: dict,
+        files: list[tuple[str, Path]],
+        suppress_files: bool,
+    ):
+        output = result.get("output", "").replace("\r\n", "\n").strip()
+        has_error = result.get("error") or "error" in output.lower()
 
-                    if file_objs:
-                        return (output, [], None, file_objs[:10])
+        file_objs = []
+        for idx, (filename, path) in enumerate(files[:10], start=1):
+            if not suppress_files:
+                file_objs.append(discord.File(path, filename=filename))
+            self._exec_file_registry[f"FILE_{idx}"] = (path, filename)
 
-                return output or "Code execution succeeded with no console output"
-        except Exception as e:
-            return f"[{language} exception: {str(e)}]"
+        if result.get("files"):
+            if has_error:
+                error_msg = f"[{language} error: {output or 'Code execution failed with no output'}]"
+                if file_objs:
+                    return (error_msg, [], None, file_objs[:10])
+                return error_msg
+
+            if file_objs:
+                return (output, [], None, file_objs[:10])
+
+        return output or "Code execution succeeded with no console output"
 
     def setup_media_formatters(self):
         @self.formatter.register("gmanscript")
@@ -5640,8 +8149,12 @@ class Tags(commands.Cog):
                     - trim video 0 duration/2 out    <- first half
                     - text img "hi" iw/2 ih/2 white out   <- centered text pos
             """
+            processor = MediaProcessor()
+            processor.owner_id = ctx.author.id
+            processor.priority = FFmpegScheduler.BATCH
+            status = JobStatus(ctx, processor)
             try:
-                processor = MediaProcessor()
+                processor.size_limit = upload_limit(ctx)
                 await processor.ensure_session()
                 results = await processor.execute_media_script(
                     script, exec_registry=self._exec_file_registry
@@ -5664,13 +8177,15 @@ class Tags(commands.Cog):
 
                     files = []
                     for path in results:
+                        if len(files) >= 10:
+                            break
                         if isinstance(path, str) and os.path.isfile(path):
                             try:
-                                with open(path, "rb") as f:
-                                    data = BytesIO(f.read())
-                                filename = os.path.basename(path)
-                                files.append(discord.File(data, filename=filename))
-                                os.remove(path)
+                                # the open handle outlives processor cleanup;
+                                # the path goes once discord.py closes it
+                                files.append(
+                                    SpooledFile(path, filename=os.path.basename(path))
+                                )
                             except Exception:
                                 continue
 
@@ -5703,9 +8218,9 @@ class Tags(commands.Cog):
                     )
 
             except Exception as e:
-                await processor.cleanup()
                 return (f"[gmanscript error: {str(e)}]", [], None, [])
             finally:
+                await status.close()
                 await processor.cleanup()
 
     def setup_formatters(self):
@@ -5716,7 +8231,9 @@ class Tags(commands.Cog):
                 * Processes nested tag functions in the content.
                 * Example: `{eval:Hello {user}!}`
             """
-            return await self.process_tags(ctx, val, kwargs.get("args", ""))
+            return await self.process_tags(
+                ctx, val, kwargs.get("args", ""), _variables=kwargs.get("_variables")
+            )
 
         @self.formatter.register("ignore")
         async def _ignore(ctx, text, **kwargs):
@@ -7907,7 +10424,13 @@ class Tags(commands.Cog):
                 return "[error: format should be {set:name|value}]"
             name, value = parts[0].strip(), parts[1].strip()
 
-            self._variables.setdefault(ctx.message.id, {})[name] = value
+            variables = kwargs.get("_variables")
+            if variables is None:
+                return ""
+            try:
+                variables.set(name, value)
+            except ValueError as e:
+                return f"[set error: {e}]"
             return ""
 
         @self.formatter.register("get")
@@ -7917,7 +10440,9 @@ class Tags(commands.Cog):
                 * Retrieves a previously set variable in the tag.
                 * Example: `Hello {get:name}!`
             """
-            variables = self._variables.get(ctx.message.id, {})
+            variables = kwargs.get("_variables")
+            if variables is None:
+                return ""
             return str(variables.get(name.strip(), ""))
 
         @self.formatter.register("math")
@@ -7926,43 +10451,14 @@ class Tags(commands.Cog):
         async def _math(ctx, expr, **kwargs):
             """
             ### {math:expression}
-                * Evaluates a mathematical expression via libqalculate.
-                * Supports all libqalculate functionality.
+                * Evaluates a mathematical expression.
+                * Plain arithmetic, common functions and simple unit conversions are evaluated in-process; anything else is handed to libqalculate.
                 * Example: `{math:5+3*2}` -> "11"
             """
             if not expr or not expr.strip():
                 return "0"
 
-            proc = None
-            try:
-                proc = await asyncio.create_subprocess_exec(
-                    "qalc",
-                    "-t",
-                    expr.strip(),
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                )
-                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=5.0)
-
-                if proc.returncode != 0:
-                    err = stderr.decode().strip()
-                    out = stdout.decode().strip()
-                    return (
-                        err
-                        or out
-                        or f"[math error: qalc returned exit code {proc.returncode}]"
-                    )
-
-                return stdout.decode().strip()
-
-            except asyncio.TimeoutError:
-                if proc is not None and proc.returncode is None:
-                    proc.kill()
-                return "[math error: timed out]"
-            except FileNotFoundError:
-                return "[math error: qalc not installed]"
-            except Exception as e:
-                return f"[math error: {e}]"
+            return await evaluate_math(expr)
 
         @self.formatter.register("python")
         @self.formatter.register("py")
@@ -10367,18 +12863,21 @@ class Tags(commands.Cog):
         return parts
 
     async def process_tags(
-        self, ctx: commands.Context, content: str, args: str = ""
+        self, ctx: commands.Context, content: str, args: str = "", **kwargs
     ) -> tuple[str, list, discord.ui.View]:
         self._exec_file_registry.clear()
-        return await self.formatter.format(content, ctx, args=args)
+        return await self.formatter.format(content, ctx, args=args, **kwargs)
 
-    @commands.Cog.listener()
-    async def on_message_delete(self, message):
-        if message.id in self._variables:
-            del self._variables[message.id]
+    async def cog_load(self):
+        await asyncio.to_thread(TEMP_STORAGE.sweep)
 
     def cog_unload(self):
         asyncio.create_task(self.processor.cleanup())
+        self._exec_file_registry.cleanup()
+        asyncio.create_task(QALC_WORKER.close())
+        asyncio.create_task(MEDIA_DOWNLOAD_CACHE.close())
+        STEP_CACHE.clear()
+        MEDIA_PROBE.save()
 
     @commands.Cog.listener()
     async def on_interaction(self, interaction: discord.Interaction):
@@ -11659,6 +14158,186 @@ class Tags(commands.Cog):
             except Exception as e:
                 await ctx.send(f"An error occurred: {str(e)}")
 
+    @commands.command(
+        name="mathbench",
+        description="Compare the in-process {math} evaluator against qalc.",
+        hidden=True,
+    )
+    @bot_info.is_owner()
+    async def mathbench(self, ctx: commands.Context, iterations: int = 20):
+        iterations = max(1, min(iterations, 200))
+        expressions = [
+            "5+3*2",
+            "(17^3 - 4) / 7",
+            "sqrt(2) * pi",
+            "factorial(20) / 3",
+            "5 km to m",
+        ]
+
+        async def in_process(expr):
+            return MATH_EVALUATOR._evaluate(expr)
+
+        async def cached(expr):
+            return MATH_EVALUATOR.evaluate(expr)
+
+        paths = [
+            ("in-process", in_process),
+            ("cached", cached),
+            ("qalc worker", QALC_WORKER.evaluate),
+            ("qalc subprocess", run_qalc),
+        ]
+
+        await ctx.typing()
+        lines = []
+        calls = iterations * len(expressions)
+        for label, func in paths:
+            start = time.perf_counter()
+            try:
+                for _ in range(iterations):
+                    for expr in expressions:
+                        await func(expr)
+            except Exception as e:
+                lines.append(f"{label:<16} failed: {e}")
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            lines.append(
+                f"{label:<16} {elapsed:>10.2f} ms total {elapsed / calls:>9.4f} ms/call"
+            )
+
+        await ctx.send(
+            f"**{calls} evaluations per path**\n```\n" + "\n".join(lines) + "\n```"
+        )
+
+    @commands.command(
+        name="fusebench",
+        description="Compare fused and step-by-step GScript filter chains.",
+        hidden=True,
+    )
+    @bot_info.is_owner()
+    async def fusebench(self, ctx: commands.Context):
+        scripts = {
+            "color grade": "contrast src 1.2 a\nsaturate a 1.4 b\nhue b 20 c\n"
+            "brightness c 0.05 d\ngamma d 1.1 out",
+            "resize + crop": "resize src 320 240 a\ncrop a 10 10 300 200 b\n"
+            "invert b out",
+            "audio + video": "volume src 0.5 a\nsepia a b\ngrayscale b out",
+        }
+
+        async def ssim(first: str, second: str) -> float | None:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg",
+                "-hide_banner",
+                "-i",
+                first,
+                "-i",
+                second,
+                "-lavfi",
+                "ssim",
+                "-f",
+                "null",
+                "-",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await proc.communicate()
+            match = re.search(r"All:([\d.]+)", stderr.decode(errors="replace"))
+            return float(match.group(1)) if match else None
+
+        await ctx.typing()
+        processor = MediaProcessor()
+        # every run has to do the work it is timing
+        processor.memoise_steps = False
+        try:
+            source = processor._get_temp_path("mp4")
+            success, error = await processor._run_ffmpeg(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "testsrc2=size=640x360:rate=25:duration=5",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "sine=frequency=440:duration=5",
+                    "-pix_fmt",
+                    "yuv420p",
+                    "-shortest",
+                    "-y",
+                    source.as_posix(),
+                ]
+            )
+            if not success:
+                return await ctx.send(error[:1900])
+
+            lines = []
+            for name, script in scripts.items():
+                outputs = {}
+                timings = {}
+                for fused in (True, False):
+                    processor.fuse_filters = fused
+                    processor.media_cache["src"] = str(source)
+                    start = time.perf_counter()
+                    result = await processor.execute_media_script(script)
+                    timings[fused] = time.perf_counter() - start
+                    if result and os.path.exists(result[0]):
+                        outputs[fused] = result[0]
+                if len(outputs) != 2:
+                    lines.append(f"{name:<14} failed: {result}")
+                    continue
+                score = await ssim(outputs[True], outputs[False])
+                verdict = "ok" if score is not None and score >= 0.98 else "MISMATCH"
+                lines.append(
+                    f"{name:<14} fused {timings[True]:>6.2f}s  "
+                    f"unfused {timings[False]:>6.2f}s  ssim {score}  {verdict}"
+                )
+        finally:
+            await processor.cleanup()
+
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.command(
+        name="mediacaches",
+        description="Show hit rates of the shared media caches.",
+        hidden=True,
+    )
+    @bot_info.is_owner()
+    async def mediacaches(self, ctx: commands.Context):
+        caches = {name: cache.stats() for name, cache in MEDIA_CACHES.items()}
+        lines = [
+            f"{name:<14} {stats['entries']:>5} entries "
+            f"{stats['bytes'] / 1024 / 1024:>8.1f} MB  "
+            f"hits {stats['hits']:>6}  misses {stats['misses']:>6}  "
+            f"hit rate {stats['hit_rate']:.1%}"
+            for name, stats in caches.items()
+        ]
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.command(
+        name="tempstorage",
+        description="Show usage of the shared temporary storage.",
+        hidden=True,
+    )
+    @bot_info.is_owner()
+    async def tempstorage(self, ctx: commands.Context):
+        stats = await asyncio.to_thread(TEMP_STORAGE.stats)
+        mb = 1024 * 1024
+        lines = [
+            f"{name:<6} {tier['leases']:>4} leases  "
+            f"reserved {tier['reserved'] / mb:>8.1f} MB  "
+            f"used {tier['used'] / mb:>8.1f} MB  "
+            f"free {tier['free'] / mb:>9.1f} MB  {tier['root']}"
+            for name, tier in stats["tiers"].items()
+        ]
+        lines.append(
+            f"total reserved {stats['reserved'] / mb:.1f} "
+            f"of {stats['quota'] / mb:.0f} MB by {stats['users']} users, "
+            f"{stats['leased']} leased, "
+            f"{stats['refused']} refused, {stats['swept']} swept"
+        )
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
 
 async def setup(bot):
     if not hasattr(bot, "pool"):
@@ -6,7 +6,6 @@ import shlex
 import shutil
 import tempfile
 import time
-import uuid
 
 import discord
 import yt_dlp
@@ -14,12 +13,18 @@ from discord import app_commands
 from discord.ext import commands, tasks
 from yt_dlp.utils import download_range_func
 
+from media_services import (
+    FFMPEG_SCHEDULER,
+    TEMP_STORAGE,
+    FFmpegScheduler,
+    TempStorageFull,
+)
+
 
 class Ytdlp(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.download_semaphore = asyncio.Semaphore(3)
-        self.temp_dir_prefix = f"yt_dlp_{os.getpid()}_"
         self.clean_temp_dir.start()
 
     @commands.Cog.listener()
@@ -40,14 +45,15 @@ class Ytdlp(commands.Cog):
     async def ytdlp(self, ctx: commands.Context, url: str, *, options: str = ""):
         await ctx.typing()
         async with self.download_semaphore:
-            temp_dir = os.path.join(
-                tempfile.gettempdir(), f"{self.temp_dir_prefix}{uuid.uuid4().hex}"
-            )
-            os.makedirs(temp_dir, exist_ok=True)
-            lock_file = os.path.join(temp_dir, "active.lock")
             try:
-                with open(lock_file, "w") as f:
-                    f.write("active")
+                lease = TEMP_STORAGE.lease(
+                    "yt_dlp", ctx.author.id, reserve=ctx.filesize_limit
+                )
+            except TempStorageFull as e:
+                await ctx.send(str(e))
+                return
+            temp_dir = str(lease.path)
+            try:
                 if " " in url and not url.startswith(
                     ("http://", "https://", "ytsearch", "ytsearch:")
                 ):
@@ -59,6 +65,8 @@ class Ytdlp(commands.Cog):
                     "no_warnings": True,
                     "outtmpl": "%(extractor)s-%(id)s.%(ext)s",
                     "paths": {"home": temp_dir, "temp": temp_dir},
+                    # yt-dlp refuses files it knows are bigger before writing
+                    "max_filesize": lease.headroom(),
                 }
 
                 if options.strip():
@@ -83,6 +91,8 @@ class Ytdlp(commands.Cog):
                         infos = await self.extract_info(
                             ydl_opts, entry, download=not ydl_opts.get("json", False)
                         )
+                        await lease.refresh()
+                        lease.ensure()
                         for info in infos:
                             if ydl_opts.get("listformats", False):
                                 await self.handle_listformats(ctx, info)
@@ -133,6 +143,7 @@ class Ytdlp(commands.Cog):
                             ydl_opts["ffmpeg"],
                             temp_dir,
                             ydl_opts.get("postprocessors", []),
+                            user_id=ctx.author.id,
                         )
                     except Exception as e:
                         await ctx.send(f"Filter processing failed:\n{e}")
@@ -143,14 +154,7 @@ class Ytdlp(commands.Cog):
             except Exception as e:
                 await ctx.send(f"An error occurred during download: {str(e)}")
             finally:
-                try:
-                    os.remove(lock_file)
-                except Exception:
-                    pass
-                try:
-                    shutil.rmtree(temp_dir)
-                except Exception:
-                    pass
+                lease.release()
 
     async def send_results(
         self,
@@ -204,7 +208,9 @@ class Ytdlp(commands.Cog):
         ):
             await ctx.send("No videos could be downloaded.")
 
-    async def apply_filter_complex(self, entries, filter_str, temp_dir, postprocessors):
+    async def apply_filter_complex(
+        self, entries, filter_str, temp_dir, postprocessors, user_id=None
+    ):
         if not entries:
             return entries
 
@@ -250,10 +256,13 @@ class Ytdlp(commands.Cog):
             output_path,
         ]
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
+        async with FFMPEG_SCHEDULER.slot(user_id, FFmpegScheduler.INTERACTIVE):
+            cmd = FFMPEG_SCHEDULER.tune_threads(cmd)
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            FFMPEG_SCHEDULER.renice(process.pid, FFmpegScheduler.INTERACTIVE)
+            stdout, stderr = await process.communicate()
 
         if process.returncode != 0:
             raise RuntimeError(f"```{stderr.decode()}```")
@@ -442,16 +451,8 @@ class Ytdlp(commands.Cog):
 
     @tasks.loop(minutes=30)
     async def clean_temp_dir(self):
-        temp_parent = tempfile.gettempdir()
         try:
-            for name in os.listdir(temp_parent):
-                if name.startswith("yt_dlp_"):
-                    path = os.path.join(temp_parent, name)
-                    try:
-                        if os.path.getmtime(path) < time.time() - 3600:
-                            await self.safe_cleanup(path)
-                    except Exception as e:
-                        print(f"Could not delete {path}: {e}")
+            await asyncio.to_thread(TEMP_STORAGE.sweep)
         except Exception as e:
             print(f"Error cleaning temp dir: {e}")
 
@@ -6,13 +6,16 @@ import signal
 import tempfile
 import time
 import traceback
+import uuid
 from collections import defaultdict
 from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import List
+from urllib.parse import quote
 
 from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 APP_USER = "gcoder"
 EXECUTION_BASE = Path("/home/gcoder")
@@ -38,6 +41,9 @@ ALLOWED_LANGUAGES = [
     "kotlin",
     "nim",
 ]
+MAX_BATCH_JOBS = 20
+BATCH_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 _active_work_dirs: set[Path] = set()
@@ -108,283 +114,323 @@ async def validate_file(file: UploadFile):
     file.filename = safe_name
 
 
-async def execute_code(language: str, code: str, files: List[UploadFile]):
-    ensure_dirs()
-    work_dir = Path(tempfile.mkdtemp(dir=EXECUTION_BASE, prefix="job_"))
-    stage_dir = STAGING_BASE / work_dir.name
-    work_dir.chmod(0o700)
-    input_dir = work_dir / "input"
-    input_dir.mkdir(mode=0o700)
-    output_dir = work_dir / "output"
-    output_dir.mkdir(mode=0o700)
-
+async def save_uploads(files: List[UploadFile], input_dir: Path) -> list[str]:
     saved_files = []
     for file in files:
         await validate_file(file)
         file_path = input_dir / file.filename
         with file_path.open("wb") as f:
-            content = await file.read()
-            f.write(content)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                f.write(chunk)
         saved_files.append(file.filename)
+    return saved_files
 
+
+def build_env(work_dir: Path, input_files: list[Path]) -> dict[str, str]:
     env = {
         "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
         "HOME": str(work_dir),
         "PLAYWRIGHT_BROWSERS_PATH": "/usr/lib/playwright",
         "NODE_PATH": "/usr/lib64/node_modules",
     }
-    for i, filename in enumerate(saved_files, start=1):
-        env[f"FILE_{i}"] = str(input_dir / filename)
-
-    async def run_with_timeout(cmd, cwd=None, env=env, input_data=None):
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            cwd=cwd,
-            env=env,
-            stdin=asyncio.subprocess.PIPE if input_data else None,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            start_new_session=True,
+    for i, path in enumerate(input_files, start=1):
+        env[f"FILE_{i}"] = str(path)
+    return env
+
+
+async def run_command(cmd, env, cwd=None, input_data=None):
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        env=env,
+        stdin=asyncio.subprocess.PIPE if input_data else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            proc.communicate(input=input_data), timeout=60
         )
+        return (
+            stdout.decode("utf-8", errors="replace")
+            + stderr.decode("utf-8", errors="replace"),
+            proc.returncode,
+        )
+    except asyncio.TimeoutError:
         try:
-            stdout, stderr = await asyncio.wait_for(
-                proc.communicate(input=input_data), timeout=60
-            )
-            return stdout.decode("utf-8", errors="replace") + stderr.decode(
-                "utf-8", errors="replace"
-            ), proc.returncode
-        except asyncio.TimeoutError:
-            try:
-                os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-            except ProcessLookupError:
-                pass
-            return "Code execution took longer than 60 seconds", 1
-
-    async with _active_work_dirs_lock:
-        _active_work_dirs.add(work_dir)
-
-    try:
-        output = ""
-        return_code = 1
-        if language == "bash":
-            sh_file = work_dir / "script.sh"
-            with sh_file.open("w") as f:
-                f.write("#!/bin/bash\n")
+            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        return "Code execution took longer than 60 seconds", 1
+
+
+async def run_language(
+    language: str, code: str, work_dir: Path, env: dict[str, str]
+) -> tuple[str, int]:
+    async def run_with_timeout(cmd, cwd=None, input_data=None):
+        return await run_command(cmd, env, cwd=cwd, input_data=input_data)
+
+    output = ""
+    return_code = 1
+    if language == "bash":
+        sh_file = work_dir / "script.sh"
+        with sh_file.open("w") as f:
+            f.write("#!/bin/bash\n")
+            f.write(code)
+        sh_file.chmod(0o700)
+        output, return_code = await run_with_timeout([str(sh_file)], cwd=work_dir)
+    elif language == "fish":
+        fish_file = work_dir / "script.fish"
+        with fish_file.open("w") as f:
+            f.write(code)
+        fish_file.chmod(0o700)
+        output, return_code = await run_with_timeout(
+            ["fish", str(fish_file)], cwd=work_dir
+        )
+    elif language == "nu":
+        nu_file = work_dir / "script.nu"
+        with nu_file.open("w") as f:
+            f.write(code)
+        nu_file.chmod(0o700)
+        output, return_code = await run_with_timeout(["nu", str(nu_file)], cwd=work_dir)
+    elif language == "elvish":
+        elv_file = work_dir / "script.elv"
+        with elv_file.open("w") as f:
+            f.write(code)
+        elv_file.chmod(0o700)
+        output, return_code = await run_with_timeout(
+            ["elvish", str(elv_file)], cwd=work_dir
+        )
+    elif language in ["javascript", "typescript"]:
+        if language == "typescript":
+            script_path = work_dir / "script.ts"
+            with script_path.open("w") as f:
                 f.write(code)
-            sh_file.chmod(0o700)
-            output, return_code = await run_with_timeout([str(sh_file)], cwd=work_dir)
-        elif language == "fish":
-            fish_file = work_dir / "script.fish"
-            with fish_file.open("w") as f:
+            tsconfig = {
+                "compilerOptions": {
+                    "target": "ES2020",
+                    "module": "CommonJS",
+                    "strict": True,
+                    "esModuleInterop": True,
+                    "skipLibCheck": True,
+                    "types": ["node"],
+                },
+                "ts-node": {"transpileOnly": True, "files": True},
+            }
+            with (work_dir / "tsconfig.json").open("w") as f:
+                json.dump(tsconfig, f)
+            cmd = ["ts-node", "--files", "--transpile-only", str(script_path)]
+            output, return_code = await run_with_timeout(cmd, cwd=work_dir)
+        else:
+            js_file = work_dir / "script.js"
+            with js_file.open("w") as f:
                 f.write(code)
-            fish_file.chmod(0o700)
             output, return_code = await run_with_timeout(
-                ["fish", str(fish_file)], cwd=work_dir
+                ["node", str(js_file)], cwd=work_dir
             )
-        elif language == "nu":
-            nu_file = work_dir / "script.nu"
-            with nu_file.open("w") as f:
-                f.write(code)
-            nu_file.chmod(0o700)
+    elif language == "python":
+        py_file = work_dir / "script.py"
+        with py_file.open("w") as f:
+            f.write(code)
+        output, return_code = await run_with_timeout(
+            ["python", str(py_file)], cwd=work_dir
+        )
+    elif language == "php":
+        php_file = work_dir / "script.php"
+        with php_file.open("w") as f:
+            f.write(code)
+        output, return_code = await run_with_timeout(
+            ["php", str(php_file)], cwd=work_dir
+        )
+    elif language == "ruby":
+        rb_file = work_dir / "script.rb"
+        with rb_file.open("w") as f:
+            f.write(code)
+        output, return_code = await run_with_timeout(
+            ["ruby", str(rb_file)], cwd=work_dir
+        )
+    elif language == "lua":
+        lua_file = work_dir / "script.lua"
+        with lua_file.open("w") as f:
+            f.write(code)
+        output, return_code = await run_with_timeout(
+            ["lua", str(lua_file)], cwd=work_dir
+        )
+    elif language == "go":
+        go_file = work_dir / "script.go"
+        with go_file.open("w") as f:
+            f.write(code)
+        output, return_code = await run_with_timeout(
+            ["go", "run", str(go_file)], cwd=work_dir
+        )
+    elif language == "rust":
+        rust_file = work_dir / "script.rs"
+        with rust_file.open("w") as f:
+            f.write(code)
+        compile_out, compile_code = await run_with_timeout(
+            ["rustc", str(rust_file), "-o", str(work_dir / "script")], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["nu", str(nu_file)], cwd=work_dir
+                [str(work_dir / "script")], cwd=work_dir
             )
-        elif language == "elvish":
-            elv_file = work_dir / "script.elv"
-            with elv_file.open("w") as f:
-                f.write(code)
-            elv_file.chmod(0o700)
+    elif language == "c":
+        c_file = work_dir / "script.c"
+        with c_file.open("w") as f:
+            f.write(code)
+        compile_out, compile_code = await run_with_timeout(
+            ["gcc", str(c_file), "-o", str(work_dir / "script")], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["elvish", str(elv_file)], cwd=work_dir
+                [str(work_dir / "script")], cwd=work_dir
             )
-        elif language in ["javascript", "typescript"]:
-            if language == "typescript":
-                script_path = work_dir / "script.ts"
-                with script_path.open("w") as f:
-                    f.write(code)
-                tsconfig = {
-                    "compilerOptions": {
-                        "target": "ES2020",
-                        "module": "CommonJS",
-                        "strict": True,
-                        "esModuleInterop": True,
-                        "skipLibCheck": True,
-                        "types": ["node"],
-                    },
-                    "ts-node": {"transpileOnly": True, "files": True},
-                }
-                with (work_dir / "tsconfig.json").open("w") as f:
-                    json.dump(tsconfig, f)
-                cmd = ["ts-node", "--files", "--transpile-only", str(script_path)]
-                output, return_code = await run_with_timeout(cmd, cwd=work_dir)
-            else:
-                js_file = work_dir / "script.js"
-                with js_file.open("w") as f:
-                    f.write(code)
-                output, return_code = await run_with_timeout(
-                    ["node", str(js_file)], cwd=work_dir
-                )
-        elif language == "python":
-            py_file = work_dir / "script.py"
-            with py_file.open("w") as f:
-                f.write(code)
+    elif language == "cpp":
+        cpp_file = work_dir / "script.cpp"
+        with cpp_file.open("w") as f:
+            f.write(code)
+        compile_out, compile_code = await run_with_timeout(
+            ["g++", str(cpp_file), "-o", str(work_dir / "script")], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["python", str(py_file)], cwd=work_dir
+                [str(work_dir / "script")], cwd=work_dir
             )
-        elif language == "php":
-            php_file = work_dir / "script.php"
-            with php_file.open("w") as f:
-                f.write(code)
+    elif language == "csharp":
+        cs_file = work_dir / "script.cs"
+        with cs_file.open("w") as f:
+            f.write(code)
+        compile_out, compile_code = await run_with_timeout(
+            ["mcs", str(cs_file)], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["php", str(php_file)], cwd=work_dir
+                ["mono", str(work_dir / "script.exe")], cwd=work_dir
             )
-        elif language == "ruby":
-            rb_file = work_dir / "script.rb"
-            with rb_file.open("w") as f:
-                f.write(code)
+    elif language == "zig":
+        zig_file = work_dir / "script.zig"
+        with zig_file.open("w") as f:
+            f.write(code)
+        compile_out, compile_code = await run_with_timeout(
+            ["zig", "build-exe", str(zig_file)], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["ruby", str(rb_file)], cwd=work_dir
+                [str(work_dir / "script")], cwd=work_dir
             )
-        elif language == "lua":
-            lua_file = work_dir / "script.lua"
-            with lua_file.open("w") as f:
-                f.write(code)
+    elif language == "java":
+        java_file = work_dir / "script.java"
+        with java_file.open("w") as f:
+            f.write(code)
+
+        compile_out, compile_code = await run_with_timeout(
+            ["javac", str(java_file)], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["lua", str(lua_file)], cwd=work_dir
+                ["java", "-cp", str(work_dir), "script.java"], cwd=work_dir
             )
-        elif language == "go":
-            go_file = work_dir / "script.go"
-            with go_file.open("w") as f:
-                f.write(code)
+    elif language == "kotlin":
+        kt_file = work_dir / "script.kt"
+        with kt_file.open("w") as f:
+            f.write(code)
+
+        compile_jar = work_dir / "script.jar"
+        compile_out, compile_code = await run_with_timeout(
+            ["kotlinc", str(kt_file), "-include-runtime", "-d", str(compile_jar)],
+            cwd=work_dir,
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
             output, return_code = await run_with_timeout(
-                ["go", "run", str(go_file)], cwd=work_dir
-            )
-        elif language == "rust":
-            rust_file = work_dir / "script.rs"
-            with rust_file.open("w") as f:
-                f.write(code)
-            compile_out, compile_code = await run_with_timeout(
-                ["rustc", str(rust_file), "-o", str(work_dir / "script")], cwd=work_dir
+                ["java", "-jar", str(compile_jar)], cwd=work_dir
             )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    [str(work_dir / "script")], cwd=work_dir
-                )
-        elif language == "c":
-            c_file = work_dir / "script.c"
-            with c_file.open("w") as f:
-                f.write(code)
-            compile_out, compile_code = await run_with_timeout(
-                ["gcc", str(c_file), "-o", str(work_dir / "script")], cwd=work_dir
-            )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    [str(work_dir / "script")], cwd=work_dir
-                )
-        elif language == "cpp":
-            cpp_file = work_dir / "script.cpp"
-            with cpp_file.open("w") as f:
-                f.write(code)
-            compile_out, compile_code = await run_with_timeout(
-                ["g++", str(cpp_file), "-o", str(work_dir / "script")], cwd=work_dir
-            )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    [str(work_dir / "script")], cwd=work_dir
-                )
-        elif language == "csharp":
-            cs_file = work_dir / "script.cs"
-            with cs_file.open("w") as f:
-                f.write(code)
-            compile_out, compile_code = await run_with_timeout(
-                ["mcs", str(cs_file)], cwd=work_dir
-            )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    ["mono", str(work_dir / "script.exe")], cwd=work_dir
-                )
-        elif language == "zig":
-            zig_file = work_dir / "script.zig"
-            with zig_file.open("w") as f:
-                f.write(code)
-            compile_out, compile_code = await run_with_timeout(
-                ["zig", "build-exe", str(zig_file)], cwd=work_dir
+    elif language == "nim":
+        nim_file = work_dir / "script.nim"
+        with nim_file.open("w") as f:
+            f.write(code)
+        compile_out, compile_code = await run_with_timeout(
+            ["nim", "c", str(nim_file)], cwd=work_dir
+        )
+        if compile_code != 0:
+            output = compile_out
+            return_code = compile_code
+        else:
+            output, return_code = await run_with_timeout(
+                [str(work_dir / "script")], cwd=work_dir
             )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    [str(work_dir / "script")], cwd=work_dir
-                )
-        elif language == "java":
-            java_file = work_dir / "script.java"
-            with java_file.open("w") as f:
-                f.write(code)
+    return output, return_code
 
-            compile_out, compile_code = await run_with_timeout(
-                ["javac", str(java_file)], cwd=work_dir
-            )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    ["java", "-cp", str(work_dir), "script.java"], cwd=work_dir
-                )
-        elif language == "kotlin":
-            kt_file = work_dir / "script.kt"
-            with kt_file.open("w") as f:
-                f.write(code)
 
-            compile_jar = work_dir / "script.jar"
-            compile_out, compile_code = await run_with_timeout(
-                ["kotlinc", str(kt_file), "-include-runtime", "-d", str(compile_jar)],
-                cwd=work_dir,
-            )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    ["java", "-jar", str(compile_jar)], cwd=work_dir
-                )
-        elif language == "nim":
-            nim_file = work_dir / "script.nim"
-            with nim_file.open("w") as f:
-                f.write(code)
-            compile_out, compile_code = await run_with_timeout(
-                ["nim", "c", str(nim_file)], cwd=work_dir
-            )
-            if compile_code != 0:
-                output = compile_out
-                return_code = compile_code
-            else:
-                output, return_code = await run_with_timeout(
-                    [str(work_dir / "script")], cwd=work_dir
-                )
+def stage_outputs(output_dir: Path, stage_dir: Path) -> list[str]:
+    ensure_dirs()
+    produced = [f for f in output_dir.iterdir() if f.is_file()]
+    final_files = []
+    if produced:
+        stage_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        for f in produced:
+            dest = stage_dir / f.name
+            shutil.copy2(f, dest)
+            final_files.append(f.name)
+    return final_files
+
+
+async def release_work_dir(work_dir: Path, stage_dir: Path):
+    async with _active_work_dirs_lock:
+        _active_work_dirs.discard(work_dir)
+    safe_delete(work_dir)
+    if stage_dir.exists() and not any(stage_dir.iterdir()):
+        safe_delete(stage_dir)
+    async with _active_work_dirs_lock:
+        active = set(_active_work_dirs)
+    for entry in EXECUTION_BASE.iterdir():
+        if entry == STAGING_BASE:
+            continue
+        if entry in active:
+            continue
+        safe_delete(entry)
 
-        ensure_dirs()
-        produced = [f for f in output_dir.iterdir() if f.is_file()]
-        final_files = []
-        if produced:
-            stage_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
-            for f in produced:
-                dest = stage_dir / f.name
-                shutil.copy2(f, dest)
-                final_files.append(f.name)
+
+async def execute_code(language: str, code: str, files: List[UploadFile]):
+    ensure_dirs()
+    work_dir = Path(tempfile.mkdtemp(dir=EXECUTION_BASE, prefix="job_"))
+    stage_dir = STAGING_BASE / work_dir.name
+    work_dir.chmod(0o700)
+    input_dir = work_dir / "input"
+    input_dir.mkdir(mode=0o700)
+    output_dir = work_dir / "output"
+    output_dir.mkdir(mode=0o700)
+
+    saved_files = await save_uploads(files, input_dir)
+    env = build_env(work_dir, [input_dir / filename for filename in saved_files])
+
+    async with _active_work_dirs_lock:
+        _active_work_dirs.add(work_dir)
+
+    try:
+        output, return_code = await run_language(language, code, work_dir, env)
+        final_files = stage_outputs(output_dir, stage_dir)
 
         return {
             "output": output.strip(),
@@ -398,19 +444,136 @@ async def execute_code(language: str, code: str, files: List[UploadFile]):
         print(f"Code execution Error: {traceback.format_exc()}")
         raise HTTPException(500, detail=f"Code execution failed: {str(e)}")
     finally:
-        async with _active_work_dirs_lock:
-            _active_work_dirs.discard(work_dir)
-        safe_delete(work_dir)
-        if stage_dir.exists() and not any(stage_dir.iterdir()):
-            safe_delete(stage_dir)
-        async with _active_work_dirs_lock:
-            active = set(_active_work_dirs)
-        for entry in EXECUTION_BASE.iterdir():
-            if entry == STAGING_BASE:
-                continue
-            if entry in active:
-                continue
-            safe_delete(entry)
+        await release_work_dir(work_dir, stage_dir)
+
+
+async def execute_batch(
+    jobs: list[dict], files: List[UploadFile], registry_keys: list[str]
+):
+    ensure_dirs()
+    work_dir = Path(tempfile.mkdtemp(dir=EXECUTION_BASE, prefix="batch_"))
+    stage_dir = STAGING_BASE / work_dir.name
+    work_dir.chmod(0o700)
+    upload_dir = work_dir / "uploads"
+    upload_dir.mkdir(mode=0o700)
+    input_dir = work_dir / "input"
+    output_dir = work_dir / "output"
+
+    async with _active_work_dirs_lock:
+        _active_work_dirs.add(work_dir)
+
+    try:
+        uploads = []
+        for index, file in enumerate(files):
+            # uploads may share a filename, keep each one in its own directory
+            file_dir = upload_dir / str(index)
+            file_dir.mkdir(mode=0o700)
+            uploads.append(file_dir / (await save_uploads([file], file_dir))[0])
+        # the trailing uploads are the client's FILE_N registry, which later
+        # jobs overwrite with their own outputs
+        split = len(uploads) - len(registry_keys)
+        attachments = uploads[:split]
+        registry: dict[str, Path] = dict(zip(registry_keys, uploads[split:]))
+        results = []
+        for index, job in enumerate(jobs):
+            for path in (input_dir, output_dir):
+                safe_delete(path)
+                path.mkdir(mode=0o700)
+
+            inputs = []
+            for source in attachments + [registry[key] for key in sorted(registry)]:
+                dest = input_dir / source.name
+                shutil.copy2(source, dest)
+                inputs.append(dest)
+
+            env = build_env(work_dir, inputs)
+            output, return_code = await run_language(
+                job["language"], job["code"], work_dir, env
+            )
+            job_stage = stage_dir / str(index)
+            final_files = stage_outputs(output_dir, job_stage)
+            for idx, filename in enumerate(final_files[:10], start=1):
+                registry[f"FILE_{idx}"] = job_stage / filename
+
+            results.append(
+                {
+                    "output": output.strip(),
+                    "files": final_files,
+                    "error": return_code != 0,
+                }
+            )
+
+        return {"job_id": work_dir.name, "results": results}
+
+    except Exception as e:
+        safe_delete(stage_dir)
+        print(f"Batch execution Error: {traceback.format_exc()}")
+        raise HTTPException(500, detail=f"Batch execution failed: {str(e)}")
+    finally:
+        await release_work_dir(work_dir, stage_dir)
+
+
+def multipart_batch_response(batch: dict) -> StreamingResponse:
+    boundary = uuid.uuid4().hex
+    stage_dir = STAGING_BASE / batch["job_id"]
+
+    def part_header(headers: dict[str, str]) -> bytes:
+        lines = [f"--{boundary}"] + [f"{k}: {v}" for k, v in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    def body():
+        yield part_header({"Content-Type": "application/json"})
+        yield json.dumps(batch).encode() + b"\r\n"
+        for index, result in enumerate(batch["results"]):
+            for filename in result["files"]:
+                # output names come from user code; RFC 5987 encoding keeps
+                # quotes and line breaks out of the part header
+                disposition = (
+                    f'attachment; name="{index}"; '
+                    f"filename*=UTF-8''{quote(filename, safe='')}"
+                )
+                yield part_header(
+                    {
+                        "Content-Type": "application/octet-stream",
+                        "Content-Disposition": disposition,
+                    }
+                )
+                with (stage_dir / str(index) / filename).open("rb") as f:
+                    while chunk := f.read(BATCH_CHUNK_SIZE):
+                        yield chunk
+                yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(
+        body(),
+        media_type=f"multipart/mixed; boundary={boundary}",
+        background=BackgroundTask(safe_delete, stage_dir),
+    )
+
+
+@app.post("/batch/execute")
+async def execute_batch_endpoint(
+    jobs: str = Form(...),
+    registry_keys: str = Form("[]"),
+    files: List[UploadFile] = File([]),
+):
+    try:
+        jobs = json.loads(jobs)
+        registry_keys = json.loads(registry_keys)
+    except json.JSONDecodeError:
+        raise HTTPException(400, detail="Invalid jobs payload")
+    if not isinstance(jobs, list) or not jobs:
+        raise HTTPException(400, detail="Invalid jobs payload")
+    if not isinstance(registry_keys, list) or len(registry_keys) > len(files):
+        raise HTTPException(400, detail="Invalid registry keys")
+    if len(jobs) > MAX_BATCH_JOBS:
+        raise HTTPException(400, detail=f"Batches are limited to {MAX_BATCH_JOBS} jobs")
+    for job in jobs:
+        if not isinstance(job, dict) or not isinstance(job.get("code"), str):
+            raise HTTPException(400, detail="Invalid jobs payload")
+        if job.get("language") not in ALLOWED_LANGUAGES:
+            raise HTTPException(400, detail="Unsupported language")
+    return multipart_batch_response(await execute_batch(jobs, files, registry_keys))
 
 
 @app.post("/{language}/execute")
@@ -2620,7 +2620,8 @@ def cleanup_code(content: str) -> str:
     return content.strip()
 
 
-setup_logger()
-
-
-bot.run(bot_info.data["login"], log_handler=None)
+if __name__ == "__main__":
+    # render workers import this file as __mp_main__; only the real entry
+    # point logs in
+    setup_logger()
+    bot.run(bot_info.data["login"], log_handler=None)
@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psutil
+
+from cogs.tags import MediaProcessor
+from media_services import MEDIA_PROBE, MediaDownloadCache
+
+# Benchmarks GScript on synthetic media and writes a JSON report. Run it from
+# the repository root with a bot_info.json present (a copy of the template is
+# enough), e.g. in CI:
+#
+#   python gscriptbench.py --runs 3 --output report.json --baseline main.json
+#
+# Passing the report of an earlier run as --baseline adds each case's wall time
+# change to the summary. The exit status is 1 when any case fails.
+
+ROOT = Path(__file__).resolve().parent
+
+# synthetic sources: key -> (extension, ffmpeg arguments)
+INPUTS = {
+    "sd": (
+        "mp4",
+        [
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=640x360:rate=25:duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:duration=4",
+            "-pix_fmt",
+            "yuv420p",
+            "-shortest",
+        ],
+    ),
+    "hd": (
+        "mp4",
+        [
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=1280x720:rate=30:duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=660:duration=4",
+            "-pix_fmt",
+            "yuv420p",
+            "-shortest",
+        ],
+    ),
+    "webm": (
+        "webm",
+        [
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=480x270:rate=24:duration=3",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=550:duration=3",
+            "-deadline",
+            "realtime",
+            "-cpu-used",
+            "8",
+            "-shortest",
+        ],
+    ),
+    "gif": ("gif", ["-f", "lavfi", "-i", "testsrc=size=320x240:rate=10:duration=2"]),
+    "img": ("png", ["-f", "lavfi", "-i", "testsrc2=size=1280x720", "-frames:v", "1"]),
+    "aud": ("mp3", ["-f", "lavfi", "-i", "sine=frequency=330:duration=6"]),
+}
+# case -> (source bound to "src", script). Every source is also loaded under its
+# own key. "load" is left out because it fetches over the network.
+CASES = {
+    "reverse": ("sd", "reverse src out"),
+    "concat": ("sd", "concat out src src"),
+    "convert": ("sd", "convert src gif out"),
+    "render": ("sd", "invert src out\nrender out webm"),
+    "export": ("sd", "invert src out\nexport out"),
+    "contrast": ("hd", "contrast src 1.3 out"),
+    "opacity": ("img", "opacity src 0.5 out"),
+    "saturate": ("hd", "saturate src 1.5 out"),
+    "hue": ("hd", "hue src 45 out"),
+    "brightness": ("hd", "brightness src 0.1 out"),
+    "gamma": ("hd", "gamma src 1.2 out"),
+    "clone": ("sd", "clone src a\ninvert a out"),
+    "fps": ("hd", "fps src 15 out"),
+    "grayscale": ("webm", "grayscale src out"),
+    "sepia": ("gif", "sepia src out"),
+    "invert": ("img", "invert src out"),
+    "tint": ("sd", "tint src 255 128 0 100 out"),
+    "resize": ("hd", "resize src 320 180 out"),
+    "crop": ("hd", "crop src 100 50 640 360 out"),
+    "rotate": ("sd", "rotate src 90 out"),
+    "trim": ("hd", "trim src 1 3 out"),
+    "speed": ("sd", "speed src 2 out"),
+    "volume": ("sd", "volume src 0.5 out"),
+    "overlay": ("hd", "resize img 320 180 logo\noverlay src logo 20 20 out"),
+    "text": ("img", 'text src "GScript benchmark" center center white out'),
+    "text gif": ("gif", 'text src "GScript benchmark" center center white out'),
+    "caption": ("sd", 'caption src "GScript benchmark" out'),
+    "caption gif": ("gif", 'caption src "GScript benchmark" out'),
+    "audioputreplace": ("sd", "audioputreplace src aud out"),
+    "audioputmix": ("sd", "audioputmix src aud out"),
+    "tremolo": ("aud", "tremolo src 5 0.5 out"),
+    "vibrato": ("aud", "vibrato src 5 0.5 out"),
+    "create": ("img", "create out 640 360 red"),
+    "fadein": ("sd", "fadein src 1 output_key=out"),
+    "fadeout": ("sd", "fadeout src 3 1 output_key=out"),
+    "colorkey": ("hd", "colorkey src color=white output_key=out"),
+    "chromakey": ("hd", "chromakey src color=green output_key=out"),
+    "setframecount": ("gif", "setframecount src 10 out"),
+    "set": ("hd", "set w 640\nresize src w 360 out"),
+    "dobetween": ("hd", "dobetween src 1 3 out\ninvert\nend"),
+    "foreachframe": ("gif", "foreachframe src out\ninvert\nend"),
+    "chain grade": (
+        "hd",
+        "contrast src 1.2 a\nsaturate a 1.4 b\nhue b 20 c\n"
+        "brightness c 0.05 d\ngamma d 1.1 out",
+    ),
+    "chain geometry": (
+        "hd",
+        "resize src 960 540 a\ncrop a 0 0 640 360 b\nrotate b 180 out",
+    ),
+    "chain edit": (
+        "sd",
+        "trim src 0 2 a\nspeed a 1.5 b\nfadein b 0.5 output_key=c\nconcat out c src",
+    ),
+    "chain gif": ("gif", 'caption src "when the benchmark" a\nspeed a 2 out'),
+}
+
+
+def _rss(me: psutil.Process) -> int:
+    total = me.memory_info().rss
+    for child in me.children(recursive=True):
+        with contextlib.suppress(psutil.Error):
+            total += child.memory_info().rss
+    return total
+
+
+def _cpu_seconds(me: psutil.Process) -> float:
+    # reaped ffmpeg runs are in children_*, live render workers are not
+    times = me.cpu_times()
+    total = sum(times[:2]) + times.children_user + times.children_system
+    for child in me.children(recursive=True):
+        with contextlib.suppress(psutil.Error):
+            total += sum(child.cpu_times()[:2])
+    return total
+
+
+async def _first_line(*cmd) -> str | None:
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+    except OSError:
+        return None
+    lines = stdout.decode(errors="replace").splitlines()
+    return lines[0].strip() if proc.returncode == 0 and lines else None
+
+
+async def _run_case(sources: dict, source: str, script: str) -> dict:
+    me = psutil.Process()
+    processor = MediaProcessor()
+    # every run has to do the work it is timing
+    processor.memoise_steps = False
+    peak = {"rss": 0, "disk": 0}
+
+    async def sample() -> None:
+        while True:
+            peak["rss"] = max(peak["rss"], await asyncio.to_thread(_rss, me))
+            if processor._lease is not None:
+                used = await asyncio.to_thread(processor._lease.usage)
+                peak["disk"] = max(peak["disk"], used)
+            await asyncio.sleep(0.1)
+
+    try:
+        for key, path in sources.items():
+            copy = processor._get_temp_path(path.suffix[1:])
+            await asyncio.to_thread(MediaDownloadCache.link, path, copy)
+            processor.media_cache[key] = str(copy)
+        processor.media_cache["src"] = processor.media_cache[source]
+        disk_base = await asyncio.to_thread(processor._lease.usage)
+        probes = MEDIA_PROBE.stats()["misses"]
+        cpu = await asyncio.to_thread(_cpu_seconds, me)
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        try:
+            result = await processor.execute_media_script(script)
+        finally:
+            wall = time.perf_counter() - start
+            sampler.cancel()
+        cpu = await asyncio.to_thread(_cpu_seconds, me) - cpu
+        failed = [r for r in result if not os.path.exists(r)]
+        return {
+            "ok": not failed,
+            "error": failed[0][:500] if failed else None,
+            "wall": round(wall, 4),
+            "cpu": round(cpu, 4),
+            "peak_rss": peak["rss"],
+            "temp_peak": max(0, peak["disk"] - disk_base),
+            "ffmpeg_runs": processor.ffmpeg_runs,
+            "ffprobe_runs": MEDIA_PROBE.stats()["misses"] - probes,
+            "output_bytes": sum(
+                os.path.getsize(r) for r in result if os.path.exists(r)
+            ),
+        }
+    finally:
+        await processor.cleanup()
+
+
+async def run(runs: int = 1, only: str = None) -> dict:
+    # the report: environment, commands no case covers, and per case the median
+    # wall and cpu time and the peak memory and temp use over all runs
+    runs = max(1, runs)
+    cases = {
+        name: case for name, case in CASES.items() if not only or only.lower() in name
+    }
+    if not cases:
+        raise ValueError(f"No benchmark case matches {only!r}")
+
+    generator = MediaProcessor()
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": await _first_line(
+            "git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"
+        ),
+        "ffmpeg": await _first_line("ffmpeg", "-hide_banner", "-version"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runs": runs,
+        "uncovered": sorted(
+            set(generator.command_specs)
+            - {"load"}
+            - {
+                line.split()[0]
+                for _, script in CASES.values()
+                for line in script.splitlines()
+            }
+        ),
+        "cases": {},
+    }
+    try:
+        sources = {}
+        for key, (extension, args) in INPUTS.items():
+            path = generator._get_temp_path(extension)
+            success, error = await generator._run_ffmpeg(
+                ["ffmpeg", "-hide_banner", *args, "-y", path.as_posix()],
+                intermediate=False,
+            )
+            if not success:
+                raise RuntimeError(f"Could not generate {key}: {error}")
+            sources[key] = path
+
+        for name, (source, script) in cases.items():
+            samples = [await _run_case(sources, source, script) for _ in range(runs)]
+            middle = len(samples) // 2
+            report["cases"][name] = {
+                "source": source,
+                "script": script,
+                **samples[-1],
+                "ok": all(sample["ok"] for sample in samples),
+                "wall": sorted(sample["wall"] for sample in samples)[middle],
+                "cpu": sorted(sample["cpu"] for sample in samples)[middle],
+                "peak_rss": max(sample["peak_rss"] for sample in samples),
+                "temp_peak": max(sample["temp_peak"] for sample in samples),
+            }
+    finally:
+        await generator.cleanup()
+    return report
+
+
+def summary(report: dict, baseline: dict = None) -> list[str]:
+    baseline = (baseline or {}).get("cases", {})
+    lines = []
+    for name, case in report["cases"].items():
+        if not case["ok"]:
+            lines.append(f"{name:<16} FAILED {case['error'][:60]}")
+            continue
+        line = (
+            f"{name:<16} {case['wall']:>6.2f}s  cpu {case['cpu']:>6.2f}s  "
+            f"rss {case['peak_rss'] / 1024 / 1024:>5.0f} MB  "
+            f"tmp {case['temp_peak'] / 1024 / 1024:>6.1f} MB  "
+            f"ff {case['ffmpeg_runs']:>2}"
+        )
+        before = baseline.get(name, {}).get("wall")
+        if before:
+            line += f"  {case['wall'] / before - 1:+.0%}"
+        lines.append(line)
+    if report["uncovered"]:
+        lines.append("not covered: " + ", ".join(report["uncovered"]))
+    return lines
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark GScript on synthetic media and report as JSON."
+    )
+    parser.add_argument("--runs", type=int, default=1, help="runs per case")
+    parser.add_argument("--only", help="only cases whose name contains this")
+    parser.add_argument("--baseline", help="report of an earlier run to compare")
+    parser.add_argument("--output", help="where to write the report (stdout)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    try:
+        report = asyncio.run(run(args.runs, args.only))
+    except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    print("\n".join(summary(report, baseline)), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0 if all(case["ok"] for case in report["cases"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
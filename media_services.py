@@ -0,0 +1,975 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Set
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import aiohttp
+import discord
+import yt_dlp
+from PIL import Image
+
+import bot_info
+
+# Process-wide media services. This is a plain module rather than part of an
+# extension so every cog shares one instance across loads and reloads.
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+async def stream_attachment(
+    session: aiohttp.ClientSession, attachment: discord.Attachment
+):
+    async with session.get(attachment.url) as resp:
+        if resp.status != 200:
+            raise RuntimeError(
+                f"Failed to fetch attachment {attachment.filename}: HTTP {resp.status}"
+            )
+        async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+async def download_to_path(
+    session: aiohttp.ClientSession, url: str, path: Path
+) -> bool:
+    async with session.get(url) as resp:
+        if resp.status != 200:
+            return False
+        try:
+            with path.open("wb") as f:
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+    return True
+
+
+class CacheStats:
+    # the counters and report shared by every process-wide cache; subclasses
+    # count their hits and misses and keep total_bytes and len() current
+    def __init__(self):
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class LRUCache(CacheStats):
+    def __init__(self, max_entries: int = 128, max_bytes: int = 0, sizeof=None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._data: OrderedDict = OrderedDict()
+        self._sizes: dict = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value) -> None:
+        size = self._sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        if key in self._data:
+            self.pop(key)
+        self._data[key] = value
+        self._sizes[key] = size
+        self.total_bytes += size
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes and self.total_bytes > self.max_bytes)
+        ):
+            self.pop(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        self.total_bytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+
+
+class MediaProbe:
+    # union of the fields MediaProcessor, Audio and Exif read
+    SHOW_ENTRIES = (
+        "format=duration,size,format_name,format_long_name,bit_rate,format_tags"
+        ":stream=codec_name,codec_type,codec_tag_string,codec_tag,codec_long_name,"
+        "width,height,duration,bit_rate,r_frame_rate,nb_frames,sample_rate,channels,"
+        "pix_fmt,extradata_hash"
+        ":side_data_list:format_tags:stream_tags"
+    )
+    SAMPLE_SIZE = 64 * 1024
+
+    def __init__(
+        self, max_entries: int = 1024, concurrency: int = 4, persist_path: str = None
+    ):
+        self._results = LRUCache(max_entries=max_entries)
+        self._keys = LRUCache(max_entries=max_entries)
+        self._pending: dict = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.persist_path = Path(persist_path) if persist_path else None
+        self._loaded = False
+        self._dirty = 0
+
+    def _content_key(self, path: str) -> str:
+        st = os.stat(path)
+        signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        cached = self._keys.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256(str(st.st_size).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read(self.SAMPLE_SIZE))
+            if st.st_size > self.SAMPLE_SIZE:
+                f.seek(max(st.st_size - self.SAMPLE_SIZE, self.SAMPLE_SIZE))
+                digest.update(f.read(self.SAMPLE_SIZE))
+        key = f"{digest.hexdigest()}:{st.st_mtime_ns}"
+        self._keys.put(path, (signature, key))
+        return key
+
+    def _load(self) -> None:
+        self._loaded = True
+        if not self.persist_path or not self.persist_path.exists():
+            return
+        try:
+            with self.persist_path.open("r", encoding="utf-8") as f:
+                for key, value in json.load(f).items():
+                    self._results.put(key, value)
+        except (OSError, ValueError):
+            pass
+
+    def save(self) -> None:
+        if not self.persist_path or not self._dirty:
+            return
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.persist_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(dict(self._results._data), f)
+        os.replace(tmp, self.persist_path)
+        self._dirty = 0
+
+    async def _run(self, target: str) -> tuple:
+        cmd = [
+            "ffprobe.exe" if platform.system() == "Windows" else "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            self.SHOW_ENTRIES,
+            "-show_data_hash",
+            "crc32",
+            "-of",
+            "json",
+            target,
+        ]
+        async with self._semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                creationflags=subprocess.CREATE_NO_WINDOW
+                if platform.system() == "Windows"
+                else 0,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=20)
+            except asyncio.TimeoutError:
+                proc.kill()
+                return False, "Error: FFprobe took longer than 20 seconds."
+        if proc.returncode != 0:
+            error_msg = stderr.decode("utf-8", errors="replace").strip()
+            return False, f"Error: FFprobe error: {error_msg}"
+        try:
+            return True, json.loads(stdout.decode("utf-8", errors="replace"))
+        except ValueError as e:
+            return False, f"Error: {str(e)}"
+
+    async def probe(self, target: str) -> tuple:
+        if not self._loaded:
+            await asyncio.to_thread(self._load)
+        try:
+            key = await asyncio.to_thread(self._content_key, target)
+        except OSError:
+            # URLs and other non-file inputs are probed every time
+            try:
+                return await self._run(target)
+            except Exception as e:
+                return False, f"Error: {str(e)}"
+
+        cached = self._results.get(key)
+        if cached is not None:
+            return tuple(cached)
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(target))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        try:
+            result = await asyncio.shield(task)
+        except Exception as e:
+            return False, f"Error: {str(e)}"
+
+        if result[0]:
+            # failures may be transient (timeouts, a file still being
+            # written), so only successful probes are remembered
+            self._results.put(key, list(result))
+            self._dirty += 1
+            if self._dirty >= 64:
+                await asyncio.to_thread(self.save)
+        return result
+
+    def stats(self) -> dict:
+        return self._results.stats()
+
+
+class FFmpegScheduler:
+    REALTIME, INTERACTIVE, BATCH = 0, 1, 2
+    NICENESS = {REALTIME: 0, INTERACTIVE: 5, BATCH: 10}
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self.running = 0
+        self._queues = {
+            self.INTERACTIVE: OrderedDict(),
+            self.BATCH: OrderedDict(),
+        }
+        self._realtime = weakref.WeakSet()
+
+    def track_realtime(self, source) -> None:
+        # voice playback spawns its own ffmpeg; it is never queued but
+        # takes a worker away from everything else while it plays
+        self._realtime.add(source)
+
+    @property
+    def realtime_load(self) -> int:
+        load = 0
+        for source in list(self._realtime):
+            process = getattr(source, "_process", None)
+            if process is not None and process.poll() is None:
+                load += 1
+        return load
+
+    def capacity(self) -> int:
+        return max(1, self.workers - self.realtime_load)
+
+    def queued(self) -> int:
+        return sum(
+            len(waiters)
+            for queue in self._queues.values()
+            for waiters in queue.values()
+        )
+
+    def position(self, future: asyncio.Future, priority: int) -> int:
+        ahead = sum(
+            len(waiters)
+            for p, queue in self._queues.items()
+            if p < priority
+            for waiters in queue.values()
+        )
+        queue = self._queues[priority]
+        depth = next(
+            (
+                list(waiters).index(future) + 1
+                for waiters in queue.values()
+                if future in waiters
+            ),
+            1,
+        )
+        # users are served round-robin, so each one ahead of us gets at most
+        # as many turns as we wait for
+        ahead += sum(min(len(waiters), depth) for waiters in queue.values())
+        return ahead
+
+    async def acquire(self, user_id=None, priority: int = INTERACTIVE, on_queued=None):
+        if priority == self.REALTIME or (
+            self.running < self.capacity() and not self.queued()
+        ):
+            self.running += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(future)
+        try:
+            if on_queued:
+                await on_queued(self.position(future, priority))
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                waiters = self._queues[priority].get(user_id)
+                if waiters and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._queues[priority][user_id]
+            raise
+        if on_queued:
+            await on_queued(0)
+
+    def release(self) -> None:
+        self.running = max(0, self.running - 1)
+        while self.running < self.capacity():
+            future = self._next_waiter()
+            if future is None:
+                return
+            self.running += 1
+            future.set_result(None)
+
+    def _next_waiter(self):
+        for priority in (self.INTERACTIVE, self.BATCH):
+            queue = self._queues[priority]
+            while queue:
+                user_id, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                del queue[user_id]
+                if waiters:
+                    queue[user_id] = waiters
+                if not future.done():
+                    return future
+        return None
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id=None, priority: int = INTERACTIVE, on_queued=None):
+        await self.acquire(user_id, priority, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def tune_threads(self, cmd: list) -> list:
+        if "-threads" in cmd or len(cmd) < 2:
+            return cmd
+        busy = max(1, self.running + self.realtime_load)
+        threads = max(1, (os.cpu_count() or 1) // busy)
+        return cmd[:-1] + ["-threads", str(threads), cmd[-1]]
+
+    def renice(self, pid: int, priority: int) -> None:
+        niceness = self.NICENESS.get(priority, 0)
+        if not niceness or not hasattr(os, "setpriority"):
+            return
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, niceness)
+        except OSError:
+            pass
+
+
+class RenderPool:
+    # Pillow renders run whole in worker processes, off the event loop and
+    # out of its GIL. The bot is multi-threaded by the time the pool starts,
+    # so workers come from a forkserver (or are spawned), never forked from it.
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                ),
+                # workers forked from one server would share a "random" colour
+                initializer=random.seed,
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args):
+        executor = self._get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, func, *args
+            )
+        except BrokenProcessPool:
+            # a worker died (usually the OOM killer); start over next time
+            if self._executor is executor:
+                self._executor = None
+            raise
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class TempStorageFull(Exception):
+    pass
+
+
+class TempLease:
+    # a scratch directory owned by one job, and the bytes reserved for it
+    def __init__(self, storage, path: Path, tier: str, user_id, kind: str):
+        self.storage = storage
+        self.path = path
+        self.tier = tier
+        self.user_id = user_id
+        self.kind = kind
+        self.reserved = 0
+        # bytes on disk as of the last refresh()
+        self.used = 0
+        self._measured = 0.0
+
+    def usage(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    async def refresh(self, max_age: float = 0) -> int:
+        # usage() walks the whole directory, so it runs off the event loop and
+        # at most once per max_age seconds
+        if time.monotonic() - self._measured >= max_age:
+            self._measured = time.monotonic()
+            self.used = await asyncio.to_thread(self.usage)
+        return self.used
+
+    def reserve(self, nbytes: int) -> None:
+        self.storage._admit(self, nbytes)
+        self.reserved += nbytes
+
+    def ensure(self, nbytes: int = 0) -> None:
+        # grow the reservation to cover what is on disk plus nbytes more
+        short = self.used + nbytes - self.reserved
+        if short > 0:
+            step = min(self.storage.step_bytes, self.storage.available(self))
+            self.reserve(max(short, step))
+
+    def headroom(self) -> int:
+        return max(0, self.reserved - self.used) + self.storage.available(self)
+
+    def trim(self) -> None:
+        # long-lived leases give back what they reserved beyond current use
+        self.reserved = min(self.reserved, self.used)
+
+    def release(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.storage._leases.discard(self)
+
+
+class TempStorage:
+    # Scratch space shared by every cog that writes media to disk. Jobs lease a
+    # directory on the tmpfs tier when their reservation is small enough and
+    # on disk otherwise; reservations count against a global and a per-user
+    # quota and against the tier's real free space, so a job that would not
+    # fit fails before writing anything.
+    LEASE_NAME = re.compile(r"^([a-z_]+)-(\d+)-[0-9a-f]{32}$")
+
+    def __init__(
+        self,
+        tiers: list,
+        max_bytes: int,
+        user_bytes: int,
+        step_bytes: int,
+        stale_seconds: int,
+    ):
+        self.tiers = tiers
+        self.max_bytes = max_bytes
+        self.user_bytes = user_bytes
+        self.step_bytes = step_bytes
+        self.stale_seconds = stale_seconds
+        self._leases: Set[TempLease] = set()
+        self.leased = 0
+        self.refused = 0
+        self.swept = 0
+
+    def _tier(self, name: str) -> tuple:
+        return next(tier for tier in self.tiers if tier[0] == name)
+
+    @staticmethod
+    def _free(root: Path, keep_free: int) -> int:
+        while not root.exists() and root != root.parent:
+            root = root.parent
+        try:
+            return shutil.disk_usage(root).free - keep_free
+        except OSError:
+            return 0
+
+    def reserved(self, user_id=None) -> int:
+        return sum(
+            lease.reserved
+            for lease in self._leases
+            if user_id is None or lease.user_id == user_id
+        )
+
+    def available(self, lease: TempLease) -> int:
+        _, root, keep_free, _ = self._tier(lease.tier)
+        room = min(self.max_bytes - self.reserved(), self._free(root, keep_free))
+        if lease.user_id is not None:
+            room = min(room, self.user_bytes - self.reserved(lease.user_id))
+        return max(0, room)
+
+    def _admit(self, lease: TempLease, nbytes: int) -> None:
+        room = self.available(lease)
+        if nbytes > room:
+            self.refused += 1
+            raise TempStorageFull(
+                f"Not enough temporary storage (needs {nbytes / 1024 / 1024:.1f} MB, "
+                f"{room / 1024 / 1024:.1f} MB available)"
+            )
+
+    def lease(self, kind: str, user_id=None, reserve: int = 0) -> TempLease:
+        for name, root, keep_free, max_lease in self.tiers:
+            if max_lease is not None and reserve > max_lease:
+                continue
+            if self._free(root, keep_free) >= reserve:
+                break
+        lease = TempLease(
+            self, root / f"{kind}-{os.getpid()}-{uuid.uuid4().hex}", name, user_id, kind
+        )
+        lease.reserve(reserve)
+        lease.path.mkdir(parents=True, exist_ok=True)
+        self._leases.add(lease)
+        self.leased += 1
+        return lease
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def sweep(self) -> int:
+        # Lease directories outlive a crash. Remove those whose process is gone,
+        # and our own that no live lease refers to once they are stale.
+        active = {lease.path for lease in self._leases}
+        removed = 0
+        for _, root, _, _ in self.tiers:
+            try:
+                entries = list(root.iterdir())
+            except OSError:
+                continue
+            for path in entries:
+                match = self.LEASE_NAME.match(path.name)
+                if not match or path in active:
+                    continue
+                pid = int(match.group(2))
+                if pid == os.getpid():
+                    try:
+                        stale = time.time() - path.stat().st_mtime > self.stale_seconds
+                    except OSError:
+                        continue
+                elif self._pid_alive(pid):
+                    continue
+                else:
+                    stale = True
+                if stale:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        self.swept += removed
+        return removed
+
+    def stats(self) -> dict:
+        tiers = {}
+        for name, root, keep_free, _ in self.tiers:
+            leases = [lease for lease in self._leases if lease.tier == name]
+            tiers[name] = {
+                "root": str(root),
+                "leases": len(leases),
+                "reserved": sum(lease.reserved for lease in leases),
+                "used": sum(lease.usage() for lease in leases),
+                "free": max(0, self._free(root, keep_free)),
+            }
+        return {
+            "tiers": tiers,
+            "reserved": self.reserved(),
+            "quota": self.max_bytes,
+            "users": len({lease.user_id for lease in self._leases} - {None}),
+            "leased": self.leased,
+            "refused": self.refused,
+            "swept": self.swept,
+        }
+
+
+async def _lease_fits(lease) -> bool:
+    # a cache's lease reserves what the cache holds on disk, so its files count
+    # against the shared temp quota; False once the quota has no room for them
+    await lease.refresh()
+    try:
+        lease.ensure()
+    except TempStorageFull:
+        return False
+    lease.trim()
+    return True
+
+
+class MediaDownloadCache(CacheStats):
+    DISCORD_CDN_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+    # attachment ids are unique, so the expiring signature can be dropped
+    SIGNED_PARAMS = ("ex", "is", "hm")
+
+    def __init__(self, storage, max_bytes: int, url_ttl: float = 300):
+        # downloads land in a lease of their own, so they count against the
+        # shared temp quota and no job's cleanup can remove them
+        super().__init__()
+        self.storage = storage
+        self.max_bytes = max_bytes
+        # other hosts may serve new content under the same URL, so their
+        # entries are only trusted for this long
+        self.url_ttl = url_ttl
+        self._lease = None
+        self._session = None
+        self._blobs: OrderedDict = OrderedDict()
+        self._urls: dict = {}
+        self._pending: dict = {}
+        # callers still to take their copy of a download too big to keep
+        self._waiters: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    @property
+    def root(self) -> Path:
+        if self._lease is None:
+            self._lease = self.storage.lease("downloads")
+        return self._lease.path
+
+    @classmethod
+    def normalize_url(cls, url: str) -> str:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        query = parsed.query
+        if host in cls.DISCORD_CDN_HOSTS:
+            query = urlencode(
+                [
+                    (k, v)
+                    for k, v in parse_qsl(query, keep_blank_values=True)
+                    if k not in cls.SIGNED_PARAMS
+                ]
+            )
+        # the query order is left alone; some servers read it positionally
+        return urlunparse((parsed.scheme.lower(), host, parsed.path, "", query, ""))
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def link(src: Path, dest: Path) -> None:
+        dest.unlink(missing_ok=True)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def _lookup(self, key: str):
+        digest, expires = self._urls.get(key, (None, None))
+        if expires is not None and time.monotonic() > expires:
+            # the blob stays; a refetch with the same bytes hashes back to it
+            del self._urls[key]
+            return None
+        entry = self._blobs.get(digest) if digest else None
+        if entry and entry[0].exists():
+            self._blobs.move_to_end(digest)
+            return entry[0]
+        return None
+
+    async def fetch(self, url: str, destination: Callable) -> tuple[Path, str]:
+        # destination(ext) names the caller's own file; every caller gets its
+        # own link or copy there, plus the sha256 of the content
+        key = self.normalize_url(url)
+        blob = self._lookup(key)
+        if blob:
+            self.hits += 1
+            return await self._hand_out(blob, destination), blob.stem
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._store(key, url))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._settle(key, task))
+        else:
+            self.hits += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            blob, _ = await asyncio.shield(task)
+            return await self._hand_out(blob, destination), blob.stem
+        finally:
+            self._waiters[task] -= 1
+            if task.done():
+                self._settle(key, task)
+
+    async def _hand_out(self, blob: Path, destination: Callable) -> Path:
+        dest = destination(blob.suffix[1:])
+        await asyncio.to_thread(self.link, blob, dest)
+        return dest
+
+    def _settle(self, key: str, task: asyncio.Task) -> None:
+        self._pending.pop(key, None)
+        if self._waiters.get(task):
+            return
+        self._waiters.pop(task, None)
+        if task.cancelled() or task.exception():
+            return
+        blob, kept = task.result()
+        if not kept:
+            # too big to keep, and every caller has its copy by now
+            blob.unlink(missing_ok=True)
+
+    async def _store(self, key: str, url: str) -> tuple[Path, bool]:
+        downloaded = await self._download(url)
+        digest = await asyncio.to_thread(self._hash_file, downloaded)
+        entry = self._blobs.get(digest)
+        if entry and entry[0].exists():
+            downloaded.unlink(missing_ok=True)
+        else:
+            size = downloaded.stat().st_size
+            if size > self.max_bytes:
+                return downloaded, False
+            blob = self.root / f"{digest}{downloaded.suffix}"
+            os.replace(downloaded, blob)
+            self._blobs[digest] = (blob, size)
+            self.total_bytes += size
+            self._evict()
+            if not await _lease_fits(self._lease):
+                # the shared quota has no room for it; hand it out once only
+                self._blobs.pop(digest)
+                self.total_bytes -= size
+                return blob, False
+        expires = None
+        if urlparse(key).netloc not in self.DISCORD_CDN_HOSTS:
+            expires = time.monotonic() + self.url_ttl
+        self._urls[key] = (digest, expires)
+        self._blobs.move_to_end(digest)
+        return self._blobs[digest][0], True
+
+    async def _download(self, url: str) -> Path:
+        partial = self.root / f"partial-{uuid.uuid4().hex}"
+        ydl_opts = {
+            "quiet": True,
+            "no_warnings": True,
+            "outtmpl": f"{partial}.%(ext)s",
+            "noplaylist": True,
+        }
+
+        def sync_ydl_download():
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=True)
+                return ydl.prepare_filename(info)
+
+        try:
+            downloaded = Path(await asyncio.to_thread(sync_ydl_download))
+            if downloaded.exists():
+                return downloaded
+        except Exception:
+            pass
+        for leftover in self.root.glob(f"{partial.name}.*"):
+            leftover.unlink(missing_ok=True)
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        downloaded = partial.with_suffix(Path(url.split("?")[0]).suffix)
+        async with self._session.get(url) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP Error {resp.status}")
+            try:
+                with downloaded.open("wb") as f:
+                    async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        f.write(chunk)
+            except BaseException:
+                downloaded.unlink(missing_ok=True)
+                raise
+        return downloaded
+
+    def _evict(self) -> None:
+        while len(self._blobs) > 1 and self.total_bytes > self.max_bytes:
+            _, (blob, size) = self._blobs.popitem(last=False)
+            self.total_bytes -= size
+            blob.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        if self._lease is not None:
+            self._lease.release()
+            self._lease = None
+        self._blobs.clear()
+        self._urls.clear()
+        self.total_bytes = 0
+
+    async def close(self) -> None:
+        for task in list(self._pending.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.clear()
+
+
+class StepCache(CacheStats):
+    # outputs of deterministic GScript steps, keyed by a hash of the command,
+    # its arguments and the content of its inputs
+    def __init__(self, storage, max_bytes: int):
+        super().__init__()
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self._lease = None
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry and entry[0].exists():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[2]
+        if entry:
+            self._entries.pop(key)
+            self.total_bytes -= entry[1]
+        self.misses += 1
+        return None
+
+    async def store(self, key: str, path: Path, intermediate: bool) -> None:
+        size = path.stat().st_size
+        if key in self._entries or size > self.max_bytes:
+            return
+        if self._lease is None:
+            self._lease = self.storage.lease("steps")
+        artifact = self._lease.path / f"{key}{path.suffix}"
+        await asyncio.to_thread(MediaDownloadCache.link, path, artifact)
+        self._entries[key] = (artifact, size, intermediate)
+        self.total_bytes += size
+        self._evict()
+        if not await _lease_fits(self._lease):
+            self._entries.pop(key)
+            self.total_bytes -= size
+            artifact.unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        while len(self._entries) > 1 and self.total_bytes > self.max_bytes:
+            _, (artifact, size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            artifact.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        if self._lease is not None:
+            self._lease.release()
+            self._lease = None
+        self._entries.clear()
+        self.total_bytes = 0
+
+
+def _image_nbytes(value) -> int:
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_image_nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_image_nbytes(v) for v in value)
+    return 0
+
+
+FFMPEG_SCHEDULER = FFmpegScheduler(
+    bot_info.data.get("ffmpeg_workers", os.cpu_count() or 4)
+)
+MEDIA_PROBE = MediaProbe(
+    max_entries=bot_info.data.get("ffprobe_cache_entries", 1024),
+    concurrency=bot_info.data.get("ffprobe_concurrency", 4),
+    persist_path=bot_info.data.get("ffprobe_cache_path"),
+)
+RENDER_POOL = RenderPool(bot_info.data.get("render_workers", os.cpu_count() or 2))
+_TEMP_TIERS = [
+    # (name, root, bytes kept free, largest reservation it accepts or None)
+    (
+        "disk",
+        Path(os.getenv("TEMP", "/tmp")) / "gman",
+        bot_info.data.get("temp_disk_min_free_mb", 1024) * 1024 * 1024,
+        None,
+    )
+]
+_TMPFS_DIR = bot_info.data.get("gscript_tmpfs_dir", "/dev/shm")
+if _TMPFS_DIR and os.path.isdir(_TMPFS_DIR) and os.access(_TMPFS_DIR, os.W_OK):
+    _TEMP_TIERS.insert(
+        0,
+        (
+            "tmpfs",
+            Path(_TMPFS_DIR) / "gman",
+            bot_info.data.get("gscript_tmpfs_min_free_mb", 2048) * 1024 * 1024,
+            bot_info.data.get("temp_tmpfs_lease_mb", 256) * 1024 * 1024,
+        ),
+    )
+TEMP_STORAGE = TempStorage(
+    _TEMP_TIERS,
+    max_bytes=bot_info.data.get("temp_quota_mb", 8192) * 1024 * 1024,
+    user_bytes=bot_info.data.get("temp_user_quota_mb", 2048) * 1024 * 1024,
+    step_bytes=bot_info.data.get("temp_reserve_step_mb", 64) * 1024 * 1024,
+    stale_seconds=bot_info.data.get("temp_stale_hours", 6) * 3600,
+)
+STEP_CACHE = StepCache(
+    TEMP_STORAGE,
+    max_bytes=bot_info.data.get("gscript_step_cache_mb", 1024) * 1024 * 1024,
+)
+MEDIA_DOWNLOAD_CACHE = MediaDownloadCache(
+    TEMP_STORAGE,
+    max_bytes=bot_info.data.get("media_download_cache_mb", 512) * 1024 * 1024,
+    url_ttl=bot_info.data.get("media_download_cache_ttl", 300),
+)
+TEXT_LAYER_CACHE = LRUCache(
+    max_entries=bot_info.data.get("text_layer_cache_entries", 64),
+    max_bytes=bot_info.data.get("text_layer_cache_mb", 128) * 1024 * 1024,
+    sizeof=_image_nbytes,
+)
+# expression string -> (compiled code or None, referenced names)
+EXPR_CACHE = LRUCache(max_entries=bot_info.data.get("expr_cache_entries", 1024))
+# every cache above, by the name the owner commands report it under
+MEDIA_CACHES = {
+    "downloads": MEDIA_DOWNLOAD_CACHE,
+    "gscript steps": STEP_CACHE,
+    "probes": MEDIA_PROBE,
+    "text layers": TEXT_LAYER_CACHE,
+    "expressions": EXPR_CACHE,
+}
@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# the cogs import bot_info and media_services from the repository root
+sys.path.insert(0, str(ROOT))
+
+if not Path("bot_info.json").exists():
+    # bot_info reads bot_info.json from the working directory; the template
+    # is enough for code that never logs in
+    workdir = tempfile.mkdtemp(prefix="gman-tests-")
+    shutil.copy(ROOT / "bot_info_template.json", Path(workdir) / "bot_info.json")
+    os.chdir(workdir)
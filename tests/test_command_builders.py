@@ -0,0 +1,453 @@
+# The ffmpeg commands GScript builds, checked argument by argument. ffmpeg never
+# runs: the processor's runner records each command and writes an empty output,
+# or three small PNG frames for an image sequence.
+import asyncio
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("discord")
+
+from PIL import Image  # noqa: E402
+
+import bot_info  # noqa: E402
+from cogs.tags import (  # noqa: E402
+    MEDIA_PROBE,
+    RENDER_POOL,
+    TEXT_LAYER_CACHE,
+    MediaProcessor,
+)
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    processor = MediaProcessor()
+    processor.ffmpeg_calls = []
+
+    async def exec_ffmpeg(cmd):
+        processor.ffmpeg_calls.append(cmd)
+        if "%08d" in cmd[-1]:
+            for idx in range(1, 4):
+                Image.new("RGB", (4, 4), (idx * 60, 0, 0)).save(cmd[-1] % idx)
+        else:
+            Path(cmd[-1]).touch()
+        return True, ""
+
+    monkeypatch.setattr(processor, "_exec_ffmpeg", exec_ffmpeg)
+    yield processor
+    asyncio.run(processor.cleanup())
+
+
+def add_media(processor, tmp_path, key, name):
+    path = tmp_path / name
+    path.write_bytes(b"media")
+    processor.media_cache[key] = str(path)
+    return path
+
+
+def arg(cmd, flag):
+    return cmd[cmd.index(flag) + 1]
+
+
+def plan(processor, script, keep=()):
+    lines = script.splitlines()
+    return asyncio.run(processor._plan_filter_chain(lines, 0, set(keep)))
+
+
+def test_fusible_steps_are_planned_as_one_chain(processor, tmp_path):
+    add_media(processor, tmp_path, "vid", "vid.mp4")
+    script = "contrast vid 1.3 a\nsaturate a 1.4 b\ninvert b c\ntrim c 0 1 d"
+    steps = plan(processor, script, keep={"d"})
+    assert [cmd for cmd, _ in steps] == ["contrast", "saturate", "invert"]
+    assert steps[-1][1]["output_key"] == "c"
+
+
+@pytest.mark.parametrize(
+    "name,script",
+    [
+        # "a" is read again after the chain, so it must be written
+        ("vid.mp4", "contrast vid 1.3 a\nsaturate a 1.4 b\noverlay b a 0 0 c"),
+        # expressions are evaluated per step against the media they run on
+        ("vid.mp4", "contrast vid 1.3 a\nresize a iw/2 ih/2 b"),
+        # the second step reads something other than the first one's output
+        ("vid.mp4", "contrast vid 1.3 a\nsaturate vid 1.4 b"),
+        # Pillow handles still images in-process
+        ("vid.png", "contrast vid 1.3 a\nsaturate a 1.4 b"),
+        # a GIF has no audio stream to filter
+        ("vid.gif", "invert vid a\nvolume a 0.5 b"),
+    ],
+    ids=["intermediate-read", "expression", "branch", "still-image", "no-audio"],
+)
+def test_chain_is_not_fused(processor, tmp_path, name, script):
+    add_media(processor, tmp_path, "vid", name)
+    assert plan(processor, script) == []
+
+
+def test_fused_chain_is_one_ffmpeg_run(processor, tmp_path):
+    source = add_media(processor, tmp_path, "vid", "vid.mp4")
+    steps = plan(
+        processor,
+        "contrast vid 1.3 a\nresize a 320.0 180 b\nvolume b 0.5 c\nfps c 15 d",
+    )
+    result = asyncio.run(processor._run_filter_chain_impl(steps))
+
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:4] == ["ffmpeg", "-hide_banner", "-i", source.as_posix()]
+    assert arg(cmd, "-vf") == "eq=contrast=1.3,scale=320:180,fps=15"
+    assert arg(cmd, "-af") == "volume=0.5"
+    assert result == f"media://{cmd[-1]}"
+    assert processor.media_cache["d"] == cmd[-1]
+
+
+def test_fused_chain_drops_its_intermediates(processor, tmp_path):
+    add_media(processor, tmp_path, "vid", "vid.mp4")
+    steps = plan(processor, "contrast vid 1.3 a\ninvert a b")
+    processor.memoise_steps = False
+    asyncio.run(processor._run_filter_chain(steps))
+    assert "a" not in processor.media_cache
+    assert arg(processor.ffmpeg_calls[0], "-vf") == "eq=contrast=1.3,negate"
+
+
+def foreachframe(processor, body, **kwargs):
+    return asyncio.run(
+        processor._foreachframe(
+            input_key="vid", output_key="out", sub_script=body, **kwargs
+        )
+    )
+
+
+def test_foreachframe_runs_fusible_bodies_as_one_filtergraph(processor, tmp_path):
+    source = add_media(processor, tmp_path, "vid", "vid.mp4")
+    result = foreachframe(processor, "contrast contrast_level=1.3\ninvert")
+
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:4] == ["ffmpeg", "-hide_banner", "-i", source.as_posix()]
+    assert arg(cmd, "-vf") == "eq=contrast=1.3,negate"
+    assert result == f"media://{processor.media_cache['out']}"
+
+
+@pytest.mark.parametrize(
+    "body,parallel",
+    [
+        ("tint red=200", True),
+        ("set shade frame_index*10\ntint red=shade", True),
+        ("tint red=200 output_key=tinted", False),
+    ],
+    ids=["auto-keys", "set", "named-output"],
+)
+def test_foreachframe_runs_frames_in_parallel(
+    processor, tmp_path, monkeypatch, body, parallel
+):
+    # frames only overlap when each step writes its own per-frame key
+    add_media(processor, tmp_path, "vid", "vid.gif")
+    monkeypatch.setitem(bot_info.data, "foreachframe_workers", 3)
+    running = []
+    peak = []
+    run_script = processor.execute_media_script
+
+    async def execute_media_script(script, **kwargs):
+        running.append(script)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        try:
+            return await run_script(script, **kwargs)
+        finally:
+            running.pop()
+
+    monkeypatch.setattr(processor, "execute_media_script", execute_media_script)
+    result = foreachframe(processor, body)
+
+    extract, encode = processor.ffmpeg_calls[0], processor.ffmpeg_calls[-1]
+    assert arg(extract, "-vsync") == "0" and extract[-1].endswith("frame_%08d.png")
+    frames = Path(arg(encode, "-i"))
+    assert sorted(p.name for p in frames.parent.iterdir()) == [
+        f"frame_{idx:08d}.png" for idx in range(3)
+    ]
+    assert "-map" not in encode
+    assert max(peak) == (3 if parallel else 1)
+    assert result == f"media://{processor.media_cache['out']}"
+    # parallel frames clean up their keys as they finish
+    leftover = any("_frame_" in key for key in processor.media_cache)
+    assert leftover is not parallel
+
+
+def stream(codec_type, **fields):
+    return {"codec_type": codec_type, **fields}
+
+
+H264 = stream("video", codec_name="h264", width=64, height=36, r_frame_rate="25/1")
+AAC = stream("audio", codec_name="aac", sample_rate="44100", channels=2)
+
+
+@pytest.fixture
+def media(processor, monkeypatch):
+    # what ffprobe would report, per file name; anything unnamed is a 10s clip
+    probes = {}
+    keyframes = {}
+
+    async def probe(path):
+        streams = probes.get(Path(path).name, [H264, AAC])
+        return True, {"format": {"duration": "10"}, "streams": streams}
+
+    async def keyframe_times(path):
+        return keyframes.get(path.name, [0.0])
+
+    monkeypatch.setattr(MEDIA_PROBE, "probe", probe)
+    monkeypatch.setattr(processor, "_keyframe_times", keyframe_times)
+    return probes, keyframes
+
+
+def trim(processor, start, end):
+    return asyncio.run(
+        processor._trim_media(
+            input_key="vid", start_time=start, end_time=end, output_key="out"
+        )
+    )
+
+
+def test_trim_on_a_keyframe_is_stream_copied(processor, tmp_path, media):
+    source = add_media(processor, tmp_path, "vid", "vid.mp4")
+    media[1]["vid.mp4"] = [0.0, 2.0, 4.0]
+    # within half a frame of the keyframe, so the cut snaps onto it
+    trim(processor, "2.01", "5")
+
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:7] == [
+        "ffmpeg",
+        "-hide_banner",
+        "-ss",
+        "2.000000",
+        "-i",
+        source.as_posix(),
+        "-t",
+    ]
+    assert arg(cmd, "-t") == "3.000000"
+    assert arg(cmd, "-c") == "copy"
+    assert arg(cmd, "-avoid_negative_ts") == "make_zero"
+    assert processor.media_cache["out"] == cmd[-1]
+
+
+def test_trim_between_keyframes_is_reencoded(processor, tmp_path, media):
+    source = add_media(processor, tmp_path, "vid", "vid.mp4")
+    media[1]["vid.mp4"] = [0.0, 2.0, 4.0]
+    trim(processor, "2.5", "5")
+
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:4] == ["ffmpeg", "-hide_banner", "-i", source.as_posix()]
+    assert (arg(cmd, "-ss"), arg(cmd, "-to")) == ("2.5", "5.0")
+    assert "copy" not in cmd
+
+
+def test_audio_trim_needs_no_keyframe(processor, tmp_path, media):
+    add_media(processor, tmp_path, "vid", "vid.mp3")
+    media[0]["vid.mp3"] = [AAC]
+    media[1]["vid.mp3"] = []
+    trim(processor, "2.5", "5")
+
+    (cmd,) = processor.ffmpeg_calls
+    assert (arg(cmd, "-ss"), arg(cmd, "-t"), arg(cmd, "-c")) == (
+        "2.500000",
+        "2.500000",
+        "copy",
+    )
+
+
+def concat(processor, *keys):
+    return asyncio.run(processor._concat_media(input_keys=list(keys), output_key="out"))
+
+
+def test_matching_streams_are_joined_by_the_concat_demuxer(processor, tmp_path, media):
+    first = add_media(processor, tmp_path, "a", "a.mp4")
+    second = add_media(processor, tmp_path, "b", "it's.mp4")
+    concat(processor, "a", "b")
+
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:6] == ["ffmpeg", "-hide_banner", "-f", "concat", "-safe", "0"]
+    assert arg(cmd, "-c") == "copy"
+    listing = Path(arg(cmd, "-i")).read_text(encoding="utf-8")
+    assert listing == "file '{}'\nfile '{}'\n".format(
+        first.resolve().as_posix(),
+        second.resolve().as_posix().replace("'", "'\\''"),
+    )
+    assert processor.media_cache["out"] == cmd[-1]
+
+
+@pytest.mark.parametrize(
+    "second,streams",
+    [
+        ("b.mp4", [dict(H264, width=128), AAC]),
+        ("b.mp4", [H264]),
+        ("b.mkv", [H264, AAC]),
+    ],
+    ids=["resolution", "missing-audio", "container"],
+)
+def test_mismatched_inputs_are_reencoded(processor, tmp_path, media, second, streams):
+    add_media(processor, tmp_path, "a", "a.mp4")
+    add_media(processor, tmp_path, "b", second)
+    media[0][second] = streams
+    concat(processor, "a", "b")
+
+    (cmd,) = processor.ffmpeg_calls
+    assert "concat" not in cmd[:4]
+    assert "-filter_complex" in cmd
+    assert "copy" not in cmd
+
+
+def test_dobetween_decodes_only_the_keyframe_window(processor, tmp_path, media):
+    source = add_media(processor, tmp_path, "vid", "vid.mp4")
+    media[1]["vid.mp4"] = [0.0, 2.0, 4.0, 6.0, 8.0]
+    asyncio.run(
+        processor._dobetween_media_impl(
+            input_key="vid",
+            start_time="4.5",
+            end_time="5.5",
+            output_key="out",
+            segment_key="seg",
+        )
+    )
+
+    cuts = {
+        tuple(cmd[2:4] + cmd[6:8]): cmd
+        for cmd in processor.ffmpeg_calls
+        if cmd[4:6] == ["-i", source.as_posix()]
+    }
+    # the edit sits between the keyframes at 4s and 6s
+    assert set(cuts) == {
+        ("-ss", "0.000000", "-t", "4.000000"),
+        ("-ss", "4.000000", "-t", "2.000000"),
+        ("-ss", "6.000000", "-c", "copy"),
+    }
+    assert all(arg(cmd, "-c") == "copy" for cmd in cuts.values())
+    window = cuts[("-ss", "4.000000", "-t", "2.000000")][-1]
+    decoded = [cmd for cmd in processor.ffmpeg_calls if "copy" not in cmd]
+    assert decoded and all(arg(cmd, "-i") == window for cmd in decoded)
+
+    final = processor.ffmpeg_calls[-1]
+    assert arg(final, "-f") == "concat"
+    listing = Path(arg(final, "-i")).read_text(encoding="utf-8").splitlines()
+    head = processor.media_cache["seg_head"]
+    tail = processor.media_cache["seg_tail"]
+    assert listing[0] == f"file '{Path(head).resolve().as_posix()}'"
+    assert listing[-1] == f"file '{Path(tail).resolve().as_posix()}'"
+    assert len(listing) == 3
+    assert processor.media_cache["out"] == final[-1]
+
+
+@pytest.mark.parametrize(
+    "name,size,pad_top,graph,output_args",
+    [
+        (
+            "vid.gif",
+            (64, 36),
+            0,
+            "[0:v][1:v]overlay=0:0,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse"
+            "[outv]",
+            ["-f", "gif", "-gifflags", "+transdiff"],
+        ),
+        (
+            "vid.gif",
+            (64, 36),
+            11,
+            "[0:v]pad=width=64:height=47:y=11:color=black[padded];[padded][1:v]"
+            "overlay=0:0,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse[outv]",
+            ["-f", "gif", "-gifflags", "+transdiff"],
+        ),
+        (
+            # yuv420p needs even dimensions
+            "vid.mp4",
+            (63, 36),
+            11,
+            "[0:v]pad=width=64:height=48:y=11:color=black[padded];[padded][1:v]"
+            "overlay=0:0[outv]",
+            ["-map", "0:a?", "-c:a", "copy", "-pix_fmt", "yuv420p"],
+        ),
+        (
+            "vid.webp",
+            (64, 36),
+            0,
+            "[0:v][1:v]overlay=0:0[outv]",
+            ["-c:v", "libwebp", "-lossless", "0", "-compression_level", "6"]
+            + ["-loop", "0", "-f", "webp"],
+        ),
+    ],
+    ids=["gif", "gif-padded", "video-padded", "webp"],
+)
+def test_layer_overlay_is_one_filtergraph(
+    processor, name, size, pad_top, graph, output_args
+):
+    cmd = processor._layer_overlay_cmd(
+        Path(name), Path("layer.png"), Path("out") / name, size, pad_top=pad_top
+    )
+    assert cmd[:6] == ["ffmpeg", "-hide_banner", "-i", name, "-i", "layer.png"]
+    assert arg(cmd, "-filter_complex") == graph
+    assert cmd[8:] == ["-map", "[outv]", *output_args, "-y", f"out/{name}"]
+
+
+@pytest.fixture
+def renders(processor, monkeypatch):
+    # stands in for the Pillow render workers: each job writes a blank layer
+    jobs = []
+
+    async def run(func, *args):
+        jobs.append((func.__name__, args))
+        if func.__name__ == "_render_caption_job":
+            Image.new("RGBA", (args[2][0], 11)).save(args[0])
+            return 11, True
+        Image.new("RGBA", args[4]).save(args[1])
+        return None, True
+
+    async def finish_text_spec(spec, font_name, fetch_emoji=True):
+        spec["font_path"] = None
+        spec["emoji"] = {}
+
+    TEXT_LAYER_CACHE.clear()
+    monkeypatch.setattr(RENDER_POOL, "run", run)
+    monkeypatch.setattr(processor, "_finish_text_spec", finish_text_spec)
+    yield jobs
+    TEXT_LAYER_CACHE.clear()
+
+
+@pytest.mark.parametrize("name", ["vid.gif", "vid.mp4"])
+def test_text_on_animated_media_is_one_overlay_pass(
+    processor, tmp_path, media, renders, name
+):
+    source = add_media(processor, tmp_path, "vid", name)
+    result = asyncio.run(
+        processor._text_impl(
+            input_key="vid",
+            output_key="out",
+            text="hello",
+            font="Arial",
+            font_size=12,
+            color="#FFFFFF",
+        )
+    )
+
+    # only the text layer is drawn; the frames never leave ffmpeg
+    ((job, args),) = renders
+    assert job == "_render_text_job"
+    assert args[0] is None and args[4] == (64, 36)
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:6] == ["ffmpeg", "-hide_banner", "-i", str(source), "-i", args[1]]
+    assert arg(cmd, "-filter_complex").startswith("[0:v][1:v]overlay=0:0")
+    assert Path(cmd[-1]).suffix == source.suffix
+    assert result == f"media://{processor.media_cache['out']}"
+
+
+def test_caption_on_animated_media_is_one_overlay_pass(
+    processor, tmp_path, media, renders
+):
+    source = add_media(processor, tmp_path, "vid", "vid.gif")
+    asyncio.run(
+        processor._apply_caption_impl(input_key="vid", output_key="out", text="hi")
+    )
+
+    ((job, args),) = renders
+    assert job == "_render_caption_job" and args[2] == (64, 36)
+    (cmd,) = processor.ffmpeg_calls
+    assert cmd[:6] == ["ffmpeg", "-hide_banner", "-i", str(source), "-i", args[0]]
+    assert arg(cmd, "-filter_complex") == (
+        "[0:v]pad=width=64:height=47:y=11:color=black[padded];[padded][1:v]"
+        "overlay=0:0,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse[outv]"
+    )
+    assert processor.media_cache["out"] == cmd[-1]
@@ -0,0 +1,96 @@
+# Downloads are shared between processors: every caller gets a file of its own,
+# and nothing is left behind in the cache's lease once callers have theirs.
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("discord")
+
+from media_services import MediaDownloadCache, TempStorage  # noqa: E402
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return TempStorage(
+        [("disk", tmp_path / "temp", 0, None)],
+        max_bytes=1 << 30,
+        user_bytes=1 << 30,
+        step_bytes=1 << 20,
+        stale_seconds=3600,
+    )
+
+
+def make_cache(storage, max_bytes, content=b"media"):
+    cache = MediaDownloadCache(storage, max_bytes=max_bytes, url_ttl=300)
+    calls = []
+
+    async def download(url):
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        path = cache.root / f"partial-{uuid.uuid4().hex}.mp4"
+        path.write_bytes(content)
+        return path
+
+    cache._download = download
+    return cache, calls
+
+
+def fetch_all(cache, urls, dest_dir):
+    dest_dir.mkdir(exist_ok=True)
+
+    def destination(ext):
+        return dest_dir / f"{uuid.uuid4().hex}.{ext}"
+
+    async def run():
+        return await asyncio.gather(*(cache.fetch(url, destination) for url in urls))
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("max_bytes", [1024, 1], ids=["cached", "oversize"])
+def test_concurrent_fetches_get_their_own_files(storage, tmp_path, max_bytes):
+    cache, calls = make_cache(storage, max_bytes)
+    results = fetch_all(cache, ["https://example.com/a.mp4"] * 3, tmp_path / "jobs")
+    paths = [path for path, _ in results]
+    assert len(calls) == 1
+    assert len(set(paths)) == 3
+    assert all(path.read_bytes() == b"media" for path in paths)
+    assert len({digest for _, digest in results}) == 1
+    # a copy too big to keep goes away once every caller has its own
+    assert len(list(cache.root.iterdir())) == (1 if max_bytes > 1 else 0)
+
+
+def test_cached_blob_is_reused_and_counted(storage, tmp_path):
+    cache, calls = make_cache(storage, 1024)
+    fetch_all(cache, ["https://example.com/a.mp4"], tmp_path / "one")
+    fetch_all(cache, ["https://example.com/a.mp4"], tmp_path / "two")
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache._lease.reserved == len(b"media")
+    cache.clear()
+    assert storage.reserved() == 0
+
+
+def test_url_ttl_expires_non_cdn_urls(storage, tmp_path):
+    cache, calls = make_cache(storage, 1024)
+    fetch_all(cache, ["https://example.com/a.mp4"], tmp_path / "one")
+    cache.url_ttl = -1
+    fetch_all(cache, ["https://example.com/b.mp4"], tmp_path / "two")
+    fetch_all(cache, ["https://example.com/b.mp4"], tmp_path / "three")
+    assert len(calls) == 3
+    # refetched bytes hash back to the blob already held
+    assert cache.stats()["entries"] == 1
+
+
+def test_normalize_url_keeps_query_order():
+    assert (
+        MediaDownloadCache.normalize_url("https://Example.com/v?b=1&a=2")
+        == "https://example.com/v?b=1&a=2"
+    )
+    assert (
+        MediaDownloadCache.normalize_url(
+            "https://cdn.discordapp.com/attachments/1/2/a.png?ex=1&is=2&hm=3&x=4"
+        )
+        == "https://cdn.discordapp.com/attachments/1/2/a.png?x=4"
+    )
@@ -0,0 +1,172 @@
+# Static code blocks are sent to g-coder in one /batch/execute request; the
+# reply is a multipart stream with the results first and each job's files after.
+import asyncio
+import importlib.util
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("fastapi")
+
+import aiohttp  # noqa: E402
+from aiohttp.base_protocol import BaseProtocol  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from cogs.tags import (  # noqa: E402
+    ExecFileRegistry,
+    TagFormatter,
+    Tags,
+    _read_exec_batch,
+)
+
+SERVER = Path(__file__).resolve().parent.parent / "g-coder" / "server" / "app.py"
+
+
+@pytest.fixture
+def gcoder(tmp_path, monkeypatch):
+    spec = importlib.util.spec_from_file_location("gcoder_app", SERVER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "EXECUTION_BASE", tmp_path / "gcoder")
+    monkeypatch.setattr(module, "STAGING_BASE", tmp_path / "gcoder" / "staging")
+    return module
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setenv("TEMP", str(tmp_path))
+    registry = ExecFileRegistry()
+    yield registry
+    registry.cleanup()
+
+
+def post_batch(gcoder, jobs, files=(), registry_keys=()):
+    client = TestClient(gcoder.app)
+    return client.post(
+        "/batch/execute",
+        data={"jobs": json.dumps(jobs), "registry_keys": json.dumps(registry_keys)},
+        files=[("files", file) for file in files],
+    )
+
+
+def read_batch(response, registry):
+    async def read():
+        stream = aiohttp.StreamReader(BaseProtocol(asyncio.get_running_loop()), 2**16)
+        stream.feed_data(response.content)
+        stream.feed_eof()
+        reader = aiohttp.MultipartReader(response.headers, stream)
+        return await _read_exec_batch(reader, registry)
+
+    return asyncio.run(read())
+
+
+def test_batch_round_trip(gcoder, registry):
+    jobs = [
+        {"language": "bash", "code": "printf one > output/out.txt; echo first"},
+        {
+            # FILE_1 is the attachment, FILE_2 the first job's output
+            "language": "bash",
+            "code": 'cat "$FILE_1" > \'output/a "b" é.txt\'; cat "$FILE_2"',
+        },
+    ]
+    response = post_batch(gcoder, jobs, [("in.txt", b"attached")])
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("multipart/mixed")
+
+    (first, first_files), (second, second_files) = read_batch(response, registry)
+    assert (first["output"], first["error"]) == ("first", False)
+    assert second["output"] == "one"
+    assert [name for name, _ in first_files] == ["out.txt"]
+    assert [name for name, _ in second_files] == ['a "b" é.txt']
+    assert first_files[0][1].read_bytes() == b"one"
+    assert second_files[0][1].read_bytes() == b"attached"
+    # staged outputs go once the response has been streamed
+    assert list(gcoder.STAGING_BASE.iterdir()) == []
+
+
+def test_batch_registry_keys_map_trailing_uploads(gcoder, registry):
+    jobs = [{"language": "bash", "code": 'cat "$FILE_2"'}]
+    files = [("attachment.txt", b"attachment"), ("registry.txt", b"registry")]
+    response = post_batch(gcoder, jobs, files, ["FILE_1"])
+    ((result, files),) = read_batch(response, registry)
+    assert result["output"] == "registry"
+    assert files == []
+
+
+@pytest.mark.parametrize(
+    "jobs",
+    [[], [{"language": "cobol", "code": ""}], [{"language": "bash"}]],
+    ids=["empty", "language", "code"],
+)
+def test_batch_rejects_invalid_jobs(gcoder, jobs):
+    assert post_batch(gcoder, jobs).status_code == 400
+
+
+def test_batch_response_encodes_filenames(gcoder):
+    stage = gcoder.STAGING_BASE / "batch_x" / "0"
+    stage.mkdir(parents=True)
+    (stage / 'a"\r\nb.txt').write_bytes(b"data")
+    batch = {
+        "job_id": "batch_x",
+        "results": [{"output": "", "files": ['a"\r\nb.txt'], "error": False}],
+    }
+    response = gcoder.multipart_batch_response(batch)
+
+    async def body():
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    content = asyncio.run(body())
+    assert b"filename*=UTF-8''a%22%0D%0Ab.txt" in content
+    assert content.count(b"\r\n--") == 2
+
+
+def collect(content):
+    tags = Tags.__new__(Tags)
+    tags.formatter = TagFormatter()
+    return tags._collect_exec_batch(content)
+
+
+@pytest.mark.parametrize(
+    "content,batched",
+    [
+        ("{python:print(1)} and {bash:echo 2}", 2),
+        ("{set:x|1}{python:print(1)}{bash:echo 2}", 0),
+        ("{python:print(1)}{bash:echo 2}{set:x|1}{python:print(3)}", 2),
+        ("{python:print(1)}{bash:echo {get:x}}{python:print(3)}", 0),
+        ("{python:print(1)}{bash:echo 2}{gscript:render x}", 0),
+    ],
+    ids=["static", "after-tag", "prefix", "dynamic", "gscript"],
+)
+def test_only_leading_static_blocks_are_batched(content, batched):
+    assert len(collect(content)) == batched
+
+
+def test_unconsumed_batch_files_are_deleted(tmp_path):
+    spooled = tmp_path / "spooled.txt"
+    spooled.write_bytes(b"output")
+    formatter = TagFormatter()
+
+    async def batch_executor(ctx, content):
+        return [(("python", "print(1)"), ({"output": ""}, [("out.txt", spooled)]))]
+
+    formatter.batch_executor = batch_executor
+    text, *_ = asyncio.run(formatter.format("no code here", None))
+    assert text == "no code here"
+    assert not spooled.exists()
+
+
+def test_exec_form_closes_registry_files(registry):
+    path = registry.spool_path("out.txt")
+    path.write_bytes(b"output")
+    registry["FILE_1"] = (path, "out.txt")
+    tags = Tags.__new__(Tags)
+    tags._exec_file_registry = registry
+    ctx = SimpleNamespace(message=SimpleNamespace(attachments=[]))
+
+    with tags._exec_form(ctx) as data:
+        handles = [value for _, _, value in data._fields]
+        assert [handle.closed for handle in handles] == [False]
+    assert [handle.closed for handle in handles] == [True]
@@ -0,0 +1,41 @@
+# The benchmark runs outside the bot so CI can keep its JSON reports.
+import json
+import shutil
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("psutil")
+if not shutil.which("ffmpeg"):
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+import gscriptbench  # noqa: E402
+
+
+def test_report_is_written(tmp_path, capsys):
+    output = tmp_path / "report.json"
+    assert gscriptbench.main(["--only", "invert", "--output", str(output)]) == 0
+
+    report = json.loads(output.read_text())
+    assert list(report["cases"]) == ["invert"]
+    case = report["cases"]["invert"]
+    assert case["ok"] and case["output_bytes"] > 0
+    assert report["commit"]
+    assert capsys.readouterr().err.startswith("invert ")
+
+
+def test_baseline_change_is_summarised():
+    report = {
+        "cases": {"invert": {"ok": True, "wall": 1.5, "cpu": 1, "peak_rss": 0}},
+        "uncovered": ["load"],
+    }
+    report["cases"]["invert"].update(temp_peak=0, ffmpeg_runs=1)
+    baseline = {"cases": {"invert": {"wall": 1.0}}}
+    lines = gscriptbench.summary(report, baseline)
+    assert lines[0].endswith("+50%")
+    assert lines[1] == "not covered: load"
+
+
+def test_unknown_case_is_an_error(capsys):
+    assert gscriptbench.main(["--only", "nothing-matches"]) == 2
+    assert "nothing-matches" in capsys.readouterr().err
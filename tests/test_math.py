@@ -0,0 +1,190 @@
+# {math} evaluates plain arithmetic in-process and hands everything else to a
+# long-lived qalc worker, falling back to a one-shot qalc run.
+import asyncio
+import os
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip("discord")
+
+from cogs import tags  # noqa: E402
+from cogs.tags import MathEvaluator, MathFallback, QalcWorker  # noqa: E402
+
+# answers every expression with "<expr> = 42" and echoes the worker's numeric
+# sentinels back like qalc does; "crash" makes it exit
+FAKE_QALC = f"""\
+#!{sys.executable}
+import sys
+
+def answer(expr):
+    if expr == "crash":
+        sys.exit(1)
+    return expr if expr.isdigit() else f"{{expr}} = 42"
+
+if len(sys.argv) > 2:
+    print(answer(sys.argv[2]))
+    sys.exit(0)
+for line in sys.stdin:
+    print(answer(line.strip()), flush=True)
+"""
+
+
+@pytest.fixture
+def evaluator():
+    return MathEvaluator(cache_entries=16)
+
+
+@pytest.fixture
+def qalc(tmp_path, monkeypatch):
+    path = tmp_path / "qalc"
+    path.write_text(textwrap.dedent(FAKE_QALC))
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return path
+
+
+@pytest.mark.parametrize(
+    "expr,expected",
+    [
+        ("2+3*4", "14"),
+        ("2^10", "1024"),
+        ("7/2", "3.5"),
+        ("-(3 − 5) × 2 ÷ 4", "1"),
+        ("sqrt(16) + abs(-2)", "6"),
+        ("2**4000", "1.318204093E1204"),
+        ("factorial(20)", "2432902008176640000"),
+    ],
+)
+def test_evaluates_arithmetic(evaluator, expr, expected):
+    assert evaluator.evaluate(expr) == expected
+
+
+@pytest.mark.parametrize(
+    "expr",
+    [
+        "__import__('os')",
+        "(1).real",
+        "[1, 2]",
+        "x + 1",
+        "True + 1",
+        "'a' * 3",
+        "1 if 1 else 2",
+        "sqrt(x=4)",
+        "2 // 3",
+        "1 < 2",
+    ],
+)
+def test_only_whitelisted_syntax_is_evaluated(evaluator, expr):
+    with pytest.raises(MathFallback):
+        evaluator.evaluate(expr)
+
+
+@pytest.mark.parametrize(
+    "expr",
+    [
+        "2**5000",
+        "9^9^9",
+        "10.5**1000",
+        "factorial(501)",
+        "(-8)**(1/3)",
+        "1/0",
+        "1" + "+1" * 300,
+        "+".join(["1"] * 150),
+        "50%",
+    ],
+    ids=[
+        "exponent",
+        "tower",
+        "float-exponent",
+        "factorial",
+        "negative-root",
+        "division",
+        "length",
+        "nodes",
+        "percent",
+    ],
+)
+def test_limits_hand_off_to_qalc(evaluator, expr):
+    with pytest.raises(MathFallback):
+        evaluator.evaluate(expr)
+
+
+@pytest.mark.parametrize(
+    "expr,expected",
+    [("round(2.5)", "3"), ("round(-2.5)", "-3"), ("round(2.4)", "2")],
+)
+def test_round_halves_away_from_zero(evaluator, expr, expected):
+    # Python's round() goes to even and would answer 2 and -2
+    assert evaluator.evaluate(expr) == expected
+
+
+@pytest.mark.parametrize(
+    "expr,expected",
+    [("5 km to m", "5000 m"), ("1 GiB in MiB", "1024 MiB"), ("90 min -> h", "1.5 h")],
+)
+def test_converts_known_units(evaluator, expr, expected):
+    assert evaluator.evaluate(expr) == expected
+
+
+@pytest.mark.parametrize("expr", ["5 km to kg", "3 furlong to m"])
+def test_unknown_conversions_hand_off_to_qalc(evaluator, expr):
+    with pytest.raises(MathFallback):
+        evaluator.evaluate(expr)
+
+
+def test_evaluate_math_falls_back_to_qalc(qalc, monkeypatch):
+    worker = QalcWorker(timeout=5)
+    monkeypatch.setattr(tags, "QALC_WORKER", worker)
+
+    async def main():
+        try:
+            return [
+                await tags.evaluate_math(" 2+2 "),
+                await tags.evaluate_math("3 furlong to m"),
+                # commands are never sent to the shared worker
+                await tags.evaluate_math("set precision 5"),
+            ]
+        finally:
+            await worker.close()
+
+    assert asyncio.run(main()) == ["4", "3 furlong to m = 42", "set precision 5 = 42"]
+    assert worker.accepts("2 furlong") and not worker.accepts("set precision 5")
+
+
+def test_worker_restarts_after_a_crash(qalc):
+    worker = QalcWorker(timeout=5)
+
+    async def main():
+        try:
+            first = await worker.evaluate("1 furlong")
+            pid = worker.proc.pid
+            with pytest.raises(ConnectionResetError):
+                await worker.evaluate("crash")
+            assert worker.proc is None and not worker.disabled
+            second = await worker.evaluate("2 furlong")
+            return first, second, pid != worker.proc.pid
+        finally:
+            await worker.close()
+
+    assert asyncio.run(main()) == ("1 furlong = 42", "2 furlong = 42", True)
+
+
+def test_worker_that_never_answers_is_disabled(qalc):
+    worker = QalcWorker(timeout=5)
+
+    async def main():
+        with pytest.raises(ConnectionResetError):
+            await worker.evaluate("crash")
+
+    asyncio.run(main())
+    assert worker.disabled
+    assert not worker.accepts("1 furlong")
+
+
+def test_missing_qalc_is_reported(monkeypatch, tmp_path):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    monkeypatch.setattr(tags, "QALC_WORKER", QalcWorker(timeout=5))
+    result = asyncio.run(tags.evaluate_math("3 furlong to m"))
+    assert result == "[math error: qalc not installed]"
@@ -0,0 +1,30 @@
+# Probe results are shared by every cog; only successful ones are remembered.
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+
+from media_services import MediaProbe  # noqa: E402
+
+
+def test_failed_probe_is_retried(tmp_path):
+    media = tmp_path / "clip.mp4"
+    media.write_bytes(b"not yet complete")
+    probe = MediaProbe(max_entries=8)
+    results = [(False, "Error: FFprobe error"), (True, {"streams": []})]
+    runs = []
+
+    async def run(target):
+        runs.append(target)
+        return results[len(runs) - 1]
+
+    probe._run = run
+
+    async def main():
+        return [await probe.probe(str(media)) for _ in range(3)]
+
+    first, second, third = asyncio.run(main())
+    assert first == results[0]
+    assert second == third == results[1]
+    assert len(runs) == 2
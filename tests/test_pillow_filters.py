@@ -0,0 +1,91 @@
+# The Pillow backend stands in for ffmpeg on still images, so its output has
+# to stay close to what the ffmpeg command would have written.
+import math
+import random
+import shutil
+import subprocess
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+pytest.importorskip("discord")
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+from cogs.tags import MediaProcessor  # noqa: E402
+
+SEPIA = "colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131"
+TINT = "lutrgb=r=255*val/maxval:g=128*val/maxval:b=64*val/maxval:a=255*val/maxval"
+
+# command, parameters, the filter the ffmpeg path runs, minimum PSNR in dB
+CASES = [
+    ("contrast", {"contrast_level": 1.5}, "eq=contrast=1.5", 50),
+    ("contrast", {"contrast_level": -2}, "eq=contrast=-2", 50),
+    ("contrast", {"contrast_level": 9}, "eq=contrast=9", 50),
+    ("brightness", {"brightness_level": 0.2}, "eq=brightness=0.2", 50),
+    ("brightness", {"brightness_level": -0.3}, "eq=brightness=-0.3", 50),
+    ("gamma", {"gamma_level": 2}, "eq=gamma=2", 50),
+    ("gamma", {"gamma_level": 0.5}, "eq=gamma=0.5", 50),
+    ("saturate", {"saturation_level": 2}, "eq=saturation=2", 45),
+    ("saturate", {"saturation_level": 0}, "eq=saturation=0", 45),
+    ("grayscale", {}, "format=gray", 45),
+    ("sepia", {}, SEPIA, 45),
+    ("invert", {}, "negate", 50),
+    ("tint", {"red": 255, "green": 128, "blue": 64}, TINT, 50),
+    ("resize", {"width": 64, "height": 48}, "scale=64:48", 33),
+    ("crop", {"x": 10, "y": 20, "width": 50, "height": 40}, "crop=50:40:10:20", 50),
+    ("rotate", {"angle": 0.5}, "rotate=0.5", 40),
+    ("rotate", {"angle": -2.2}, "rotate=-2.2", 40),
+]
+
+
+@pytest.fixture(scope="module", params=["RGB", "RGBA", "L", "LA"])
+def source(request, tmp_path_factory):
+    # gradients with noise on top, so both flat areas and edges are covered
+    rng = random.Random(1)
+    width, height = 128, 96
+    image = Image.new("RGBA", (width, height))
+    image.putdata(
+        [
+            tuple(
+                min(max(int(v + rng.gauss(0, 20)), 0), 255)
+                for v in (x * 2, y * 2.6, (x + y) * 1.1)
+            )
+            + ((x * 2) % 256,)
+            for y in range(height)
+            for x in range(width)
+        ]
+    )
+    path = tmp_path_factory.mktemp("src") / f"{request.param}.png"
+    image.convert(request.param).save(path)
+    return path
+
+
+def _psnr(a: Image.Image, b: Image.Image) -> float:
+    mode = "RGBA" if "A" in a.mode + b.mode else "RGB"
+    if a.mode == b.mode == "L":
+        mode = "L"
+    diff = ImageChops.difference(a.convert(mode), b.convert(mode))
+    worst = max(ImageStat.Stat(diff).rms)
+    return 100.0 if worst == 0 else 20 * math.log10(255 / worst)
+
+
+@pytest.mark.parametrize(
+    "cmd,params,vf,threshold", CASES, ids=[case[2] for case in CASES]
+)
+def test_matches_ffmpeg(source, tmp_path, cmd, params, vf, threshold):
+    expected = tmp_path / "ffmpeg.png"
+    extra = ["-pix_fmt", "yuv420p"] if cmd == "tint" else []
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(source), "-vf", vf]
+        + extra
+        + ["-y", str(expected)],
+        check=True,
+    )
+    with Image.open(source) as image:
+        image.load()
+        result = MediaProcessor._pillow_filter(cmd, image, dict(params))
+    with Image.open(expected) as reference:
+        reference.load()
+        assert result.size == reference.size
+        assert _psnr(result, reference) >= threshold
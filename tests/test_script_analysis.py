@@ -0,0 +1,93 @@
+# GScript is checked before anything runs: unknown keys are reported and
+# steps whose results are never used are dropped.
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+
+from cogs.tags import MediaProcessor  # noqa: E402
+
+
+@pytest.fixture
+def processor():
+    processor = MediaProcessor()
+    processor.media_cache["vid"] = "/nonexistent/vid.mp4"
+    return processor
+
+
+def analyse(processor, script: str, keep_keys=()):
+    lines = [line.strip() for line in script.splitlines() if line.strip()]
+    return asyncio.run(processor._analyse_script(lines, set(keep_keys)))
+
+
+def test_unknown_key_is_reported(processor):
+    problems, _ = analyse(processor, "invert missing out\nrender out")
+    assert problems == ["Error: line 1: unknown media key 'missing'"]
+
+
+def test_unused_step_is_dead(processor):
+    problems, dead = analyse(
+        processor,
+        """
+        invert vid unused
+        contrast vid 1.5 out
+        render out
+        """,
+    )
+    assert problems == []
+    assert dead == {0}
+
+
+@pytest.mark.parametrize(
+    "body",
+    ["invert segment_main tmp", "invert input_key=segment_main output_key=tmp"],
+    ids=["positional", "named"],
+)
+def test_dobetween_body_outputs_are_defined(processor, body):
+    problems, dead = analyse(
+        processor,
+        f"""
+        dobetween vid 1 2 out
+        {body}
+        end
+        render tmp
+        """,
+    )
+    assert problems == []
+    assert dead == set()
+
+
+def test_block_outputs_follow_how_the_block_runs(processor):
+    dobetween = asyncio.run(
+        processor._block_outputs(
+            "dobetween", ["invert segment_main tmp", "contrast contrast_level=2"]
+        )
+    )
+    # foreachframe names every step's output itself unless output_key= is given
+    foreachframe = asyncio.run(
+        processor._block_outputs(
+            "foreachframe",
+            ["invert a b", "contrast contrast_level=2 output_key=kept", "set v 1"],
+        )
+    )
+    assert dobetween == {"tmp"}
+    assert foreachframe == {"kept"}
+
+
+@pytest.mark.parametrize(
+    "body,memoised",
+    [
+        (["contrast contrast_level=2"], True),
+        (["invert segment_main tmp"], False),
+        (["contrast contrast_level=2 output_key=tmp"], False),
+    ],
+    ids=["scratch-only", "positional-write", "named-write"],
+)
+def test_block_memoised_only_without_side_outputs(processor, tmp_path, body, memoised):
+    # a cache hit restores just the block's output key
+    source = tmp_path / "vid.mp4"
+    source.write_bytes(b"video")
+    processor.media_cache["vid"] = str(source)
+    key = asyncio.run(processor._block_key("dobetween vid 1 2 out", body, {}, "out"))
+    assert (key is not None) is memoised